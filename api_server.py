@@ -5,48 +5,77 @@ api_server.py — KuyProxy HTTP API Server
 Berjalan di port 8080 (lokal), di-tunnel ke VPS via FRP.
 Digunakan oleh Web Dashboard untuk kontrol HP dari jauh.
 
+Server multi-thread: aksi lama (start/stop/reset/rotate) jalan sebagai
+job di background dan langsung membalas {"job": id}; /status dibaca dari
+cache yang di-refresh thread monitor, jadi /ping tidak ikut tertahan.
+
 Endpoints:
   GET  /ping          → health check
-  GET  /status        → status lengkap
-  GET  /start         → start proxy services
-  GET  /stop          → stop proxy services
-  GET  /rotate?user=N → rotate IP user ke-N
-  GET  /reset         → airplane mode full reset
-  GET  /logs?n=100    → ambil N baris log terakhir
+  GET  /status        → status lengkap (cache, maks STATUS_INTERVAL detik)
+  GET  /start         → start proxy services (job)
+  GET  /stop          → stop proxy services (job)
+  GET  /reload        → reload config & IP pool proxy (SIGHUP, tanpa putus)
+  GET  /upgrade       → ganti proses proxy, tunnel lama di-drain (SIGUSR2)
+  GET  /rotate?user=N[&grace=S]      → rotate IP user ke-N (job, make-before-break)
+  GET  /rotate?users=1,5,7|all       → rotate banyak user sekaligus (job)
+  GET  /jobs[?id=J]   → status job
+  GET  /schedule[?every=M&bytes=B&conns=C&users=1,2|all]
+                      → lihat / ubah policy rotasi otomatis
+  GET  /reset         → airplane mode full reset (job)
+  GET  /logs?n=100[&file=proxy]        → ambil N baris log terakhir
+  GET  /logs/stream?n=50[&file=proxy] → Server-Sent Events, baris baru di-push
   GET  /ips           → list IP pool
-  GET  /stats         → traffic stats
+  GET  /stats         → traffic stats live (stats.shm dari proxy)
+  GET  /metrics       → Prometheus text exposition (histogram, gauge)
   GET  /config        → baca config
   POST /config        → update config
 """
 
-import os, sys, json, time, subprocess, threading, signal
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import os, json, time, subprocess, threading, signal, itertools, collections
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import logging
+from stats_shm import StatsReader, HIST_BOUNDS
+import log_tail
+import pool_manager
 
 KUYDIR   = os.path.expanduser("~/kuyproxy")
 CONFIG   = os.path.join(KUYDIR, "config.cfg")
 IP_LIST  = os.path.join(KUYDIR, "added_ips.txt")
-LOG_FILE = os.path.join(KUYDIR, "logs", "kuyproxy.log")
+LOG_DIR  = os.path.join(KUYDIR, "logs")
+LOG_FILE = os.path.join(LOG_DIR, "kuyproxy.log")
 PID_PROXY = os.path.join(KUYDIR, "proxy.pid")
 PID_FRP   = os.path.join(KUYDIR, "frpc.pid")
 
+STATUS_INTERVAL = 2        # detik refresh cache status + tick scheduler
+JOB_KEEP        = 200      # job selesai yang masih bisa dilihat di /jobs
+SCRIPT_TIMEOUT  = 600      # detik maksimum kuyproxy.sh / airplane.sh
+LOG_STREAM_MAX  = 8        # client /logs/stream bersamaan
+LOG_HEARTBEAT   = 15       # detik, komentar SSE supaya FRP / browser tidak timeout
+
 start_time = time.time()
+stats_reader = StatsReader()
 log = logging.getLogger("API")
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(message)s", datefmt="%H:%M:%S")
 
 # ── Helpers ───────────────────────────────────────────────────
-def cfg(key, default=""):
-    try:
-        with open(CONFIG) as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith(f"{key}="):
-                    return line.split("=", 1)[1].strip().strip('"')
-    except: pass
-    return default
+# Cache config: parse ulang hanya kalau stat config.cfg berubah
+_config_cache = {"sig": None, "data": {}}
+_config_lock  = threading.Lock()
 
-def read_all_config():
+def _config_sig():
+    try:
+        st = os.stat(CONFIG)
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+    except: return None
+
+def _load_config():
+    sig = _config_sig()
+    cache = _config_cache
+    if sig is not None and sig == cache["sig"]:
+        return cache["data"]
     data = {}
     try:
         with open(CONFIG) as f:
@@ -56,8 +85,16 @@ def read_all_config():
                     k, _, v = line.partition("=")
                     data[k.strip()] = v.strip().strip('"')
     except: pass
+    with _config_lock:
+        _config_cache.update(sig=sig, data=data)
     return data
 
+def cfg(key, default=""):
+    return _load_config().get(key, default)
+
+def read_all_config():
+    return dict(_load_config())
+
 def write_config(updates: dict):
     try:
         with open(CONFIG, "r") as f:
@@ -79,6 +116,7 @@ def write_config(updates: dict):
                 new_lines.append(f"{k}={v}\n")
         with open(CONFIG, "w") as f:
             f.writelines(new_lines)
+        _config_cache["sig"] = None
         return True
     except Exception as e:
         log.error(f"Write config failed: {e}")
@@ -90,12 +128,44 @@ def get_ip_pool():
             return [l.strip() for l in f if l.strip()]
     except: return []
 
-def get_logs(n=100):
+def log_path(name=""):
+    """Nama log (kuyproxy / proxy / api / pool / frpc) → path di logs/.
+    Kosong = LOG_FILE dari config."""
+    if not name:
+        return os.path.join(KUYDIR, cfg("LOG_FILE") or "logs/kuyproxy.log")
+    name = os.path.basename(name)
+    if not name.endswith(".log"):
+        name += ".log"
+    path = os.path.join(LOG_DIR, name)
+    if not os.path.isfile(path):
+        raise ValueError(f"unknown log {name!r}")
+    return path
+
+def get_logs(n=100, name=""):
+    return log_tail.tail(log_path(name), max(0, min(n, 10000)))
+
+def cap_logs():
+    """Jaga tiap logs/*.log ≤ LOG_MAX_LINES baris (generasi lama di .log.1).
+    File yang ukurannya tidak berubah sejak cek terakhir dilewati."""
     try:
-        with open(LOG_FILE) as f:
-            lines = f.readlines()
-        return [l.rstrip() for l in lines[-n:]]
-    except: return []
+        limit = int(cfg("LOG_MAX_LINES") or 0)
+    except ValueError:
+        return
+    for name in os.listdir(LOG_DIR) if limit > 0 else ():
+        if not name.endswith(".log"):
+            continue
+        path = os.path.join(LOG_DIR, name)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        if _log_sizes.get(path) == size:
+            continue
+        if log_tail.cap(path, limit):
+            size = 0
+        _log_sizes[path] = size
+
+_log_sizes = {}
 
 def is_service_running(pid_file):
     try:
@@ -104,92 +174,333 @@ def is_service_running(pid_file):
         return True
     except: return False
 
-def run_cmd(cmd, background=False):
+def signal_service(pid_file, sig):
     try:
-        if background:
-            p = subprocess.Popen(cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            return p.pid
-        else:
-            r = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=30)
-            return r.returncode == 0, r.stdout + r.stderr
+        pid = int(open(pid_file).read().strip())
+        os.kill(pid, sig)
+        return True
+    except: return False
+
+def run_script(name, *args, timeout=SCRIPT_TIMEOUT):
+    """Jalankan script di KUYDIR sampai selesai. Output dibuang: script
+    sudah log sendiri, dan proses nohup-nya tidak boleh memegang pipe."""
+    try:
+        r = subprocess.run(["bash", os.path.join(KUYDIR, name), *args],
+                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, timeout=timeout)
+        return r.returncode == 0
     except Exception as e:
-        return False, str(e)
+        log.error(f"{name} {' '.join(args)}: {e}")
+        return False
 
-def telegram_notify(msg):
+# Satu thread pengirim: notif berurutan, request HTTP tidak menunggu Telegram
+_notifier = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notify")
+
+def _telegram_send(msg):
     token = cfg("TELEGRAM_BOT_TOKEN")
     chat  = cfg("TELEGRAM_CHAT_ID")
     if not token or not chat:
         return
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    data = json.dumps({"chat_id": chat, "text": msg, "parse_mode": "HTML"})
-    subprocess.Popen(
-        f'curl -s -X POST "{url}" -H "Content-Type: application/json" -d \'{data}\'',
-        shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-    )
+    req = urllib.request.Request(
+        f"https://api.telegram.org/bot{token}/sendMessage",
+        data=json.dumps({"chat_id": chat, "text": msg, "parse_mode": "HTML"}).encode(),
+        headers={"Content-Type": "application/json"})
+    try:
+        urllib.request.urlopen(req, timeout=10).close()
+    except Exception as e:
+        log.warning(f"Telegram notify failed: {e}")
+
+def telegram_notify(msg):
+    _notifier.submit(_telegram_send, msg)
 
 def json_response(data, status=200):
     body = json.dumps(data, ensure_ascii=False, indent=2).encode()
     return status, body
 
+# ── Status Cache ──────────────────────────────────────────────
+# Di-refresh thread monitor (dan setelah job start/stop), handler cuma
+# membaca dict ini
+_status = {"proxy": False, "frp": False, "pool": [], "updated": 0.0}
+
+def refresh_status():
+    _status.update(proxy=is_service_running(PID_PROXY),
+                   frp=is_service_running(PID_FRP),
+                   pool=get_ip_pool(), updated=time.time())
+
+# ── Jobs ──────────────────────────────────────────────────────
+class Job:
+    def __init__(self, jid, kind, total=1):
+        self.id       = jid
+        self.kind     = kind
+        self.state    = "queued"          # queued → running → done | failed
+        self.created  = time.time()
+        self.started  = self.finished = None
+        self.total    = total
+        self.done     = 0
+        self.failed   = 0
+        self.results  = []
+        self.error    = None
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def to_dict(self):
+        return {"id": self.id, "kind": self.kind, "state": self.state,
+                "created": self.created, "started": self.started, "finished": self.finished,
+                "total": self.total, "done": self.done, "failed": self.failed,
+                "results": self.results, "error": self.error}
+
+class JobQueue:
+    """Aksi service (start/stop/reset) berurutan di satu thread; rotasi
+    dipecah per ROTATE_BATCH user dan jalan paralel maks ROTATE_PARALLEL."""
+
+    def __init__(self, parallel=2, batch=16):
+        self.jobs     = collections.OrderedDict()
+        self.lock     = threading.Lock()
+        self.ids      = itertools.count(1)
+        self.batch    = max(1, batch)
+        self.service  = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job")
+        self.rotators = ThreadPoolExecutor(max_workers=max(1, parallel), thread_name_prefix="rotate")
+
+    def _new(self, kind, total=1):
+        with self.lock:
+            job = Job(f"j{next(self.ids)}", kind, total)
+            self.jobs[job.id] = job
+            while len(self.jobs) > JOB_KEEP:
+                old = next(iter(self.jobs.values()))
+                if old.active:
+                    break
+                self.jobs.popitem(last=False)
+        return job
+
+    def get(self, jid):
+        return self.jobs.get(jid)
+
+    def list(self):
+        with self.lock:
+            return [j.to_dict() for j in reversed(self.jobs.values())]
+
+    def running(self):
+        return sum(1 for j in list(self.jobs.values()) if j.active)
+
+    def submit(self, kind, fn, *args):
+        """Job satu langkah: fn(*args) → bool / dict hasil."""
+        job = self._new(kind)
+
+        def run():
+            job.state, job.started = "running", time.time()
+            try:
+                res = fn(*args)
+                ok  = res.get("ok", True) if isinstance(res, dict) else bool(res)
+                job.results.append(res if isinstance(res, dict) else {"ok": ok})
+            except Exception as e:
+                ok, job.error = False, str(e)
+            job.done, job.failed = int(ok), int(not ok)
+            job.state, job.finished = ("done" if ok else "failed"), time.time()
+            log.info(f"Job {job.id} {kind}: {job.state}")
+
+        self.service.submit(run)
+        return job
+
+    def rotate(self, idxs, grace=None, kind="rotate"):
+        """Job rotasi banyak user. Tiap potongan = satu request ke daemon
+        pool (IP baru satu batch netlink + satu push pool ke proxy)."""
+        idxs   = list(dict.fromkeys(idxs))
+        job    = self._new(kind, len(idxs))
+        chunks = [idxs[i:i + self.batch] for i in range(0, len(idxs), self.batch)]
+        left   = [len(chunks)]
+
+        def run(chunk):
+            if job.state == "queued":
+                job.state, job.started = "running", time.time()
+            try:
+                res = rotate_users(chunk, grace)
+            except Exception as e:
+                res = [{"user": i + 1, "ok": False, "error": str(e)} for i in chunk]
+            refresh_status()
+            with self.lock:
+                job.results += res
+                job.done    += sum(1 for r in res if r.get("ok"))
+                job.failed  += sum(1 for r in res if not r.get("ok"))
+                left[0] -= 1
+                last = not left[0]
+            if last:
+                job.state    = "done" if job.done else "failed"
+                job.finished = time.time()
+                _rotate_notify(job)
+
+        if not chunks:
+            job.state = "done"
+            job.started = job.finished = time.time()
+        for chunk in chunks:
+            self.rotators.submit(run, chunk)
+        return job
+
+jobs = None      # JobQueue, dibuat di main() sesuai config
+
+def _rotate_notify(job):
+    ok = [r for r in job.results if r.get("ok")]
+    log.info(f"Job {job.id} {job.kind}: {len(ok)}/{job.total} user dirotasi")
+    if len(ok) == 1 and job.total == 1:
+        telegram_notify(f"🔄 IP rotated: <b>user{ok[0]['user']}</b> → {ok[0].get('new', '?')}")
+    elif ok:
+        telegram_notify(f"🔄 {len(ok)}/{job.total} IP rotated ({job.kind})")
+
+def job_reply(job, **extra):
+    return dict({"ok": True, "job": job.id, "state": job.state}, **extra)
+
 # ── API Actions ───────────────────────────────────────────────
 def action_status():
-    proxy_up = is_service_running(PID_PROXY)
-    frp_up   = is_service_running(PID_FRP)
-    pool     = get_ip_pool()
-    uptime   = int(time.time() - start_time)
-
+    st = _status
     return {
         "status":    "online",
-        "proxy":     proxy_up,
-        "frp":       frp_up,
-        "running":   proxy_up and frp_up,
-        "ip_pool":   len(pool),
-        "ips":       pool,
-        "uptime_s":  uptime,
+        "proxy":     st["proxy"],
+        "frp":       st["frp"],
+        "running":   st["proxy"] and st["frp"],
+        "ip_pool":   len(st["pool"]),
+        "ips":       st["pool"],
+        "uptime_s":  int(time.time() - start_time),
         "interface": cfg("NETWORK_INTERFACE", "auto"),
         "method":    cfg("ROTATION_METHOD", "root"),
+        "jobs":      jobs.running(),
+        "cached_at": st["updated"],
         "version":   "1.0.0",
     }
 
-def action_start():
+def _start():
     log.info("Starting proxy services...")
-    sh = os.path.join(KUYDIR, "kuyproxy.sh")
-    run_cmd(f"bash {sh} start &", background=False)
-    time.sleep(2)
-    telegram_notify("🟢 KuyProxy <b>STARTED</b>")
-    return {"ok": True, "msg": "Start command sent"}
+    ok = run_script("kuyproxy.sh", "start")
+    refresh_status()
+    if ok:
+        telegram_notify("🟢 KuyProxy <b>STARTED</b>")
+    return ok
 
-def action_stop():
+def _stop():
     log.info("Stopping proxy services...")
-    sh = os.path.join(KUYDIR, "kuyproxy.sh")
-    run_cmd(f"bash {sh} stop", background=False)
-    telegram_notify("🔴 KuyProxy <b>STOPPED</b>")
-    return {"ok": True, "msg": "Stop command sent"}
-
-def action_rotate(user_idx: int):
-    log.info(f"Rotating IP for user index {user_idx}...")
-    sh = os.path.join(KUYDIR, "ip_manager.sh")
-    ok, out = run_cmd(f"bash {sh} rotate {user_idx}")
-    if ok:
-        pool = get_ip_pool()
-        new_ip = pool[user_idx] if user_idx < len(pool) else "?"
-        telegram_notify(f"🔄 IP rotated: <b>user{user_idx+1}</b> → {new_ip}")
-    return {"ok": ok, "msg": out.strip() if isinstance(out, str) else "", "user": user_idx+1}
+    # kuyproxy.sh stop ikut mematikan api_server → notif dikirim duluan
+    _telegram_send("🔴 KuyProxy <b>STOPPED</b>")
+    ok = run_script("kuyproxy.sh", "stop")
+    refresh_status()
+    return ok
 
-def action_reset():
+def action_start():
+    return job_reply(jobs.submit("start", _start), msg="Start command sent")
+
+def action_stop():
+    return job_reply(jobs.submit("stop", _stop), msg="Stop command sent")
+
+def action_reload():
+    ok = signal_service(PID_PROXY, signal.SIGHUP)
+    return {"ok": ok, "msg": "Reload signal sent" if ok else "Proxy not running"}
+
+def action_upgrade():
+    log.info("Upgrading proxy process...")
+    ok = signal_service(PID_PROXY, signal.SIGUSR2)
+    if ok:
+        telegram_notify("⏫ KuyProxy <b>UPGRADE</b> — tunnel lama di-drain")
+    return {"ok": ok, "msg": "Upgrade signal sent" if ok else "Proxy not running"}
+
+# Tanpa daemon, read-modify-write added_ips.txt harus berurutan
+_direct_lock = threading.Lock()
+
+def _rotate_direct(idxs, grace):
+    """Tanpa daemon pool.ctl: netlink langsung kalau root, selain itu
+    jalur lama lewat ip_manager.sh (su + ip) per user."""
+    with _direct_lock:
+        if os.geteuid() != 0:
+            # ip_manager.sh bisa menunggu drain selama ROTATE_GRACE_SEC
+            timeout = int(cfg("ROTATE_GRACE_SEC") or 60) + 30
+            out = []
+            for idx in idxs:
+                ok = run_script("ip_manager.sh", "rotate", str(idx), timeout=timeout)
+                pool = get_ip_pool()
+                out.append({"user": idx + 1, "ok": ok,
+                            "new": pool[idx] if ok and idx < len(pool) else None})
+            return out
+        pm = pool_manager.PoolManager()
+        try:
+            done = pm.switch(idxs)
+        except:
+            pm.close()
+            raise
+    grace = pm.grace if grace is None else grace
+
+    def retire():
+        try:
+            pool_manager.drain([old for _, old, _ in done], grace, lambda ip: pm.delete([ip]))
+        finally:
+            pm.close()
+
+    threading.Thread(target=retire, daemon=True).start()
+    rotated = {idx for idx, _, _ in done}
+    return ([{"user": idx + 1, "ok": True, "old": old, "new": new} for idx, old, new in done] +
+            [{"user": idx + 1, "ok": False, "error": "IP baru kurang"} for idx in idxs if idx not in rotated])
+
+def rotate_users(idxs, grace=None):
+    """IP baru dipasang dulu, user dipindah atomik, IP lama di-drain
+    (ROTATE_GRACE_SEC) lalu dilepas di background oleh daemon pool.
+    → [{"user", "ok", "old", "new" | "error"}]"""
+    log.info(f"Rotating IP for user {', '.join(str(i + 1) for i in idxs)}...")
+    msg = {"cmd": "rotate", "idxs": idxs}
+    if grace is not None:
+        msg["grace"] = grace
+    try:
+        reply = pool_manager.pool_request(msg, timeout=60)
+    except OSError:
+        return _rotate_direct(idxs, grace)
+    if not reply.get("ok"):
+        log.error(f"Rotate gagal: {reply.get('error')}")
+        return [{"user": i + 1, "ok": False, "error": reply.get("error")} for i in idxs]
+    return ([dict(r, ok=True) for r in reply["rotated"]] +
+            [{"user": u, "ok": False, "error": "IP baru kurang"} for u in reply["failed"]])
+
+def parse_users(spec):
+    """"3" / "1,5,7" / "2-10" / "all" → [idx 0-based] di dalam pool."""
+    n = len(_status["pool"]) or len(get_ip_pool())
+    spec = str(spec or "").strip().lower()
+    if spec in ("all", "*"):
+        return list(range(n))
+    out = []
+    for part in filter(None, (x.strip() for x in spec.split(","))):
+        a, _, b = part.partition("-")
+        out += range(int(a) - 1, int(b or a))
+    return [i for i in dict.fromkeys(out) if 0 <= i < n]
+
+def action_rotate(users, grace=None):
+    idxs = parse_users(users)
+    if not idxs:
+        return {"ok": False, "error": "no such user"}
+    job = jobs.rotate(idxs, grace)
+    if len(idxs) == 1:
+        return job_reply(job, user=idxs[0] + 1)
+    return job_reply(job, users=len(idxs))
+
+def action_jobs(jid=""):
+    if not jid:
+        return {"ok": True, "jobs": jobs.list()}
+    job = jobs.get(jid)
+    if job is None:
+        return {"ok": False, "error": "job not found"}
+    return dict(job.to_dict(), ok=True)
+
+def _reset():
     log.info("Triggering airplane mode reset...")
-    sh = os.path.join(KUYDIR, "airplane.sh")
     telegram_notify("✈️ Airplane mode rotation <b>started</b>")
-    # Run di background karena butuh waktu
-    subprocess.Popen(f"bash {sh} rotate", shell=True)
-    return {"ok": True, "msg": "Airplane rotation started"}
+    return run_script("airplane.sh", "rotate")
 
-def action_logs(n=100):
-    lines = get_logs(n)
+def action_reset():
+    return job_reply(jobs.submit("reset", _reset), msg="Airplane rotation started")
+
+def action_logs(n=100, name=""):
+    try:
+        lines = get_logs(n, name)
+    except ValueError as e:
+        return {"ok": False, "error": str(e)}
     return {"ok": True, "lines": lines, "count": len(lines)}
 
 def action_ips():
-    pool = get_ip_pool()
+    pool = _status["pool"]
     result = []
     base  = cfg("SOCKS_USERNAME", "user")
     for i, ip in enumerate(pool):
@@ -197,26 +508,225 @@ def action_ips():
     return {"ok": True, "pool": result, "total": len(pool)}
 
 def action_stats():
-    # Baca stats dari proxy
-    stats_file = os.path.join(KUYDIR, "stats.json")
-    try:
-        with open(stats_file) as f:
-            return json.load(f)
-    except:
-        return {"connections": 0, "bytes_up": 0, "bytes_down": 0}
+    # Baca stats live dari shared memory proxy (stats.shm), tanpa lock
+    snap = stats_reader.read()
+    if snap is None:
+        return {"ok": False, "alive": False,
+                "connections": 0, "bytes_up": 0, "bytes_down": 0, "active": 0}
+    t = snap["total"]
+    snap.update(ok=True, connections=t["connections"], active=t["active"],
+                bytes_up=t["bytes_up"], bytes_down=t["bytes_down"])
+    return snap
+
+# ── Metrics (Prometheus) ──────────────────────────────────────
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# gauge di stats.shm → (nama metric, label, help)
+_GAUGE_METRICS = {
+    "accept_queue_socks5":   ("kuyproxy_accept_queue", {"listener": "socks5"}, "Koneksi menunggu accept()"),
+    "accept_queue_http":     ("kuyproxy_accept_queue", {"listener": "http"}, "Koneksi menunggu accept()"),
+    "accept_backlog_socks5": ("kuyproxy_accept_backlog", {"listener": "socks5"}, "Backlog listen() maksimum"),
+    "accept_backlog_http":   ("kuyproxy_accept_backlog", {"listener": "http"}, "Backlog listen() maksimum"),
+    "pool_max":              ("kuyproxy_pool_max_workers", {}, "Worker maksimum thread pool"),
+    "pool_threads":          ("kuyproxy_pool_threads", {}, "Thread worker yang sudah dibuat"),
+    "pool_busy":             ("kuyproxy_pool_busy_workers", {}, "Worker yang sedang menangani sesi"),
+    "pool_queue":            ("kuyproxy_pool_queued", {}, "Sesi menunggu worker kosong"),
+    "loop_lag_seconds":      ("kuyproxy_loop_lag_seconds", {}, "Lag event loop asyncio (maks per detik)"),
+    "loop_sessions":         ("kuyproxy_loop_sessions", {}, "Sesi aktif di event loop asyncio"),
+    "reactor_links":         ("kuyproxy_reactor_links", {}, "Tunnel di relay reactor epoll"),
+    "upstream_idle":         ("kuyproxy_upstream_idle_connections", {}, "Koneksi HTTP upstream idle di pool"),
+    "accept_batch_max":      ("kuyproxy_accept_batch_max", {}, "Accept terbanyak dalam satu wakeup listener"),
+    "log_queue":             ("kuyproxy_log_queue", {}, "Record log menunggu thread writer"),
+    "udp_assocs":            ("kuyproxy_udp_associations", {}, "Asosiasi SOCKS5 UDP aktif"),
+}
+
+def _label(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def action_metrics():
+    snap  = stats_reader.read()
+    out   = []
+    typed = set()
+
+    def metric(name, kind, help_, labels, value):
+        if name not in typed:
+            typed.add(name)
+            out.append(f"# HELP {name} {help_}")
+            out.append(f"# TYPE {name} {kind}")
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        lbl = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+        out.append(f"{name}{{{lbl}}} {value}" if lbl else f"{name} {value}")
+
+    metric("kuyproxy_up", "gauge", "Proxy daemon hidup", {}, int(bool(snap and snap["alive"])))
+    if not snap:
+        return "\n".join(out) + "\n"
+    metric("kuyproxy_start_time_seconds", "gauge", "Waktu start proxy (unix)", {}, snap["started"])
+    metric("kuyproxy_stats_updated_seconds", "gauge", "Waktu publish stats terakhir (unix)", {}, snap["updated"])
+    metric("kuyproxy_workers", "gauge", "Proses worker proxy yang hidup", {}, snap.get("workers", 0))
+
+    # Traffic per proto / user / IP (satu family metric harus berurutan)
+    for group, label, prefix in (("protos", "proto", "kuyproxy"),
+                                 ("users", "user", "kuyproxy_user"),
+                                 ("ips", "ip", "kuyproxy_ip")):
+        items = snap[group].items()
+        for key, d in items:
+            metric(f"{prefix}_connections_total", "counter", f"Sesi per {label}", {label: key}, d["connections"])
+        for key, d in items:
+            for direction in ("up", "down"):
+                metric(f"{prefix}_bytes_total", "counter", f"Byte per {label}",
+                       {label: key, "direction": direction}, d[f"bytes_{direction}"])
+        for key, d in items:
+            metric(f"{prefix}_errors_total", "counter", f"Connect/DNS gagal per {label}", {label: key}, d["errors"])
+        for key, d in items:
+            metric(f"{prefix}_active_tunnels", "gauge", f"Tunnel aktif per {label}", {label: key}, d["active"])
+
+    # Histogram latency setup koneksi
+    name = "kuyproxy_setup_duration_seconds"
+    out.append(f"# HELP {name} Latency setup koneksi per fase (auth, dns, connect, first_byte)")
+    out.append(f"# TYPE {name} histogram")
+    for phase, h in snap["hist"].items():
+        cum = 0
+        for bound, n in zip(list(HIST_BOUNDS) + ["+Inf"], h["buckets"]):
+            cum += n
+            out.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {cum}')
+        out.append(f'{name}_sum{{phase="{phase}"}} {h["sum"]}')
+        out.append(f'{name}_count{{phase="{phase}"}} {cum}')
+
+    g = snap["gauges"]
+    for key, (mname, labels, help_) in _GAUGE_METRICS.items():
+        metric(mname, "gauge", help_, labels, g.get(key, 0))
+    metric("kuyproxy_dns_cache_hits_total", "counter", "DNS cache hit", {}, int(g.get("dns_hits", 0)))
+    metric("kuyproxy_dns_cache_misses_total", "counter", "DNS cache miss", {}, int(g.get("dns_misses", 0)))
+    metric("kuyproxy_listen_overflows_total", "counter", "Accept queue penuh (TcpExt ListenOverflows, seluruh host)", {}, int(g.get("listen_overflows", 0)))
+    metric("kuyproxy_udp_dropped_total", "counter", "Datagram UDP dibuang (limit, header rusak, buffer penuh)", {}, int(g.get("udp_dropped", 0)))
+    metric("kuyproxy_log_dropped_total", "counter", "Record log dibuang karena antrian penuh", {}, int(g.get("log_dropped", 0)))
+    metric("kuyproxy_listen_drops_total", "counter", "SYN dibuang listener (TcpExt ListenDrops, seluruh host)", {}, int(g.get("listen_drops", 0)))
+    return "\n".join(out) + "\n"
 
 def action_get_config():
     return {"ok": True, "config": read_all_config()}
 
+# Key yang hanya dibaca proxy saat start → perlu upgrade (SIGUSR2),
+# sisanya cukup reload (SIGHUP, lihat apply_settings di proxy_server.py)
+UPGRADE_KEYS = ("LOCAL_SOCKS_PORT", "LOCAL_HTTP_PORT", "PROXY_", "LISTEN_", "RELAY_")
+
 def action_post_config(body: bytes):
     try:
         updates = json.loads(body)
+        before  = read_all_config()
         if write_config(updates):
-            return {"ok": True, "msg": "Config saved"}
+            changed = [k for k, v in updates.items() if str(before.get(k, "")) != str(v)]
+            if any(k.startswith(UPGRADE_KEYS) for k in changed):
+                applied = signal_service(PID_PROXY, signal.SIGUSR2)
+                mode = "upgrade"
+            else:
+                # SIGHUP → proxy reload config (limit dll) tanpa restart
+                applied = signal_service(PID_PROXY, signal.SIGHUP)
+                mode = "reload"
+            return {"ok": True, "msg": "Config saved", "applied": applied, "mode": mode}
         return {"ok": False, "msg": "Write failed"}
     except Exception as e:
         return {"ok": False, "msg": str(e)}
 
+# ── Rotation Scheduler ────────────────────────────────────────
+# Policy dari config, dicek thread monitor tiap STATUS_INTERVAL:
+#   ROTATE_EVERY_MIN   → semua user target dirotasi tiap N menit
+#   ROTATE_AFTER_BYTES → user dirotasi setelah N byte (up+down) sejak rotasi terakhir
+#   ROTATE_AFTER_CONNS → user dirotasi setelah N koneksi sejak rotasi terakhir
+#   ROTATE_USERS       → target ("1,2,5-8"), kosong / all = semua user pool
+SCHEDULE_KEYS = {"every": "ROTATE_EVERY_MIN", "bytes": "ROTATE_AFTER_BYTES",
+                 "conns": "ROTATE_AFTER_CONNS", "users": "ROTATE_USERS"}
+
+class RotationScheduler:
+    def __init__(self):
+        self.last_all = time.time()
+        self.base     = {}            # idx → (bytes, conns) saat rotasi terakhir
+        self.job      = None
+
+    def policy(self):
+        def num(key):
+            try:
+                return max(0, int(float(cfg(key, "0") or 0)))
+            except ValueError:
+                return 0
+        return {"every": num("ROTATE_EVERY_MIN"), "bytes": num("ROTATE_AFTER_BYTES"),
+                "conns": num("ROTATE_AFTER_CONNS"), "users": cfg("ROTATE_USERS", "") or "all"}
+
+    def _usage(self, idxs):
+        """idx → (bytes, conns) dari stats.shm, untuk user userN."""
+        snap = stats_reader.read()
+        if not snap or not snap["alive"]:
+            return {}
+        base, users, out = cfg("SOCKS_USERNAME", "user") or "user", snap["users"], {}
+        for idx in idxs:
+            d = users.get(f"{base}{idx + 1}")
+            out[idx] = (d["bytes_up"] + d["bytes_down"], d["connections"]) if d else (0, 0)
+        return out
+
+    def tick(self, now):
+        pol = self.policy()
+        if not (pol["every"] or pol["bytes"] or pol["conns"]):
+            self.last_all = now
+            return
+        if self.job is not None and self.job.active:
+            return                       # rotasi sebelumnya belum selesai
+        try:
+            targets = parse_users(pol["users"])
+        except ValueError:
+            return
+        usage = self._usage(targets)
+        due = []
+        if pol["every"] and now - self.last_all >= pol["every"] * 60:
+            self.last_all, due = now, list(targets)
+        for idx, (b, c) in usage.items():
+            b0, c0 = self.base.setdefault(idx, (b, c))
+            if b < b0 or c < c0:         # proxy restart → counter mulai dari 0
+                b0 = c0 = 0
+            if ((pol["bytes"] and b - b0 >= pol["bytes"]) or
+                    (pol["conns"] and c - c0 >= pol["conns"])) and idx not in due:
+                due.append(idx)
+        if not due:
+            return
+        for idx in due:
+            self.base[idx] = usage.get(idx, (0, 0))
+        log.info(f"Scheduled rotation: {len(due)} user")
+        self.job = jobs.rotate(due, kind="schedule")
+
+    def status(self):
+        pol = self.policy()
+        nxt = self.last_all + pol["every"] * 60 if pol["every"] else None
+        return {"policy": pol, "next_rotation": nxt,
+                "job": self.job.to_dict() if self.job else None}
+
+scheduler = RotationScheduler()
+
+def action_schedule(params):
+    """Tanpa parameter → policy sekarang; dengan parameter → simpan ke config."""
+    updates = {SCHEDULE_KEYS[k]: v for k, v in params.items() if k in SCHEDULE_KEYS}
+    if updates:
+        if "users" in updates:
+            try:
+                parse_users(updates["ROTATE_USERS"])
+            except ValueError:
+                return {"ok": False, "error": "invalid users"}
+        if not write_config(updates):
+            return {"ok": False, "error": "Write failed"}
+        scheduler.last_all = time.time()
+    return dict(scheduler.status(), ok=True)
+
+def monitor():
+    while True:
+        try:
+            refresh_status()
+            scheduler.tick(time.time())
+            cap_logs()
+        except Exception as e:
+            log.error(f"monitor: {e}")
+        time.sleep(STATUS_INTERVAL)
+
+_log_streams = threading.BoundedSemaphore(LOG_STREAM_MAX)
+
 # ── HTTP Handler ──────────────────────────────────────────────
 class APIHandler(BaseHTTPRequestHandler):
 
@@ -232,6 +742,64 @@ class APIHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(body)
 
+    def send_text(self, text, content_type="text/plain; charset=utf-8"):
+        body = text.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_logs(self, path, n):
+        """SSE: n baris terakhir, lalu tiap baris baru sebagai event `data:`.
+        id = offset byte, jadi EventSource yang reconnect (Last-Event-ID)
+        melanjutkan tanpa mengirim ulang baris yang sama."""
+        if not _log_streams.acquire(blocking=False):
+            self.send_json({"ok": False, "error": "too many log streams"}, 503)
+            return
+        follower = None
+        try:
+            try:
+                resume = int(self.headers.get("Last-Event-ID", ""))
+            except ValueError:
+                resume = None
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            if resume is None:
+                try:
+                    end = os.path.getsize(path)
+                except OSError:
+                    end = 0
+                follower = log_tail.Follower(path, end)
+                self._sse(log_tail.tail(path, max(0, min(n, 1000)), end), end)
+            else:
+                follower = log_tail.Follower(path, resume)
+            while True:
+                lines = follower.poll(LOG_HEARTBEAT)
+                if lines:
+                    self._sse(lines, follower.offset)
+                else:
+                    self.wfile.write(b": ping\n\n")
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            pass
+        finally:
+            if follower:
+                follower.close()
+            _log_streams.release()
+
+    def _sse(self, lines, offset):
+        if not lines:
+            return
+        # Satu event per baris; id cukup di event terakhir batch
+        out = "".join(f"data: {l}\n\n" for l in lines[:-1]) + f"id: {offset}\ndata: {lines[-1]}\n\n"
+        self.wfile.write(out.encode())
+        self.wfile.flush()
+
     def do_GET(self):
         parsed = urlparse(self.path)
         path   = parsed.path.rstrip("/")
@@ -246,20 +814,37 @@ class APIHandler(BaseHTTPRequestHandler):
             "/status": action_status,
             "/start":  action_start,
             "/stop":   action_stop,
+            "/reload": action_reload,
+            "/upgrade": action_upgrade,
             "/reset":  action_reset,
-            "/logs":   lambda: action_logs(int(p("n", "100"))),
+            "/jobs":   lambda: action_jobs(p("id")),
+            "/schedule": lambda: action_schedule({k: v[0] for k, v in params.items() if v}),
+            "/logs":   lambda: action_logs(int(p("n", "100")), p("file")),
             "/ips":    action_ips,
             "/stats":  action_stats,
             "/config": action_get_config,
         }
 
+        if path == "/metrics":
+            self.send_text(action_metrics(), METRICS_CONTENT_TYPE)
+            return
+
+        if path == "/logs/stream":
+            try:
+                self.stream_logs(log_path(p("file")), int(p("n", "50")))
+            except ValueError as e:
+                self.send_json({"ok": False, "error": str(e)}, 404)
+            return
+
         if path == "/rotate":
-            user = p("user", "1")
             try:
-                idx = int(user) - 1
+                grace = float(p("grace")) if p("grace") else None
             except:
-                idx = 0
-            self.send_json(action_rotate(idx))
+                grace = None
+            try:
+                self.send_json(action_rotate(p("users") or p("user", "1"), grace))
+            except ValueError:
+                self.send_json({"ok": False, "error": "invalid user"}, 400)
             return
 
         handler = routes.get(path)
@@ -292,18 +877,30 @@ class APIHandler(BaseHTTPRequestHandler):
 
 # ── Main ─────────────────────────────────────────────────────
 def main():
+    global jobs
+    jobs = JobQueue(parallel=int(cfg("ROTATE_PARALLEL") or 2),
+                    batch=int(cfg("ROTATE_BATCH") or 16))
+    refresh_status()
+    threading.Thread(target=monitor, daemon=True, name="monitor").start()
+
     port = int(cfg("LOCAL_API_PORT") or 8080)
-    server = HTTPServer(("0.0.0.0", port), APIHandler)
+    server = ThreadingHTTPServer(("0.0.0.0", port), APIHandler)
+    server.daemon_threads = True
     log.info(f"🌐 API Server listening on 0.0.0.0:{port}")
 
     def shutdown(sig, frame):
+        # shutdown() menunggu serve_forever selesai → jangan dipanggil dari
+        # thread yang menjalankannya (handler sinyal jalan di main thread)
         log.info("API Server shutting down...")
-        server.shutdown()
-        sys.exit(0)
+        threading.Thread(target=server.shutdown, daemon=True).start()
 
     signal.signal(signal.SIGTERM, shutdown)
     signal.signal(signal.SIGINT, shutdown)
     server.serve_forever()
+    server.server_close()
+    # Job yang masih jalan (script / rotasi) tidak ditunggu
+    logging.shutdown()
+    os._exit(0)
 
 if __name__ == "__main__":
     main()
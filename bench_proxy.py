@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+bench_proxy.py — Load test & benchmark KuyProxy
+================================================
+Menjalankan proxy_server.py dari repo ini di HOME sementara (config.cfg
+repo + override --set), origin lokal di proses terpisah (echo TCP + HTTP
+kecil di [::1]), lalu memukulnya dengan client asyncio:
+
+  socks5  → SOCKS5 CONNECT + auth userN, kirim --size byte, baca echo
+  connect → HTTP CONNECT (Proxy-Authorization) + echo yang sama
+  http    → GET http://[::1]:port/?n=SIZE lewat proxy (--requests per koneksi)
+
+Sticky IP: kalau root, --ips alamat fd00:6b75:7942::N/128 dipasang di lo
+(netlink, dilepas lagi di akhir) dan dipakai sebagai pool. Origin
+mengirim alamat peer di awal koneksi / header X-Peer, jadi tiap sesi
+dicek keluar dari IP milik userN. Tanpa root pool = ::1.
+
+Hasil JSON (stdout atau --out) per workload: conn/s, MB/s, latency setup
+p50/p99, error, sticky_mismatch, RSS & thread proxy (puncak), CPU proxy.
+Bandingkan dua run:  python3 bench_proxy.py --compare lama.json baru.json
+
+  python3 bench_proxy.py -c 64 -d 10 --size 64K
+  python3 bench_proxy.py -w http --requests 20 --set PROXY_ENGINE=async
+  python3 bench_proxy.py --set PROXY_WORKERS=4 --set RELAY_MODE=reactor -o r.json
+"""
+
+import os, sys, json, time, errno, socket, struct, base64, shutil, signal, asyncio
+import argparse, tempfile, subprocess, resource, platform
+
+REPO      = os.path.dirname(os.path.abspath(__file__))
+PASSWORD  = "kuyproxy123"
+LO_PREFIX = "fd00:6b75:7942::"
+WORKLOADS = ("socks5", "connect", "http")
+
+# ── Origin (proses terpisah supaya tidak berebut GIL dengan client) ──
+async def _origin_echo(reader, writer):
+    peer = writer.get_extra_info("peername")[0]
+    try:
+        writer.write(socket.inet_pton(socket.AF_INET6, peer))
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        writer.close()
+
+async def _origin_http(reader, writer):
+    peer = writer.get_extra_info("peername")[0]
+    body = b""
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            target = head.split(b" ", 2)[1]
+            n = int(target.rpartition(b"n=")[2] or 0) if b"n=" in target else 0
+            if len(body) != n:
+                body = b"x" * n
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                         b"Content-Length: %d\r\nX-Peer: %s\r\n\r\n" % (n, peer.encode()) + body)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError, OSError, ValueError, IndexError):
+        pass
+    finally:
+        writer.close()
+
+async def _origin_main():
+    echo = await asyncio.start_server(_origin_echo, "::1", 0, backlog=4096)
+    http = await asyncio.start_server(_origin_http, "::1", 0, backlog=4096)
+    print(json.dumps({"echo": echo.sockets[0].getsockname()[1],
+                      "http": http.sockets[0].getsockname()[1]}), flush=True)
+    await asyncio.Event().wait()
+
+def start_origin():
+    p = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--origin"],
+                         stdout=subprocess.PIPE, text=True)
+    ports = json.loads(p.stdout.readline())
+    return p, ports
+
+# ── Loopback IPv6 pool ────────────────────────────────────────
+def setup_loopback(n):
+    """Pasang n alamat /128 di lo → (ips, cleanup). Tanpa root → ::1."""
+    if n <= 0 or os.geteuid() != 0:
+        return ["::1"], lambda: None
+    try:
+        import pool_manager
+        nl    = pool_manager.Netlink()
+        index = socket.if_nametoindex("lo")
+        ips   = [f"{LO_PREFIX}{i:x}" for i in range(1, n + 1)]
+        body  = lambda ip: pool_manager._addr_body(index, ip, 128)
+        errs  = [e for e in nl.batch([(pool_manager.RTM_NEWADDR, pool_manager.NLM_F_CREATE, body(ip))
+                                      for ip in ips]) if e not in (0, errno.EEXIST)]
+        if errs:
+            raise OSError(errs[0], os.strerror(errs[0]))
+    except Exception as e:
+        print(f"⚠️  Loopback pool tidak bisa dipasang ({e}) — pakai ::1", file=sys.stderr)
+        return ["::1"], lambda: None
+
+    def cleanup():
+        nl.batch([(pool_manager.RTM_DELADDR, 0, body(ip)) for ip in ips])
+        nl.close()
+    return ips, cleanup
+
+# ── Proxy ─────────────────────────────────────────────────────
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_proxy(home, overrides, pool):
+    kd = os.path.join(home, "kuyproxy")
+    os.makedirs(os.path.join(kd, "logs"), exist_ok=True)
+    ports = {"LOCAL_SOCKS_PORT": _free_port(), "LOCAL_HTTP_PORT": _free_port()}
+    cfg, seen = [], set()
+    settings = dict(ports, SOCKS_USERNAME="user", SOCKS_PASSWORD=PASSWORD, STICKY_MODE="index",
+                    **overrides)
+    with open(os.path.join(REPO, "config.cfg")) as f:
+        for line in f:
+            k = line.split("=", 1)[0].strip()
+            if "=" in line and not line.lstrip().startswith("#") and k in settings:
+                line = f"{k}={settings[k]}\n"
+                seen.add(k)
+            cfg.append(line)
+    cfg += [f"{k}={v}\n" for k, v in settings.items() if k not in seen]
+    with open(os.path.join(kd, "config.cfg"), "w") as f:
+        f.writelines(cfg)
+    with open(os.path.join(kd, "added_ips.txt"), "w") as f:
+        f.writelines(f"{ip}\n" for ip in pool)
+    p = subprocess.Popen([sys.executable, os.path.join(REPO, "proxy_server.py")],
+                         env=dict(os.environ, HOME=home), stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + 15
+    for port in ports.values():
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if p.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"proxy tidak bisa start (lihat {kd}/logs/proxy.log)")
+                time.sleep(0.1)
+    return p, ports["LOCAL_SOCKS_PORT"], ports["LOCAL_HTTP_PORT"]
+
+def stop_proxy(p):
+    try:
+        os.killpg(p.pid, signal.SIGTERM)
+        p.wait(10)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        try: os.killpg(p.pid, signal.SIGKILL)
+        except ProcessLookupError: pass
+
+class ProcSampler:
+    """RSS, thread & CPU proxy (+ worker prefork) dari /proc."""
+
+    TICK = os.sysconf("SC_CLK_TCK")
+
+    def __init__(self, pid):
+        self.root = pid
+
+    def _pids(self):
+        pids = [self.root]
+        for d in os.listdir("/proc"):
+            if d.isdigit():
+                try:
+                    with open(f"/proc/{d}/stat") as f:
+                        if int(f.read().rpartition(")")[2].split()[1]) == self.root:
+                            pids.append(int(d))
+                except (OSError, ValueError, IndexError):
+                    pass
+        return pids
+
+    def sample(self):
+        """→ (rss_mb, threads, cpu_s) dijumlah semua proses proxy."""
+        rss = threads = cpu = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            rss += int(line.split()[1])
+                        elif line.startswith("Threads:"):
+                            threads += int(line.split()[1])
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rpartition(")")[2].split()
+                cpu += (int(fields[11]) + int(fields[12])) / self.TICK
+            except (OSError, ValueError, IndexError):
+                pass
+        return rss / 1024, threads, cpu
+
+# ── Client ────────────────────────────────────────────────────
+def _auth_header(user):
+    return "Basic " + base64.b64encode(f"{user}:{PASSWORD}".encode()).decode()
+
+async def _read_peer(reader):
+    return socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+
+async def _echo(reader, writer, payload):
+    writer.write(payload)
+    got = await reader.readexactly(len(payload))
+    await writer.drain()
+    return len(payload) + len(got)
+
+async def session_socks5(ctx, user):
+    t0 = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", ctx["socks"])
+    try:
+        writer.write(b"\x05\x01\x02")
+        if await reader.readexactly(2) != b"\x05\x02":
+            raise ConnectionError("socks5 method")
+        u, p = user.encode(), PASSWORD.encode()
+        writer.write(b"\x01" + bytes([len(u)]) + u + bytes([len(p)]) + p)
+        if (await reader.readexactly(2))[1] != 0:
+            raise ConnectionError("socks5 auth")
+        writer.write(b"\x05\x01\x00\x04" + socket.inet_pton(socket.AF_INET6, "::1") +
+                     struct.pack("!H", ctx["echo"]))
+        rep = await reader.readexactly(4)
+        if rep[1] != 0:
+            raise ConnectionError(f"socks5 reply {rep[1]}")
+        await reader.readexactly({1: 4, 4: 16}.get(rep[3], 0) + 2)
+        setup = time.perf_counter() - t0
+        peer  = await _read_peer(reader)
+        return setup, peer, await _echo(reader, writer, ctx["payload"])
+    finally:
+        writer.close()
+
+async def session_connect(ctx, user):
+    t0 = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", ctx["http_proxy"])
+    try:
+        writer.write(f"CONNECT [::1]:{ctx['echo']} HTTP/1.1\r\nHost: [::1]:{ctx['echo']}\r\n"
+                     f"Proxy-Authorization: {_auth_header(user)}\r\n\r\n".encode())
+        head = await reader.readuntil(b"\r\n\r\n")
+        if b" 200 " not in head.split(b"\r\n", 1)[0]:
+            raise ConnectionError(head.split(b"\r\n", 1)[0].decode(errors="replace"))
+        setup = time.perf_counter() - t0
+        peer  = await _read_peer(reader)
+        return setup, peer, await _echo(reader, writer, ctx["payload"])
+    finally:
+        writer.close()
+
+async def session_http(ctx, user):
+    """--requests GET di satu koneksi keep-alive; setup = waktu sampai
+    header respons pertama."""
+    t0 = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", ctx["http_proxy"])
+    setup, peer, total = None, None, 0
+    req = (f"GET http://[::1]:{ctx['http']}/?n={ctx['size']} HTTP/1.1\r\nHost: [::1]:{ctx['http']}\r\n"
+           f"Proxy-Authorization: {_auth_header(user)}\r\n\r\n").encode()
+    try:
+        for _ in range(ctx["requests"]):
+            writer.write(req)
+            head = await reader.readuntil(b"\r\n\r\n")
+            if setup is None:
+                setup = time.perf_counter() - t0
+            lines = head.decode("latin-1").split("\r\n")
+            if " 200 " not in lines[0]:
+                raise ConnectionError(lines[0])
+            hdr = {k.lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:] if l)}
+            peer = hdr.get("x-peer", peer)
+            body = await reader.readexactly(int(hdr.get("content-length", 0)))
+            total += len(req) + len(head) + len(body)
+        return setup, peer, total
+    finally:
+        writer.close()
+
+SESSIONS = {"socks5": session_socks5, "connect": session_connect, "http": session_http}
+
+def _pct(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+async def run_workload(name, ctx, concurrency, duration, pool, users, sampler):
+    fn       = SESSIONS[name]
+    lat      = []
+    errors   = {}
+    counts   = {"sessions": 0, "bytes": 0, "sticky_mismatch": 0}
+    peak     = {"rss_mb": 0.0, "threads": 0}
+    deadline = time.monotonic() + duration
+
+    async def worker(i):
+        user_no = i % users + 1
+        expect  = pool[(user_no - 1) % len(pool)]
+        while time.monotonic() < deadline:
+            try:
+                setup, peer, nbytes = await fn(ctx, f"user{user_no}")
+            except Exception as e:
+                key = type(e).__name__
+                errors[key] = errors.get(key, 0) + 1
+                await asyncio.sleep(0.01)
+                continue
+            lat.append(setup)
+            counts["sessions"] += 1
+            counts["bytes"]    += nbytes
+            if peer is not None and peer != expect:
+                counts["sticky_mismatch"] += 1
+
+    async def watch():
+        while time.monotonic() < deadline:
+            rss, threads, _ = sampler.sample()
+            peak["rss_mb"]  = max(peak["rss_mb"], rss)
+            peak["threads"] = max(peak["threads"], threads)
+            await asyncio.sleep(0.5)
+
+    cpu0, ru0, t0 = sampler.sample()[2], resource.getrusage(resource.RUSAGE_SELF), time.monotonic()
+    await asyncio.gather(watch(), *(worker(i) for i in range(concurrency)))
+    elapsed = time.monotonic() - t0
+    rss, threads, cpu1 = sampler.sample()
+    ru1 = resource.getrusage(resource.RUSAGE_SELF)
+    ms  = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        "sessions":        counts["sessions"],
+        "conn_per_s":      round(counts["sessions"] / elapsed, 1),
+        "mb_per_s":        round(counts["bytes"] / elapsed / 1e6, 2),
+        "setup_p50_ms":    ms(_pct(lat, 0.50)),
+        "setup_p99_ms":    ms(_pct(lat, 0.99)),
+        "setup_max_ms":    ms(max(lat) if lat else None),
+        "errors":          sum(errors.values()),
+        "error_kinds":     errors,
+        "sticky_mismatch": counts["sticky_mismatch"],
+        "proxy_rss_mb":    round(max(peak["rss_mb"], rss), 1),
+        "proxy_threads":   max(peak["threads"], threads),
+        "proxy_cpu_s":     round(cpu1 - cpu0, 2),
+        "client_cpu_s":    round(ru1.ru_utime + ru1.ru_stime - ru0.ru_utime - ru0.ru_stime, 2),
+        "elapsed_s":       round(elapsed, 2),
+    }
+
+# ── Compare ───────────────────────────────────────────────────
+COMPARE_KEYS = ("conn_per_s", "mb_per_s", "setup_p50_ms", "setup_p99_ms",
+                "proxy_rss_mb", "proxy_threads", "proxy_cpu_s", "errors")
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    for name in [w for w in WORKLOADS if w in old and w in new]:
+        print(f"── {name}")
+        for key in COMPARE_KEYS:
+            a, b = old[name].get(key), new[name].get(key)
+            delta = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else ""
+            print(f"  {key:<15} {a!s:>10} → {b!s:<10} {delta}")
+    return 0
+
+# ── Main ──────────────────────────────────────────────────────
+def _size(v):
+    v = v.strip().upper()
+    mult = {"K": 1 << 10, "M": 1 << 20}.get(v[-1:], 1)
+    return int(float(v.rstrip("KM")) * mult)
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "-C", REPO, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def main(argv):
+    ap = argparse.ArgumentParser(description="Benchmark KuyProxy (SOCKS5 / HTTP CONNECT / HTTP)")
+    ap.add_argument("-w", "--workloads", default=",".join(WORKLOADS),
+                    help="socks5,connect,http (default semua)")
+    ap.add_argument("-c", "--concurrency", type=int, default=32)
+    ap.add_argument("-d", "--duration", type=float, default=10, help="detik per workload")
+    ap.add_argument("--size", type=_size, default="64K", help="byte per sesi (echo / body HTTP)")
+    ap.add_argument("--requests", type=int, default=1, help="request HTTP per koneksi")
+    ap.add_argument("--users", type=int, default=8, help="jumlah user berbeda (user1..N)")
+    ap.add_argument("--ips", type=int, default=8, help="alamat IPv6 loopback untuk pool (butuh root)")
+    ap.add_argument("--set", action="append", default=[], metavar="KEY=VAL",
+                    help="override config.cfg, mis. PROXY_ENGINE=async")
+    ap.add_argument("-o", "--out", help="tulis JSON ke file (default stdout)")
+    ap.add_argument("--keep", action="store_true", help="jangan hapus HOME sementara (log proxy)")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    ap.add_argument("--origin", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv[1:])
+
+    if args.origin:
+        asyncio.run(_origin_main())
+        return 0
+    if args.compare:
+        return compare(*args.compare)
+
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    bad = [w for w in workloads if w not in SESSIONS]
+    if bad:
+        ap.error(f"workload tidak dikenal: {', '.join(bad)}")
+    overrides = dict(kv.split("=", 1) for kv in args.set)
+
+    home = tempfile.mkdtemp(prefix="kuybench-")
+    pool, cleanup = setup_loopback(args.ips)
+    origin = proxy = None
+    try:
+        origin, oports = start_origin()
+        proxy, s5, hp = start_proxy(home, overrides, pool)
+        sampler = ProcSampler(proxy.pid)
+        ctx = {"socks": s5, "http_proxy": hp, "echo": oports["echo"], "http": oports["http"],
+               "size": args.size, "payload": os.urandom(args.size), "requests": max(1, args.requests)}
+        results = {}
+        for name in workloads:
+            print(f"▶ {name}: c={args.concurrency} {args.duration:g}s size={args.size}",
+                  file=sys.stderr)
+            r = results[name] = asyncio.run(run_workload(name, ctx, args.concurrency, args.duration,
+                                                         pool, args.users, sampler))
+            print(f"  {r['conn_per_s']} conn/s  {r['mb_per_s']} MB/s  p50 {r['setup_p50_ms']}ms  "
+                  f"p99 {r['setup_p99_ms']}ms  err {r['errors']}  rss {r['proxy_rss_mb']}MB  "
+                  f"threads {r['proxy_threads']}", file=sys.stderr)
+    finally:
+        if proxy:
+            stop_proxy(proxy)
+        if origin:
+            origin.kill()
+            origin.wait()
+        cleanup()
+        if args.keep:
+            print(f"HOME proxy: {home}", file=sys.stderr)
+        else:
+            shutil.rmtree(home, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "rev": _git_rev(),
+            "python": platform.python_version(), "machine": platform.machine(),
+            "cpus": os.cpu_count(), "concurrency": args.concurrency, "duration_s": args.duration,
+            "size": args.size, "requests": args.requests, "users": args.users,
+            "pool": len(pool), "sticky": pool != ["::1"], "config": overrides,
+        },
+        "results": results,
+    }
+    out = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -14,6 +14,18 @@ cfg() { grep -m1 "^$1=" "$CONFIG" 2>/dev/null | cut -d= -f2- | tr -d '"'; }
 
 log() { echo "[$(date '+%H:%M:%S')] [IP] $*"; }
 
+# ── Pool manager (rtnetlink, 1 proses untuk seluruh batch) ──
+# Return 3 = netlink tidak bisa dipakai → fallback ke `ip` per alamat
+pool_manager() {
+    local py; py=$(command -v python3)
+    [ -z "$py" ] || [ ! -f "$KUYDIR/pool_manager.py" ] && return 3
+    if [ "$(id -u)" = "0" ]; then
+        "$py" "$KUYDIR/pool_manager.py" "$@"
+    else
+        su -c "HOME='$HOME' '$py' '$KUYDIR/pool_manager.py' $*"
+    fi
+}
+
 # ── Detect interface IPv6 aktif ──────────
 detect_interface() {
     local forced; forced=$(cfg NETWORK_INTERFACE)
@@ -62,6 +74,13 @@ setup_pool() {
     local count; count=$(cfg IP_POOL_COUNT)
     count=${count:-10}
 
+    pool_manager setup "$count"
+    case $? in
+        0) return 0 ;;
+        3) log "⚠️  pool_manager unavailable — fallback ke ip" ;;
+        *) log "⚠️  Could not build IPv6 pool — Single IP mode"; return 0 ;;
+    esac
+
     log "Setting up IPv6 pool ($count IPs)..."
 
     local iface; iface=$(detect_interface)
@@ -113,6 +132,7 @@ setup_pool() {
 # ── Remove seluruh pool ───────────────────
 remove_pool() {
     if [ ! -f "$IP_LIST" ]; then return; fi
+    pool_manager remove && return 0
     local iface; iface=$(cat "$IFACE_FILE" 2>/dev/null)
     iface=${iface:-$(detect_interface)}
 
@@ -128,6 +148,9 @@ remove_pool() {
 # ── Rotate IP user tertentu (index 0-based) ──
 rotate_user() {
     local idx="$1"
+    pool_manager rotate "$idx"
+    local rc=$?
+    [ "$rc" -ne 3 ] && return "$rc"
     local iface; iface=$(cat "$IFACE_FILE" 2>/dev/null)
     iface=${iface:-$(detect_interface)}
 
@@ -145,19 +168,21 @@ rotate_user() {
 
     log "Rotating user $((idx+1)): $old_ip → $new_ip"
 
-    # Hapus IP lama, tambah baru
-    su -c "ip -6 addr del ${old_ip}/64 dev $iface" 2>/dev/null
+    # Make-before-break: tambah IP baru, pindahkan user, IP lama dilepas
+    # setelah ROTATE_GRACE_SEC supaya tunnel yang masih jalan tidak putus
     if su -c "ip -6 addr add ${new_ip}/64 dev $iface" 2>/dev/null; then
         # Update file
         local tmp; tmp=$(mktemp)
         awk -v idx="$((idx+1))" -v new="$new_ip" 'NR==idx{print new; next} {print}' "$IP_LIST" > "$tmp"
         mv "$tmp" "$IP_LIST"
-        log "✅ user$((idx+1)) now → $new_ip"
+        local pid; pid=$(cat "$KUYDIR/proxy.pid" 2>/dev/null)
+        [ -n "$pid" ] && kill -HUP "$pid" 2>/dev/null
+        local grace; grace=$(cfg ROTATE_GRACE_SEC); grace=${grace:-60}
+        ( sleep "$grace"; su -c "ip -6 addr del ${old_ip}/64 dev $iface" 2>/dev/null ) >/dev/null 2>&1 &
+        log "✅ user$((idx+1)) now → $new_ip (IP lama dilepas dalam ${grace}s)"
         return 0
     else
-        # Rollback
-        su -c "ip -6 addr add ${old_ip}/64 dev $iface" 2>/dev/null
-        log "❌ Rotate failed, rolled back"
+        log "❌ Rotate failed — $old_ip tetap dipakai"
         return 1
     fi
 }
@@ -189,10 +214,11 @@ case "${1:-help}" in
     setup)   setup_pool ;;
     remove)  remove_pool ;;
     rotate)  rotate_user "${2:-0}" ;;
+    serve)   pool_manager serve ;;
     list)    list_ips ;;
     status)  show_status ;;
     detect)  detect_interface ;;
     *)
-        echo "Usage: $0 {setup|remove|rotate <idx>|list|status|detect}"
+        echo "Usage: $0 {setup|remove|rotate <idx>|serve|list|status|detect}"
         ;;
 esac
@@ -67,6 +67,11 @@ cmd_start() {
     log "  Proxy PID: $(cat $PID_PROXY)"
     sleep 1
 
+    # Daemon pool (root, netlink) — rotasi dari API tanpa su per request
+    log "🔁 Starting pool daemon..."
+    nohup bash "$KUYDIR/ip_manager.sh" serve \
+        >> "$LOGDIR/pool.log" 2>&1 &
+
     # Start API server
     log "🌐 Starting API Server..."
     nohup python3 "$KUYDIR/api_server.py" \
@@ -111,6 +116,7 @@ cmd_stop() {
     stop_pid "$PID_API"   "api_server"
     stop_pid "$PID_PROXY" "proxy_server"
     bash "$KUYDIR/ip_manager.sh" remove
+    python3 "$KUYDIR/pool_manager.py" stop >/dev/null 2>&1
     log "✅ Stopped"
 }
 
@@ -169,6 +175,39 @@ cmd_restart() {
     cmd_start
 }
 
+# ── RELOAD (config + IP pool, tanpa putus) ─
+cmd_reload() {
+    if ! is_running "$PID_PROXY"; then
+        log "⚠️  Proxy not running"
+        return 1
+    fi
+    kill -HUP "$(cat "$PID_PROXY")"
+    log "🔁 Config reloaded (pid $(cat "$PID_PROXY"))"
+}
+
+# ── UPGRADE (proses baru ambil alih listener) ─
+# Proses lama berhenti accept dan drain tunnel yang masih jalan
+cmd_upgrade() {
+    if ! is_running "$PID_PROXY"; then
+        log "⚠️  Proxy not running"
+        return 1
+    fi
+    local old; old=$(cat "$PID_PROXY")
+    log "⏫ Upgrading proxy (pid $old)..."
+    kill -USR2 "$old"
+    local i pid
+    for i in $(seq 1 35); do
+        sleep 1
+        pid=$(cat "$PID_PROXY" 2>/dev/null)
+        if [ "$pid" != "$old" ] && is_running "$PID_PROXY"; then
+            log "✅ Upgraded: pid $old → $pid (pid lama drain)"
+            return 0
+        fi
+    done
+    log "❌ Upgrade gagal — pid $old tetap melayani"
+    return 1
+}
+
 # ── IPs ───────────────────────────────────
 cmd_ips() {
     bash "$KUYDIR/ip_manager.sh" list
@@ -234,6 +273,8 @@ case "${1:-help}" in
     start)   cmd_start ;;
     stop)    cmd_stop ;;
     restart) cmd_restart ;;
+    reload)  cmd_reload ;;
+    upgrade) cmd_upgrade ;;
     status)  cmd_status ;;
     rotate)  cmd_rotate "${2:-1}" ;;
     reset)   cmd_reset ;;
@@ -250,6 +291,8 @@ case "${1:-help}" in
         printf "  %-12s %s\n" "start"   "Start semua service (proxy + api + frpc)"
         printf "  %-12s %s\n" "stop"    "Stop semua service"
         printf "  %-12s %s\n" "restart" "Restart semua service"
+        printf "  %-12s %s\n" "reload"  "Reload config & IP pool tanpa putus"
+        printf "  %-12s %s\n" "upgrade" "Ganti proses proxy tanpa putus (tunnel lama di-drain)"
         printf "  %-12s %s\n" "status"  "Lihat status semua service"
         printf "  %-12s %s\n" "rotate [N]" "Rotate IP user ke-N (default: 1)"
         printf "  %-12s %s\n" "reset"   "Airplane mode reset (ganti IP semua)"
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+log_tail.py — Tail, follow & cap log KuyProxy
+=============================================
+Dipakai api_server untuk /logs dan /logs/stream:
+
+  tail(path, n)        → n baris terakhir, dibaca mundur per blok dari
+                         akhir file (biaya ~ n baris, bukan ukuran file);
+                         kalau kurang, disambung dari path.1
+  cap(path, max_lines) → lebih dari max_lines baris → isi dipindah ke
+                         path.1 lalu file di-truncate di tempat
+                         (copytruncate: fd O_APPEND milik tee / nohup /
+                         FileHandler tetap valid, tanpa perlu reopen)
+  Follower(path, pos)  → tunggu baris baru via inotify (ctypes), fallback
+                         polling stat kalau inotify tidak tersedia.
+                         Truncate (cap) / file diganti → baca dari awal.
+"""
+
+import os, time, select, ctypes, ctypes.util
+
+BLOCK      = 8192
+READ_MAX   = 64 * 1024          # byte maksimum per wakeup follower
+POLL_EVERY = 1.0                # detik, kalau tanpa inotify
+
+def _tail_offset(f, n, size):
+    """Offset awal n baris terakhir, 0 kalau file tidak lebih dari n baris.
+    Baris terakhir tanpa \\n tetap dihitung satu baris."""
+    pos  = size
+    need = n + 1 if size and _byte_at(f, size - 1) == b"\n" else n
+    while pos > 0:
+        step = min(BLOCK, pos)
+        pos -= step
+        f.seek(pos)
+        buf = f.read(step)
+        cnt = buf.count(b"\n")
+        if cnt >= need:
+            idx = len(buf)
+            for _ in range(need):
+                idx = buf.rindex(b"\n", 0, idx)
+            return pos + idx + 1
+        need -= cnt
+    return 0
+
+def _byte_at(f, off):
+    f.seek(off)
+    return f.read(1)
+
+def tail_lines(path, n, end=None):
+    """n baris terakhir satu file (sampai offset `end`) → [str]."""
+    if n <= 0:
+        return []
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            size = size if end is None else min(end, size)
+            f.seek(_tail_offset(f, n, size))
+            data = f.read(size - f.tell())
+    except OSError:
+        return []
+    return data.decode("utf-8", "replace").splitlines()[-n:]
+
+def tail(path, n, end=None):
+    """Seperti tail_lines, disambung generasi sebelumnya (path.1) kalau
+    file baru saja di-cap."""
+    lines = tail_lines(path, n, end)
+    if len(lines) < n:
+        lines = tail_lines(path + ".1", n - len(lines)) + lines
+    return lines
+
+def cap(path, max_lines):
+    """Cap file ke max_lines baris. → True kalau file dirotasi."""
+    if max_lines <= 0:
+        return False
+    try:
+        with open(path, "rb+") as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size or _tail_offset(f, max_lines, size) == 0:
+                return False
+            f.seek(0)
+            tmp = path + ".1.tmp"
+            with open(tmp, "wb") as out:
+                while True:
+                    chunk = f.read(1 << 20)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            os.replace(tmp, path + ".1")
+            f.truncate(0)
+        return True
+    except OSError:
+        return False
+
+# ── inotify (ctypes) ──────────────────────────────────────────
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_NONBLOCK    = os.O_NONBLOCK
+IN_CLOEXEC     = os.O_CLOEXEC
+
+_libc = None
+
+def _inotify():
+    global _libc
+    if _libc is None:
+        try:
+            lib = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+            lib.inotify_init1, lib.inotify_add_watch
+            _libc = lib
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc or None
+
+class Inotify:
+    """Satu watch pada satu file. wait(timeout) → True kalau ada event."""
+
+    def __init__(self, path, mask=IN_MODIFY | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF):
+        libc = _inotify()
+        if libc is None:
+            raise OSError("inotify not available")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            e = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(e, os.strerror(e))
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+
+    def wait(self, timeout):
+        if not self.poller.poll(timeout * 1000):
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        try: os.close(self.fd)
+        except: pass
+
+class Follower:
+    """Ikuti baris baru mulai offset `pos` (None = akhir file)."""
+
+    def __init__(self, path, pos=None):
+        self.path  = path
+        self.ino   = None
+        self.watch = None
+        self.pos   = pos
+        self.partial = b""
+
+    @property
+    def offset(self):
+        """Offset setelah baris utuh terakhir yang sudah dikirim."""
+        return (self.pos or 0) - len(self.partial)
+
+    def _stat(self):
+        try:
+            return os.stat(self.path)
+        except OSError:
+            return None
+
+    def _rewatch(self, st):
+        if self.watch:
+            self.watch.close()
+            self.watch = None
+        self.ino = st.st_ino if st else None
+        if st:
+            try:
+                self.watch = Inotify(self.path)
+            except OSError:
+                pass
+
+    def _read(self, st):
+        if self.pos is None or self.pos > st.st_size:
+            # Awal follow, atau file di-cap / di-truncate
+            self.pos = st.st_size if self.pos is None else 0
+            self.partial = b""
+        if st.st_size <= self.pos:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self.pos)
+            data = f.read(min(READ_MAX, st.st_size - self.pos))
+        self.pos += len(data)
+        data = self.partial + data
+        end = data.rfind(b"\n") + 1
+        self.partial = data[end:]
+        return data[:end].decode("utf-8", "replace").splitlines()
+
+    def poll(self, timeout):
+        """Baris baru → [str]; [] kalau timeout tanpa baris baru."""
+        st = self._stat()
+        if st is None or st.st_ino != self.ino:
+            if self.ino is not None:
+                self.pos = 0 if st else None      # file diganti → dari awal
+            self._rewatch(st)
+        if st is not None:
+            lines = self._read(st)
+            if lines or self.pos < st.st_size:
+                return lines
+        if self.watch:
+            self.watch.wait(timeout)
+        else:
+            time.sleep(min(timeout, POLL_EVERY))
+        st = self._stat()
+        if st is None or st.st_ino != self.ino:
+            return []
+        return self._read(st)
+
+    def close(self):
+        if self.watch:
+            self.watch.close()
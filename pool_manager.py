@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+"""
+pool_manager.py — IPv6 Pool Manager (rtnetlink)
+================================================
+Pengganti loop `su -c "ip -6 addr add ..."` di ip_manager.sh. Semua alamat
+dikirim lewat satu socket NETLINK_ROUTE dalam batch, lalu diverifikasi
+dengan dump RTM_GETADDR sampai DAD selesai. Hasilnya disimpan ke
+added_ips.txt (untuk restart) dan langsung dikirim ke proxy yang sedang
+jalan lewat control socket (proxy.ctl / proxy-w<N>.ctl), jadi proxy tidak
+perlu membaca ulang file.
+
+Butuh CAP_NET_ADMIN — di Termux jalankan lewat su (ip_manager.sh sudah
+melakukannya):
+
+  python3 pool_manager.py setup [N]   → buat pool baru N IP (default IP_POOL_COUNT)
+  python3 pool_manager.py remove      → hapus seluruh pool
+  python3 pool_manager.py rotate IDX  → ganti IP slot IDX (0-based)
+  python3 pool_manager.py verify      → cek pool di added_ips.txt masih terpasang
+  python3 pool_manager.py list        → tampilkan pool
+  python3 pool_manager.py serve       → daemon root di pool.ctl (dipakai api_server)
+  python3 pool_manager.py stop        → hentikan daemon
+
+Rotasi selalu make-before-break: IP baru dipasang + lolos DAD, mapping
+user di proxy diganti atomik, tunnel di IP lama dibiarkan selesai sampai
+ROTATE_GRACE_SEC, baru IP lama dilepas.
+
+Exit code 3 = netlink tidak bisa dipakai (tanpa root / bukan Linux).
+"""
+
+import os, sys, json, time, glob, errno, socket, struct, secrets, ipaddress, logging, threading
+
+KUYDIR     = os.path.expanduser("~/kuyproxy")
+CONFIG     = os.path.join(KUYDIR, "config.cfg")
+IP_LIST    = os.path.join(KUYDIR, "added_ips.txt")
+IFACE_FILE = os.path.join(KUYDIR, "interface.txt")
+CTL_FILE   = os.path.join(KUYDIR, "proxy.ctl")
+POOL_CTL   = os.path.join(KUYDIR, "pool.ctl")
+
+POOL_MAX     = 1000
+DAD_TIMEOUT  = 5.0     # detik menunggu alamat lepas dari tentative
+ADD_RETRIES  = 3       # putaran ulang untuk alamat yang gagal / bentrok
+ROTATE_GRACE = 60      # detik default tunnel di IP lama boleh selesai
+
+log = logging.getLogger("POOL")
+
+def worker_ctl_file(worker_id):
+    return os.path.join(KUYDIR, f"proxy-w{worker_id}.ctl")
+
+def load_cfg():
+    cfg = {}
+    try:
+        with open(CONFIG) as f:
+            for line in f:
+                line = line.strip()
+                if "=" in line and not line.startswith("#"):
+                    k, _, v = line.partition("=")
+                    cfg[k.strip()] = v.strip().strip('"')
+    except FileNotFoundError:
+        pass
+    return cfg
+
+def read_pool():
+    try:
+        with open(IP_LIST) as f:
+            return [l.strip() for l in f if l.strip()]
+    except FileNotFoundError:
+        return []
+
+# ── rtnetlink ─────────────────────────────────────────────────
+NLMSG      = struct.Struct("=IHHII")      # len, type, flags, seq, pid
+IFADDRMSG  = struct.Struct("=BBBBi")      # family, prefixlen, flags, scope, index
+RTATTR     = struct.Struct("=HH")
+NLMSG_ERR  = struct.Struct("=i")
+
+NLMSG_ERROR, NLMSG_DONE = 2, 3
+RTM_NEWADDR, RTM_DELADDR, RTM_GETADDR = 20, 21, 22
+NLM_F_REQUEST, NLM_F_ACK = 0x1, 0x4
+NLM_F_EXCL, NLM_F_CREATE, NLM_F_DUMP = 0x200, 0x400, 0x300
+IFA_ADDRESS, IFA_LOCAL, IFA_FLAGS = 1, 2, 8
+IFA_F_DADFAILED, IFA_F_TENTATIVE = 0x08, 0x40
+RT_SCOPE_UNIVERSE = 0
+
+BATCH_BYTES = 32 * 1024   # request per sendmsg; ack-nya muat di SO_RCVBUF
+ACK_TIMEOUT = 2.0         # detik menunggu ack satu batch; sisanya dianggap ETIMEDOUT
+
+class NetlinkError(OSError):
+    pass
+
+def _align(n):
+    return (n + 3) & ~3
+
+def _attr(kind, data):
+    return (RTATTR.pack(RTATTR.size + len(data), kind) + data).ljust(_align(RTATTR.size + len(data)), b"\0")
+
+def _attrs(buf, pos, end):
+    while pos + RTATTR.size <= end:
+        ln, kind = RTATTR.unpack_from(buf, pos)
+        if ln < RTATTR.size:
+            break
+        yield kind, buf[pos + RTATTR.size:pos + ln]
+        pos += _align(ln)
+
+class Netlink:
+    """Socket NETLINK_ROUTE untuk alamat IPv6. Request dikirim berderet
+    dalam satu buffer (NLM_F_ACK per pesan) dan ack-nya dicocokkan per seq."""
+
+    def __init__(self):
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        except (AttributeError, OSError) as e:
+            raise NetlinkError(f"netlink tidak tersedia: {e}")
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+        self.sock.bind((0, 0))
+        self.sock.settimeout(ACK_TIMEOUT)
+        self.seq = int(time.time()) & 0x7FFFFFFF
+
+    def close(self):
+        self.sock.close()
+
+    def _pack(self, mtype, flags, body):
+        self.seq = (self.seq + 1) & 0x7FFFFFFF
+        return self.seq, NLMSG.pack(NLMSG.size + len(body), mtype, flags, self.seq, 0) + body
+
+    def _messages(self):
+        data = self.sock.recv(1 << 20)
+        pos = 0
+        while pos + NLMSG.size <= len(data):
+            ln, mtype, flags, seq, _ = NLMSG.unpack_from(data, pos)
+            if ln < NLMSG.size:
+                break
+            yield mtype, seq, data[pos + NLMSG.size:pos + ln]
+            pos += _align(ln)
+
+    def batch(self, requests):
+        """[(type, flags, body)] → [errno] sesuai urutan (0 = sukses).
+        Request yang ack-nya tidak datang dalam ACK_TIMEOUT → ETIMEDOUT."""
+        results = [0] * len(requests)
+        i = 0
+        while i < len(requests):
+            buf, pending = bytearray(), {}
+            while i < len(requests) and len(buf) < BATCH_BYTES:
+                mtype, flags, body = requests[i]
+                seq, msg = self._pack(mtype, flags | NLM_F_REQUEST | NLM_F_ACK, body)
+                pending[seq] = i
+                buf += msg
+                i += 1
+            self.sock.sendall(buf)
+            deadline = time.monotonic() + ACK_TIMEOUT
+            try:
+                while pending and time.monotonic() < deadline:
+                    for mtype, seq, payload in self._messages():
+                        if mtype == NLMSG_ERROR and seq in pending:
+                            results[pending.pop(seq)] = -NLMSG_ERR.unpack_from(payload)[0]
+            except socket.timeout:
+                pass
+            for idx in pending.values():
+                results[idx] = errno.ETIMEDOUT
+        return results
+
+    def addrs(self):
+        """Dump semua alamat IPv6 → [(index, ip, prefixlen, flags, scope)]."""
+        seq, msg = self._pack(RTM_GETADDR, NLM_F_REQUEST | NLM_F_DUMP,
+                              IFADDRMSG.pack(socket.AF_INET6, 0, 0, 0, 0))
+        self.sock.sendall(msg)
+        out = []
+        while True:
+            for mtype, mseq, payload in self._messages():
+                if mseq != seq:
+                    continue
+                if mtype == NLMSG_DONE:
+                    return out
+                if mtype == NLMSG_ERROR:
+                    err = -NLMSG_ERR.unpack_from(payload)[0]
+                    raise NetlinkError(err, os.strerror(err))
+                if mtype != RTM_NEWADDR:
+                    continue
+                family, plen, flags, scope, index = IFADDRMSG.unpack_from(payload)
+                ip = None
+                for kind, data in _attrs(payload, IFADDRMSG.size, len(payload)):
+                    if kind in (IFA_LOCAL, IFA_ADDRESS) and len(data) == 16 and ip is None:
+                        ip = socket.inet_ntop(socket.AF_INET6, data)
+                    elif kind == IFA_FLAGS and len(data) >= 4:
+                        flags = struct.unpack_from("=I", data)[0]
+                if ip:
+                    out.append((index, ip, plen, flags, scope))
+
+def _addr_body(index, ip, prefixlen=64):
+    raw = socket.inet_pton(socket.AF_INET6, ip)
+    return (IFADDRMSG.pack(socket.AF_INET6, prefixlen, 0, RT_SCOPE_UNIVERSE, index)
+            + _attr(IFA_LOCAL, raw) + _attr(IFA_ADDRESS, raw))
+
+# ── Control Socket Client ─────────────────────────────────────
+# proxy_server.py mendengarkan di proxy.ctl (single process) atau
+# proxy-w<N>.ctl (per worker). Protokol: satu baris JSON request,
+# satu baris JSON response.
+
+def ctl_paths():
+    return [CTL_FILE] + sorted(glob.glob(os.path.join(KUYDIR, "proxy-w*.ctl")))
+
+def ctl_request(path, msg, timeout=5):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(json.dumps(msg).encode() + b"\n")
+        buf = b""
+        while not buf.endswith(b"\n"):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            buf += chunk
+    return json.loads(buf or b"{}")
+
+def ctl_broadcast(msg, timeout=5):
+    """Kirim ke semua proses proxy yang hidup → [response]. Socket basi
+    (proses sudah mati) dilewati."""
+    out = []
+    for path in ctl_paths():
+        try:
+            out.append(ctl_request(path, msg, timeout))
+        except (OSError, ValueError):
+            pass
+    return out
+
+# ── Pool Manager ──────────────────────────────────────────────
+class PoolManager:
+    def __init__(self, cfg=None):
+        self.cfg = cfg if cfg is not None else load_cfg()
+        self.nl  = Netlink()
+        self.iface = self.index = self.prefix = None
+
+    def close(self):
+        self.nl.close()
+
+    def detect(self):
+        """Interface + prefix /64 dari alamat global pertama yang bukan
+        bagian pool. NETWORK_INTERFACE di config memaksa interface."""
+        forced = self.cfg.get("NETWORK_INTERFACE", "")
+        pool   = set(read_pool())
+        names  = {i: n for i, n in socket.if_nameindex()}
+        for index, ip, plen, flags, scope in self.nl.addrs():
+            if scope != RT_SCOPE_UNIVERSE or plen > 64 or ip in pool:
+                continue
+            if flags & (IFA_F_TENTATIVE | IFA_F_DADFAILED):
+                continue
+            if forced and names.get(index) != forced:
+                continue
+            self.iface, self.index = names.get(index), index
+            self.prefix = ipaddress.IPv6Network(f"{ip}/64", strict=False)
+            return self.iface, self.prefix
+        if forced and forced in names.values():
+            self.iface = forced
+            self.index = socket.if_nametoindex(forced)
+        return self.iface, None
+
+    def _ensure(self):
+        if self.prefix is None:
+            self.detect()
+        if self.prefix is None:
+            raise NetlinkError("prefix IPv6 /64 tidak ditemukan")
+
+    def _random(self, taken):
+        while True:
+            iid = secrets.randbits(64)
+            if iid <= 1:
+                continue
+            ip = str(self.prefix[iid])
+            if ip not in taken:
+                taken.add(ip)
+                return ip
+
+    def _status(self, ips):
+        """{ip: "ok" | "tentative" | "failed"} untuk alamat di interface pool."""
+        want, found = set(ips), {}
+        for index, ip, plen, flags, scope in self.nl.addrs():
+            if index == self.index and ip in want:
+                if flags & IFA_F_DADFAILED:
+                    found[ip] = "failed"
+                elif flags & IFA_F_TENTATIVE:
+                    found[ip] = "tentative"
+                else:
+                    found[ip] = "ok"
+        return {ip: found.get(ip, "failed") for ip in ips}
+
+    def wait_dad(self, ips, timeout=DAD_TIMEOUT):
+        """Tunggu DAD selesai → (ok, failed). Yang masih tentative saat
+        timeout dihitung gagal."""
+        deadline = time.monotonic() + timeout
+        while True:
+            st = self._status(ips)
+            if "tentative" not in st.values() or time.monotonic() >= deadline:
+                ok = [ip for ip in ips if st[ip] == "ok"]
+                return ok, [ip for ip in ips if st[ip] != "ok"]
+            time.sleep(0.1)
+
+    def add(self, n, taken=None):
+        """Tambah n alamat acak terverifikasi di prefix /64 → [ip]."""
+        self._ensure()
+        taken = set(taken or ()) | {ip for _, ip, _, _, _ in self.nl.addrs()}
+        added = []
+        for _ in range(ADD_RETRIES):
+            want = n - len(added)
+            if want <= 0:
+                break
+            ips  = [self._random(taken) for _ in range(want)]
+            errs = self.nl.batch([(RTM_NEWADDR, NLM_F_CREATE | NLM_F_EXCL, _addr_body(self.index, ip))
+                                  for ip in ips])
+            sent = [ip for ip, err in zip(ips, errs) if not err]
+            for ip, err in zip(ips, errs):
+                if err and err != errno.EEXIST:
+                    log.warning(f"add {ip}: {os.strerror(err)}")
+                    if err in (errno.EPERM, errno.EACCES):
+                        raise NetlinkError(err, os.strerror(err))
+            ok, failed = self.wait_dad(sent)
+            if failed:
+                log.warning(f"{len(failed)} IP gagal DAD / verifikasi, diganti")
+                self.delete(failed)
+            added += ok
+        return added
+
+    def delete(self, ips):
+        if not ips:
+            return 0
+        if self.index is None:
+            self.detect()
+        if self.index is None:
+            return 0
+        errs = self.nl.batch([(RTM_DELADDR, 0, _addr_body(self.index, ip)) for ip in ips])
+        return sum(1 for e in errs if not e)
+
+    # ── Operasi pool ─────────────────────────
+    def setup(self, count=None):
+        count = count or int(self.cfg.get("IP_POOL_COUNT", 10) or 10)
+        count = max(0, min(POOL_MAX, count))
+        if self.prefix is None:
+            self.detect()
+        if self.prefix is None:
+            log.warning("⚠️  Prefix IPv6 tidak ditemukan — Single IP mode")
+            publish([])
+            return []
+        log.info(f"Interface {self.iface}, prefix {self.prefix}")
+        # Pool baru dipasang dulu, pool lama dilepas setelah proxy pindah
+        old  = read_pool()
+        t0   = time.monotonic()
+        pool = self.add(count, taken=old)
+        publish(pool, self.iface)
+        self.delete(old)
+        log.info(f"✅ Pool ready: {len(pool)}/{count} IPs in {time.monotonic() - t0:.2f}s")
+        return pool
+
+    def remove(self):
+        old = read_pool()
+        n = self.delete(old)
+        publish([], self.iface)
+        log.info(f"✅ Removed {n} IPs")
+        return n
+
+    @property
+    def grace(self):
+        return float(self.cfg.get("ROTATE_GRACE_SEC", ROTATE_GRACE) or 0)
+
+    def switch(self, idxs):
+        """Langkah 1-2 rotasi: IP baru dipasang & lolos DAD (satu batch
+        netlink), lalu slot diganti di semua proses proxy sekaligus →
+        [(idx, old, new)]. IP lama masih terpasang."""
+        pool = read_pool()
+        idxs = list(dict.fromkeys(idxs))
+        for idx in idxs:
+            if not 0 <= idx < len(pool):
+                raise IndexError(f"user index {idx} out of range")
+        new = self.add(len(idxs), taken=pool)
+        if not new:
+            raise NetlinkError("IP baru gagal ditambahkan")
+        done = []
+        for idx, ip in zip(idxs, new):
+            done.append((idx, pool[idx], ip))
+            pool[idx] = ip
+        publish(pool, self.iface)
+        for idx, old, ip in done:
+            log.info(f"✅ user{idx + 1}: {old} → {ip}")
+        if len(done) < len(idxs):
+            log.warning(f"{len(idxs) - len(done)} user tidak dirotasi (IP baru kurang)")
+        return done
+
+    def rotate(self, idx, grace=None):
+        """Rotasi lengkap satu user (blocking sampai IP lama dilepas) → (old, new)."""
+        (_, old, new), = self.switch([idx])
+        drain([old], self.grace if grace is None else grace, lambda ip: self.delete([ip]))
+        return old, new
+
+    def verify(self):
+        pool = read_pool()
+        if self.index is None:
+            self.detect()
+        st = self._status(pool) if self.index is not None else dict.fromkeys(pool, "failed")
+        return {ip: st[ip] for ip in pool}
+
+def drain(ips, grace, retire):
+    """Tunggu tunnel yang masih bind ke IP lama selesai (maks `grace` detik).
+    Koneksi upstream idle di IP itu langsung ditutup proxy. `retire(ip)`
+    dipanggil begitu satu IP kosong, sisanya saat grace habis."""
+    pending  = set(ips)
+    deadline = time.monotonic() + grace
+    while pending:
+        busy = {}
+        for r in ctl_broadcast({"cmd": "drain_ip", "ips": sorted(pending)}):
+            for ip, n in r.get("busy", {}).items() if r.get("ok") else ():
+                busy[ip] = busy.get(ip, 0) + n
+        if time.monotonic() >= deadline:
+            for ip, n in busy.items():
+                log.warning(f"Grace habis — {n} tunnel di {ip} diputus")
+            busy = {}
+        for ip in pending - set(busy):
+            retire(ip)
+        pending &= set(busy)
+        if pending:
+            time.sleep(0.5)
+
+def publish(pool, iface=None):
+    """Simpan pool (atomic) untuk restart lalu dorong ke proxy yang jalan."""
+    tmp = IP_LIST + ".tmp"
+    with open(tmp, "w") as f:
+        f.writelines(f"{ip}\n" for ip in pool)
+    _chown_like_kuydir(tmp)
+    os.replace(tmp, IP_LIST)
+    if iface:
+        with open(IFACE_FILE, "w") as f:
+            f.write(f"{iface}\n")
+        _chown_like_kuydir(IFACE_FILE)
+    return ctl_broadcast({"cmd": "pool", "ips": pool})
+
+def _chown_like_kuydir(path):
+    # Dijalankan via su: file tetap milik user Termux supaya script lain bisa menulis
+    try:
+        st = os.stat(KUYDIR)
+        if os.geteuid() == 0 and st.st_uid != 0:
+            os.chown(path, st.st_uid, st.st_gid)
+    except OSError:
+        pass
+
+# ── Daemon ────────────────────────────────────────────────────
+# `pool_manager.py serve` dijalankan sekali lewat su saat start. api_server
+# mengirim perintah ke pool.ctl (protokol sama dengan proxy.ctl), jadi
+# rotasi tidak perlu fork bash / su / ip per request. Drain IP lama jalan
+# di thread sendiri, response dikirim begitu user sudah pindah IP.
+
+class PoolServer:
+    def __init__(self, pm):
+        self.pm       = pm
+        self.lock     = threading.Lock()       # netlink + added_ips.txt
+        self.draining = {}                     # IP lama → deadline
+        self.stopped  = threading.Event()
+
+    def handle(self, msg):
+        cmd = msg.get("cmd")
+        if cmd == "ping":
+            return {"pid": os.getpid()}
+        if cmd == "status":
+            now = time.monotonic()
+            return {"pool": read_pool(), "iface": self.pm.iface,
+                    "draining": {ip: max(0, int(d - now)) for ip, d in self.draining.items()}}
+        if cmd == "rotate":
+            if "idxs" in msg:
+                return self.rotate([int(i) for i in msg["idxs"]], msg.get("grace"))
+            r = self.rotate([int(msg.get("idx", 0))], msg.get("grace"))
+            return dict(r["rotated"][0], grace=r["grace"])
+        if cmd == "setup":
+            with self.lock:
+                self.pm.cfg = load_cfg()
+                return {"pool": len(self.pm.setup(msg.get("count")))}
+        if cmd == "remove":
+            with self.lock:
+                return {"removed": self.pm.remove()}
+        if cmd == "verify":
+            with self.lock:
+                return {"status": self.pm.verify()}
+        if cmd == "stop":
+            self.stopped.set()
+            return {}
+        raise ValueError(f"unknown command {cmd!r}")
+
+    def rotate(self, idxs, grace=None):
+        with self.lock:
+            self.pm.cfg = load_cfg()
+            grace = self.pm.grace if grace is None else float(grace)
+            done  = self.pm.switch(idxs)
+        olds = [old for _, old, _ in done]
+        deadline = time.monotonic() + grace
+        for old in olds:
+            self.draining[old] = deadline
+        threading.Thread(target=self._drain, args=(olds, grace), daemon=True).start()
+        rotated = {idx for idx, _, _ in done}
+        return {"rotated": [{"user": idx + 1, "old": old, "new": new} for idx, old, new in done],
+                "failed": [idx + 1 for idx in idxs if idx not in rotated],
+                "grace": grace}
+
+    def _retire(self, old):
+        with self.lock:
+            self.pm.delete([old])
+        self.draining.pop(old, None)
+        log.info(f"IP lama {old} dilepas")
+
+    def _drain(self, olds, grace):
+        try:
+            drain(olds, grace, self._retire)
+        finally:
+            for old in [ip for ip in olds if ip in self.draining]:
+                self._retire(old)
+
+    def _client(self, conn):
+        with conn:
+            try:
+                conn.settimeout(30)
+                buf = b""
+                while not buf.endswith(b"\n") and len(buf) < (1 << 20):
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        break
+                    buf += chunk
+                reply = dict(self.handle(json.loads(buf)), ok=True)
+            except Exception as e:
+                reply = {"ok": False, "error": str(e)}
+            try:
+                conn.sendall(json.dumps(reply).encode() + b"\n")
+            except OSError:
+                pass
+
+    def serve(self, path=POOL_CTL):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        srv.bind(path)
+        os.chmod(path, 0o600)
+        _chown_like_kuydir(path)               # api_server jalan sebagai user Termux
+        srv.listen(16)
+        srv.settimeout(1)
+        log.info(f"Pool daemon listening on {path} (pid {os.getpid()})")
+        while not self.stopped.is_set():
+            try:
+                conn, _ = srv.accept()
+            except socket.timeout:
+                continue
+            threading.Thread(target=self._client, args=(conn,), daemon=True).start()
+        srv.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        for old in list(self.draining):         # jangan tinggalkan IP yatim
+            with self.lock:
+                self.pm.delete([old])
+
+def pool_request(msg, timeout=30):
+    """Kirim perintah ke daemon pool.ctl. OSError kalau daemon tidak jalan."""
+    return ctl_request(POOL_CTL, msg, timeout)
+
+# ── CLI ───────────────────────────────────────────────────────
+def main(argv):
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [IP] %(message)s", datefmt="%H:%M:%S")
+    cmd = argv[1] if len(argv) > 1 else "help"
+    if cmd == "list":
+        for i, ip in enumerate(read_pool(), 1):
+            print(f"user{i:<3} → {ip}")
+        return 0
+    if cmd not in ("setup", "remove", "rotate", "verify", "serve", "stop"):
+        print(f"Usage: {argv[0]} {{setup [N]|remove|rotate <idx>|verify|list|serve|stop}}")
+        return 1
+    if cmd != "serve":
+        # Daemon jalan → serahkan ke sana supaya pool tidak diubah dua proses
+        msg = {"cmd": cmd}
+        if cmd == "setup" and len(argv) > 2:
+            msg["count"] = int(argv[2])
+        if cmd == "rotate":
+            msg["idx"] = int(argv[2]) if len(argv) > 2 else 0
+        try:
+            reply = pool_request(msg, timeout=120)
+        except OSError:
+            if cmd == "stop":
+                return 0
+        else:
+            if not reply.get("ok"):
+                log.error(f"❌ {reply.get('error')}")
+                return 1
+            if cmd == "rotate":
+                log.info(f"✅ user{reply['user']}: {reply['old']} → {reply['new']} "
+                         f"(IP lama di-drain {reply['grace']:.0f}s)")
+            elif cmd == "verify":
+                bad = {ip: s for ip, s in reply["status"].items() if s != "ok"}
+                for ip, s in bad.items():
+                    print(f"{ip} {s}")
+                return 1 if bad else 0
+            elif cmd == "setup":
+                log.info(f"✅ Pool ready: {reply['pool']} IPs")
+                return 0 if reply["pool"] else 1
+            return 0
+    try:
+        pm = PoolManager()
+    except NetlinkError as e:
+        log.error(f"❌ {e}")
+        return 3
+    try:
+        if cmd == "serve":
+            pm.detect()
+            PoolServer(pm).serve()
+            return 0
+        if cmd == "setup":
+            pool = pm.setup(int(argv[2]) if len(argv) > 2 else None)
+            return 0 if pool else 1
+        if cmd == "remove":
+            pm.remove()
+        elif cmd == "rotate":
+            pm.rotate(int(argv[2]) if len(argv) > 2 else 0)
+        elif cmd == "verify":
+            bad = {ip: s for ip, s in pm.verify().items() if s != "ok"}
+            for ip, s in bad.items():
+                print(f"{ip} {s}")
+            return 1 if bad else 0
+        return 0
+    except NetlinkError as e:
+        log.error(f"❌ {e}")
+        return 3 if e.errno in (errno.EPERM, errno.EACCES) else 1
+    except (IndexError, ValueError) as e:
+        log.error(f"❌ {e}")
+        return 1
+    finally:
+        pm.close()
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -3,46 +3,638 @@
 proxy_server.py — KuyProxy Unified Proxy Daemon
 ================================================
 Menjalankan DUA server sekaligus dalam satu proses:
-  1. SOCKS5 Server (port 1080) — sticky IP via username
+  1. SOCKS5 Server (port 1080) — sticky IP via username (CONNECT + UDP ASSOCIATE)
   2. HTTP Proxy   (port 8118) — sticky IP via Proxy-Authorization header
 
 Sticky IP Mapping:
   user1 → IPv6 pool[0]
   user2 → IPv6 pool[1]
   user3 → IPv6 pool[2]  ...dst
+  + mapping eksplisit di user_map.txt, atau hashing konsisten
+    untuk username bebas (STICKY_MODE=hash)
 
 Semua traffic outbound di-bind dari IPv6 spesifik sesuai user,
 sehingga setiap user punya IP publik berbeda.
+
+Engine (PROXY_ENGINE di config.cfg):
+  thread — satu worker thread per sesi (ThreadPoolExecutor, default)
+  async  — semua sesi sebagai coroutine di satu asyncio event loop
 """
 
-import socket, threading, select, struct, os, sys, base64
-import logging, time, json, signal
+import socket, threading, select, struct, os, sys, base64, subprocess
+import logging, time, json, signal, asyncio, errno, collections, hashlib
+import ipaddress, bisect, heapq, random
 from concurrent.futures import ThreadPoolExecutor
+from stats_shm import StatsWriter, SHM_FILE, worker_shm_file, HIST_NAMES, HIST_BOUNDS, HIST_WIDTH
+from pool_manager import CTL_FILE, worker_ctl_file
 
 # ── Config ────────────────────────────────────────────────────
 KUYDIR   = os.path.expanduser("~/kuyproxy")
 CONFIG   = os.path.join(KUYDIR, "config.cfg")
 IP_LIST  = os.path.join(KUYDIR, "added_ips.txt")
+USER_MAP = os.path.join(KUYDIR, "user_map.txt")
 LOG_FILE = os.path.join(KUYDIR, "logs", "proxy.log")
+ACCESS_LOG = os.path.join(KUYDIR, "logs", "access.log")
 
 os.makedirs(os.path.join(KUYDIR, "logs"), exist_ok=True)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(name)s] %(message)s",
-    datefmt="%H:%M:%S",
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler(LOG_FILE, encoding="utf-8"),
-    ]
-)
+# ── Logging ───────────────────────────────────────────────────
+# Thread sesi / event loop hanya append ke deque (tanpa lock, tanpa I/O);
+# thread writer mengosongkannya tiap LOG_FLUSH_INTERVAL dan menulis satu
+# write() per file per batch. Antrian penuh → record dibuang & dihitung,
+# koneksi tidak pernah menunggu disk / stdout.
+LOG_QUEUE_MAX      = 10000
+LOG_FLUSH_INTERVAL = 0.2
+LOG_FORMAT         = logging.Formatter("%(asctime)s [%(name)s] %(message)s", "%H:%M:%S")
+
+def _same_file(stream, path):
+    # nohup ... >> proxy.log: stdout == LOG_FILE → jangan tulis dua kali
+    try:
+        a, b = os.fstat(stream.fileno()), os.stat(path)
+        return (a.st_dev, a.st_ino) == (b.st_dev, b.st_ino)
+    except (OSError, ValueError, AttributeError):
+        return False
+
+class LogPipeline(logging.Handler):
+    """Handler logging non-blocking + access log per tunnel."""
+
+    def __init__(self):
+        super().__init__()
+        self.queue   = collections.deque()
+        self.dropped = 0
+        self.sampled = 0
+        self.total_dropped = 0
+        self.sample  = {}             # levelno → rate (0..1), ERROR ke atas selalu
+        self.access_rate = 1.0
+        self.flushing = threading.Lock()
+        self.log_fd = os.open(LOG_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.access_fd = None
+        self.stdout = None if _same_file(sys.stdout, LOG_FILE) else sys.stdout
+        self._start()
+
+    def _start(self):
+        threading.Thread(target=self._writer, daemon=True, name="log-writer").start()
+
+    def after_fork(self):
+        # Worker prefork: thread writer tidak ikut ter-fork
+        self.flushing = threading.Lock()
+        self.createLock()
+        self._start()
+
+    def configure(self, cfg):
+        global LOG_QUEUE_MAX
+        def rate(key):
+            try:
+                return min(1.0, max(0.0, float(cfg.get(key, 1) or 0)))
+            except ValueError:
+                return 1.0
+        LOG_QUEUE_MAX = int(cfg.get("LOG_QUEUE_MAX", LOG_QUEUE_MAX) or LOG_QUEUE_MAX)
+        self.sample = {lvl: r for lvl, r in ((logging.DEBUG, rate("LOG_SAMPLE_DEBUG")),
+                                             (logging.INFO, rate("LOG_SAMPLE_INFO")),
+                                             (logging.WARNING, rate("LOG_SAMPLE_WARNING")))
+                       if r < 1}
+        self.access_rate = rate("LOG_ACCESS_SAMPLE")
+        if self.access_rate and self.access_fd is None:
+            self.access_fd = os.open(ACCESS_LOG, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _put(self, item):
+        if len(self.queue) >= LOG_QUEUE_MAX:
+            self.dropped += 1
+        else:
+            self.queue.append(item)
+
+    # Seperti QueueHandler: hanya emit, filter + lock tetap lewat Handler.handle
+    def emit(self, record):
+        rate = self.sample.get(record.levelno)
+        if rate is not None and random.random() >= rate:
+            self.sampled += 1
+            return
+        self._put(record)
+
+    def access(self, t):
+        """Satu record per tunnel (dipanggil saat tunnel ditutup)."""
+        if self.access_fd is None or (self.access_rate < 1 and random.random() >= self.access_rate):
+            return
+        self._put((time.time(), t.proto, t.user, t.bind_ip, t.target,
+                   t.opened - t.started if t.opened else 0.0, t.bytes_up, t.bytes_down, t.started))
+
+    @staticmethod
+    def _access_line(item):
+        # ts proto user bind_ip target setup_ms dur_ms up down
+        end, proto, user, bind_ip, target, setup, up, down, started = item
+        return (f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(end))} {proto or '-'} "
+                f"{user or 'anon'} {bind_ip or 'default'} {target or '-'} "
+                f"{int(setup * 1000)} {int((end - started) * 1000)} {up} {down}\n")
+
+    def flush(self):
+        with self.flushing:
+            q, lines, access = self.queue, [], []
+            for _ in range(len(q)):
+                item = q.popleft()
+                if isinstance(item, tuple):
+                    access.append(self._access_line(item))
+                else:
+                    try:
+                        lines.append(LOG_FORMAT.format(item) + "\n")
+                    except Exception:
+                        pass
+            if self.dropped:
+                n, self.dropped = self.dropped, 0
+                self.total_dropped += n
+                lines.append(f"{time.strftime('%H:%M:%S')} [LOG  ] {n} record dibuang (antrian penuh)\n")
+            if lines:
+                data = "".join(lines)
+                _write_all(self.log_fd, data.encode("utf-8", "replace"))
+                if self.stdout is not None:
+                    try:
+                        self.stdout.write(data)
+                        self.stdout.flush()
+                    except (OSError, ValueError):
+                        self.stdout = None
+            if access and self.access_fd is not None:
+                _write_all(self.access_fd, "".join(access).encode("utf-8", "replace"))
+
+    def _writer(self):
+        while True:
+            time.sleep(LOG_FLUSH_INTERVAL)
+            if self.queue or self.dropped:
+                try:
+                    self.flush()
+                except Exception:
+                    pass
+
+    def close(self):
+        self.flush()
+        super().close()
+
+def _write_all(fd, data):
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    except OSError:
+        pass
+
+log_pipeline = LogPipeline()
+logging.basicConfig(level=logging.INFO, handlers=[log_pipeline])
+os.register_at_fork(after_in_child=log_pipeline.after_fork)
 
 s5_log  = logging.getLogger("SOCKS5")
 http_log = logging.getLogger("HTTP  ")
+relay_log = logging.getLogger("RELAY ")
 
 # ── Stats ─────────────────────────────────────────────────────
-stats = {"connections": 0, "bytes_up": 0, "bytes_down": 0}
-stats_lock = threading.Lock()
+# Counter per (user, bind_ip, proto). Field index ke row counter:
+STAT_FIELDS = ("connections", "bytes_up", "bytes_down", "errors", "connects", "connect_ms")
+F_CONNS, F_UP, F_DOWN, F_ERRORS, F_CONNECTS, F_CONNECT_MS = range(len(STAT_FIELDS))
+# Histogram latency setup, urutan sama dengan stats_shm.HIST_NAMES
+H_AUTH, H_DNS, H_CONNECT, H_FIRST_BYTE = range(len(HIST_NAMES))
+STATS_INTERVAL     = 1
+STATS_LOG_INTERVAL = 60
+stats_writer       = None    # StatsWriter → stats.shm, dibaca api_server /stats
+
+class Tunnel:
+    """Counter per tunnel. Hanya ditulis oleh relay tunnel itu sendiri,
+    jadi tidak perlu lock per chunk; total di-fold ke shard saat tutup."""
+    __slots__ = ("user", "bind_ip", "proto", "bytes_up", "bytes_down", "started",
+                 "limits", "limits_gen", "admitted", "target", "opened")
+
+    def __init__(self, user=None, bind_ip=None, proto=""):
+        self.user       = user
+        self.bind_ip    = bind_ip
+        self.proto      = proto
+        self.bytes_up   = 0
+        self.bytes_down = 0
+        self.started    = time.time()
+        self.limits     = None    # (bucket up, bucket down) dari RateLimiter
+        self.limits_gen = -1
+        self.admitted   = None    # scope yang dihitung RateLimiter.admit
+        self.target     = None    # "host:port" untuk access log
+        self.opened     = 0.0     # waktu relay mulai (setup = opened - started)
+
+    def key(self):
+        return stats_key(self.user, self.bind_ip, self.proto)
+
+def stats_key(user, bind_ip, proto):
+    return (user or "anon", bind_ip or "default", proto or "-")
+
+# add/discard set atomic di bawah GIL, tidak perlu lock
+active_tunnels = set()
+
+class _Shard:
+    """Counter milik satu thread: rows (key → list counter), histogram
+    latency setup, dan flag busy worker."""
+    __slots__ = ("rows", "hist", "busy")
+
+    def __init__(self):
+        self.rows = {}
+        self.hist = [[0] * HIST_WIDTH for _ in HIST_NAMES]
+        self.busy = 0
+
+class TrafficStats:
+    """Counter traffic tanpa lock di jalur panas.
+
+    Tiap thread menulis ke shard miliknya sendiri (_Shard). Thread stats
+    mengagregasi semua shard secara periodik dan menambahkan byte tunnel
+    yang masih hidup dari `active_tunnels`. Lock hanya dipakai saat shard
+    baru didaftarkan / saat agregasi."""
+
+    def __init__(self):
+        self._local   = threading.local()
+        self._shards  = []          # [(thread, _Shard)]
+        self._retired = _Shard()    # gabungan shard dari thread yang sudah mati
+        self._prev    = {}          # hasil agregasi terakhir (counter dijaga monoton)
+        self._lock    = threading.Lock()
+        self.last     = self._summarize({}, collections.Counter())
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def add(self, key, field, n=1):
+        rows = self._shard().rows
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = [0] * len(STAT_FIELDS)
+        row[field] += n
+
+    def observe(self, hist, seconds):
+        """Catat durasi ke histogram bucket tetap (H_AUTH, H_DNS, ...)."""
+        row = self._shard().hist[hist]
+        row[bisect.bisect_left(HIST_BOUNDS, seconds)] += 1
+        row[-1] += int(seconds * 1e6)
+
+    def connected(self, key, started):
+        """Catat connect upstream sukses, `started` = time.monotonic() awal connect."""
+        elapsed = time.monotonic() - started
+        self.add(key, F_CONNECTS)
+        self.add(key, F_CONNECT_MS, int(elapsed * 1000))
+        self.observe(H_CONNECT, elapsed)
+
+    def first_byte(self, tunnel):
+        self.observe(H_FIRST_BYTE, time.time() - tunnel.started)
+
+    def set_busy(self, busy):
+        self._shard().busy = busy
+
+    @staticmethod
+    def _fold(acc, shard):
+        for key, row in shard.rows.copy().items():
+            # dict.copy() atomic di bawah GIL, aman walau owner sedang insert
+            dst = acc.rows.get(key)
+            if dst is None:
+                acc.rows[key] = list(row)
+            else:
+                for i, v in enumerate(row):
+                    dst[i] += v
+        for dst, row in zip(acc.hist, shard.hist):
+            for i, v in enumerate(row):
+                dst[i] += v
+
+    def collect(self):
+        """Agregasi semua shard → dict total / users / ips / protos / hist."""
+        acc = _Shard()
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    self._fold(self._retired, shard)
+            self._shards = alive
+            self._fold(acc, self._retired)
+            for _, shard in alive:
+                self._fold(acc, shard)
+                acc.busy += shard.busy
+        rows = acc.rows
+
+        active = collections.Counter()
+        for t in list(active_tunnels):
+            key = t.key()
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = [0] * len(STAT_FIELDS)
+            row[F_UP]   += t.bytes_up
+            row[F_DOWN] += t.bytes_down
+            active[key] += 1
+
+        # Tunnel yang baru tutup bisa sesaat tidak terhitung di kedua sisi;
+        # ambil max dengan hasil sebelumnya supaya counter tidak pernah turun
+        for key, row in rows.items():
+            prev = self._prev.get(key)
+            if prev:
+                for i, v in enumerate(prev):
+                    if v > row[i]:
+                        row[i] = v
+        self._prev = rows
+        out = self._summarize(rows, active)
+        out["hist"] = acc.hist
+        out["busy"] = acc.busy
+        self.last = out
+        return out
+
+    @staticmethod
+    def _summarize(rows, active):
+        def entry():
+            return dict.fromkeys(STAT_FIELDS + ("active",), 0)
+        total = entry()
+        users, ips, protos = {}, {}, {}
+        for key, row in rows.items():
+            for d in (total,
+                      users.setdefault(key[0], entry()),
+                      ips.setdefault(key[1], entry()),
+                      protos.setdefault(key[2], entry())):
+                for i, name in enumerate(STAT_FIELDS):
+                    d[name] += row[i]
+                d["active"] += active.get(key, 0)
+        out = {"time": int(time.time()), "total": total,
+               "users": users, "ips": ips, "protos": protos}
+        for d in [total, *users.values(), *ips.values(), *protos.values()]:
+            d["connect_avg_ms"] = d["connect_ms"] // d["connects"] if d["connects"] else 0
+        return out
+
+traffic = TrafficStats()
+
+def tunnel_open(t):
+    t.opened = time.time()
+    active_tunnels.add(t)
+
+def tunnel_close(t):
+    active_tunnels.discard(t)
+    limiter.release(t)
+    key = t.key()
+    traffic.add(key, F_UP, t.bytes_up)
+    traffic.add(key, F_DOWN, t.bytes_down)
+    log_pipeline.access(t)
+
+# Listener per nama ("socks5" / "http") untuk sampling accept queue
+listeners   = {}
+worker_pool = None                                 # ThreadPoolExecutor (engine thread)
+loop_stats  = {"lag": 0.0, "sessions": 0}          # diisi engine async
+accept_stats = {"batch_max": 0}                    # accept terbanyak per wakeup
+
+def listen_overflows():
+    """(ListenOverflows, ListenDrops) dari /proc/net/netstat — counter
+    seluruh host: SYN/ACK dibuang karena accept queue penuh."""
+    try:
+        with open("/proc/net/netstat") as f:
+            rows = [l.split() for l in f if l.startswith("TcpExt:")]
+        d = dict(zip(rows[0][1:], rows[1][1:]))
+        return int(d.get("ListenOverflows", 0)), int(d.get("ListenDrops", 0))
+    except:
+        return 0, 0
+
+def accept_queue(sock):
+    """(antrian accept sekarang, backlog maks) dari TCP_INFO listener.
+    Untuk socket LISTEN kernel mengisi tcpi_unacked / tcpi_sacked."""
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        return struct.unpack_from("<II", info, 24)
+    except:
+        return 0, 0
+
+def collect_gauges(busy):
+    g = {}
+    for name, sock in list(listeners.items()):
+        g[f"accept_queue_{name}"], g[f"accept_backlog_{name}"] = accept_queue(sock)
+    if worker_pool is not None:
+        g["pool_max"]     = worker_pool._max_workers
+        g["pool_threads"] = len(worker_pool._threads)
+        g["pool_queue"]   = worker_pool._work_queue.qsize()
+        g["pool_busy"]    = busy
+    g["loop_lag_seconds"] = loop_stats["lag"]
+    g["loop_sessions"]    = loop_stats["sessions"]
+    g["reactor_links"]    = sum(len(r.sides) // 2 for r in reactors)
+    g["upstream_idle"]    = sum(len(v) for v in list(upstream_pool.idle.values()))
+    if dns_cache is not None:
+        g["dns_hits"], g["dns_misses"] = dns_cache.hits, dns_cache.misses
+    g["accept_batch_max"], accept_stats["batch_max"] = accept_stats["batch_max"], 0
+    g["listen_overflows"], g["listen_drops"] = listen_overflows()
+    g["udp_assocs"]  = len(udp_relay.assocs) if udp_relay else 0
+    g["udp_dropped"] = udp_relay.dropped if udp_relay else 0
+    g["log_queue"]   = len(log_pipeline.queue)
+    g["log_dropped"] = log_pipeline.total_dropped + log_pipeline.dropped
+    return g
+
+def stats_loop():
+    """Agregasi + publish ke shared memory setiap STATS_INTERVAL,
+    ringkasan ke log setiap STATS_LOG_INTERVAL."""
+    log = logging.getLogger("STATS")
+    logged = time.monotonic()
+    overflows = listen_overflows()[0]
+    while True:
+        time.sleep(STATS_INTERVAL)
+        try:
+            if config_store:
+                config_store.get()      # perubahan config (mis. limit) ikut terbaca
+            s = traffic.collect()
+            s["gauges"] = collect_gauges(s["busy"])
+            if stats_writer:
+                stats_writer.publish(s)
+            limiter.sweep()
+        except Exception as e:
+            log.debug(f"collect error: {e}")
+            continue
+        if time.monotonic() - logged < STATS_LOG_INTERVAL:
+            continue
+        logged = time.monotonic()
+        if s["gauges"]["listen_overflows"] > overflows:
+            log.warning(f"Accept queue overflow: +{s['gauges']['listen_overflows'] - overflows} "
+                        f"SYN dibuang (naikkan LISTEN_BACKLOG / net.core.somaxconn)")
+            overflows = s["gauges"]["listen_overflows"]
+        t = s["total"]
+        log.info(f"Connections: {t['connections']} | Active: {t['active']} | "
+                 f"↑{t['bytes_up']//1024}KB ↓{t['bytes_down']//1024}KB | "
+                 f"Errors: {t['errors']} | Connect avg: {t['connect_avg_ms']}ms")
+        for name in ("protos", "users", "ips"):
+            top = sorted(s[name].items(), key=lambda kv: -(kv[1]["bytes_up"] + kv[1]["bytes_down"]))[:5]
+            if top:
+                log.info(f"  {name:<6} " + " | ".join(
+                    f"{k}: {v['active']}/{v['connections']} ↑{v['bytes_up']//1024}KB ↓{v['bytes_down']//1024}KB"
+                    for k, v in top))
+
+# ── Rate Limit ────────────────────────────────────────────────
+# Token bucket per user / pool IP / global untuk bandwidth up & down,
+# plus batas tunnel bersamaan. Tunnel yang kena limit di-pace (sleep
+# sebesar "utang" token), tidak diputus. Datagram UDP yang melebihi
+# limit dibuang (police).
+PACE_CHUNK  = 16384
+LIMIT_KEYS  = ("USER", "IP", "GLOBAL")
+BUCKET_IDLE = 300       # detik; bucket penuh yang tidak dipakai selama ini dibuang
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "last", "lock")
+
+    def __init__(self, rate, burst):
+        self.rate   = rate
+        self.burst  = burst
+        self.tokens = burst
+        self.last   = time.monotonic()
+        self.lock   = threading.Lock()
+
+    def reserve(self, n):
+        """Ambil n token (boleh minus) → detik yang harus ditunggu caller."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last   = now
+            self.tokens -= n
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def take(self, n):
+        """Ambil n token hanya kalau cukup (tanpa utang) → True/False."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last   = now
+            if self.tokens < n:
+                return False
+            self.tokens -= n
+            return True
+
+    def refund(self, n):
+        """Kembalikan token dari take() yang batal."""
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + n)
+
+class RateLimiter:
+    """Limit dari config.cfg (LIMIT_<SCOPE>_UP_KBPS / _DOWN_KBPS / _CONNS).
+
+    configure() dipanggil setiap snapshot config baru; rate bucket yang
+    sudah ada diubah di tempat dan `gen` dinaikkan, jadi tunnel yang
+    sedang jalan ikut limit baru tanpa restart."""
+
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.gen     = 0
+        self.conf    = None
+        self.rates   = {}       # scope → (up, down) byte/detik, 0 = tanpa batas
+        self.caps    = {}       # scope → maks tunnel bersamaan
+        self.burst   = 1.0
+        self.buckets = {}       # (scope, name, up) → TokenBucket
+        self.active  = collections.Counter()
+        self.swept   = time.monotonic()
+
+    def configure(self, cfg):
+        def num(key):
+            try:
+                return max(0.0, float(cfg.get(key, 0) or 0))
+            except ValueError:
+                return 0.0
+        rates = {s.lower(): (num(f"LIMIT_{s}_UP_KBPS") * 1024, num(f"LIMIT_{s}_DOWN_KBPS") * 1024)
+                 for s in LIMIT_KEYS}
+        caps  = {s.lower(): int(num(f"LIMIT_{s}_CONNS")) for s in LIMIT_KEYS}
+        burst = num("LIMIT_BURST_SEC") or 1.0
+        conf  = (rates, caps, burst)
+        if conf == self.conf:
+            return
+        with self.lock:
+            self.conf, self.rates, self.caps, self.burst = conf, rates, caps, burst
+            for (scope, _, up), b in list(self.buckets.items()):
+                rate = rates[scope][0 if up else 1]
+                b.rate, b.burst = rate, max(rate * burst, PACE_CHUNK)
+            self.gen += 1
+
+    @staticmethod
+    def _scopes(user, bind_ip):
+        return (("user", user or "anon"), ("ip", bind_ip or "default"), ("global", ""))
+
+    def _bucket(self, scope, name, up):
+        rate = self.rates[scope][0 if up else 1]
+        if not rate:
+            return None
+        key = (scope, name, up)
+        b = self.buckets.get(key)
+        if b is None:
+            b = self.buckets[key] = TokenBucket(rate, max(rate * self.burst, PACE_CHUNK))
+        return b
+
+    def sweep(self):
+        """Buang bucket yang sudah penuh dan idle BUCKET_IDLE (user / IP
+        lama setelah rotasi). Dipanggil stats_loop → jumlah yang dibuang."""
+        now = time.monotonic()
+        if now - self.swept < BUCKET_IDLE:
+            return 0
+        self.swept = now
+        with self.lock:
+            idle = [k for k, b in self.buckets.items()
+                    if now - b.last >= BUCKET_IDLE
+                    and b.tokens + (now - b.last) * b.rate >= b.burst]
+            for k in idle:
+                del self.buckets[k]
+            if idle:
+                self.gen += 1       # tunnel yang masih pegang bucket lama sync ulang
+        return len(idle)
+
+    def _sync(self, tunnel):
+        with self.lock:
+            scopes = self._scopes(tunnel.user, tunnel.bind_ip)
+            up   = [b for b in (self._bucket(s, n, True) for s, n in scopes) if b]
+            down = [b for b in (self._bucket(s, n, False) for s, n in scopes) if b]
+            tunnel.limits     = (up, down) if up or down else None
+            tunnel.limits_gen = self.gen
+
+    def chunk(self, tunnel, size):
+        """Ukuran baca per chunk: diperkecil kalau tunnel kena limit, supaya pacing halus."""
+        if tunnel.limits_gen != self.gen:
+            self._sync(tunnel)
+        return min(size, PACE_CHUNK) if tunnel.limits else size
+
+    def delay(self, tunnel, n, up):
+        """Catat n byte → detik jeda sebelum baca berikutnya (0 = langsung)."""
+        if tunnel.limits_gen != self.gen:
+            self._sync(tunnel)
+        if tunnel.limits is None:
+            return 0.0
+        wait = 0.0
+        for b in tunnel.limits[0 if up else 1]:
+            wait = max(wait, b.reserve(n))
+        return wait
+
+    def police(self, tunnel, n, up):
+        """Limit untuk datagram (UDP): False → datagram dibuang, tidak di-pace."""
+        if tunnel.limits_gen != self.gen:
+            self._sync(tunnel)
+        if tunnel.limits is None:
+            return True
+        taken = []
+        for b in tunnel.limits[0 if up else 1]:
+            if not b.take(n):
+                # Bucket lain sudah terpotong → kembalikan, datagram dibuang
+                for t in taken:
+                    t.refund(n)
+                return False
+            taken.append(b)
+        return True
+
+    def admit(self, tunnel):
+        """Cek batas tunnel bersamaan. False → tolak koneksi baru."""
+        scopes = self._scopes(tunnel.user, tunnel.bind_ip)
+        with self.lock:
+            for scope in scopes:
+                cap = self.caps.get(scope[0])
+                if cap and self.active[scope] >= cap:
+                    return False
+            for scope in scopes:
+                self.active[scope] += 1
+        tunnel.admitted = scopes
+        return True
+
+    def release(self, tunnel):
+        scopes, tunnel.admitted = tunnel.admitted, None
+        if not scopes:
+            return
+        with self.lock:
+            for scope in scopes:
+                self.active[scope] -= 1
+                if self.active[scope] <= 0:
+                    del self.active[scope]
+
+limiter = RateLimiter()
 
 # ── Load Config ───────────────────────────────────────────────
 def load_cfg():
@@ -65,32 +657,204 @@ def get_ip_pool():
     except FileNotFoundError:
         return []
 
-def resolve_user_ip(username: str, base_user: str, pool: list):
-    """Sticky IP: user1→pool[0], user2→pool[1], etc."""
-    if not pool or not username:
+# ── Config Snapshot ───────────────────────────────────────────
+class Snapshot:
+    __slots__ = ("cfg", "pool", "resolver")
+
+    def __init__(self, cfg, pool):
+        self.cfg      = cfg
+        self.pool     = pool
+        self.resolver = build_resolver(cfg, pool)
+
+def _file_sig(path):
+    try:
+        st = os.stat(path)
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+class ConfigStore:
+    """Snapshot config.cfg + added_ips.txt di memori.
+
+    File hanya di-parse ulang kalau stat-nya berubah (dicek paling sering
+    sekali per CHECK_INTERVAL) atau saat SIGHUP. Snapshot diganti dalam
+    satu assignment, jadi sesi yang sedang jalan tetap pakai versi lama."""
+
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self):
+        self.lock     = threading.Lock()
+        self.checked  = time.monotonic()
+        self.sigs     = None
+        self.snapshot = None
+        self.reload()
+
+    def get(self):
+        now = time.monotonic()
+        if now - self.checked >= self.CHECK_INTERVAL:
+            self.checked = now
+            if self._sigs() != self.sigs:
+                self.reload()
+        return self.snapshot
+
+    @staticmethod
+    def _sigs():
+        return (_file_sig(CONFIG), _file_sig(IP_LIST), _file_sig(USER_MAP))
+
+    def reload(self):
+        with self.lock:
+            self.sigs     = self._sigs()
+            self.snapshot = Snapshot(load_cfg(), get_ip_pool())
+            limiter.configure(self.snapshot.cfg)
+        return self.snapshot
+
+    def set_pool(self, pool):
+        """Pool dari pool_manager (control socket), dipakai langsung tanpa
+        membaca added_ips.txt. Signature file pool ikut diperbarui supaya
+        file yang barusan ditulis pool_manager tidak di-parse ulang."""
+        with self.lock:
+            sig = _file_sig(IP_LIST)
+            self.sigs     = (self.sigs[0], sig, self.sigs[2])
+            self.snapshot = Snapshot(self.snapshot.cfg, list(pool))
+        return self.snapshot
+
+config_store = None
+
+# ── Sticky IP Resolver ────────────────────────────────────────
+class IPResolver:
+    """Index username → IP pool, dibangun sekali per snapshot.
+
+    Urutan lookup:
+      1. user_map.txt — `nama=N` (slot pool ke-N, 1-based), `nama=<IPv6>`,
+         atau `nama=hash`. Banyak nama boleh menunjuk slot/IP yang sama.
+      2. Skema lama   — base_user → pool[0], base_userN → pool[N-1]
+      3. STICKY_MODE=hash — username lain di-assign via rendezvous hashing
+         atas slot pool, jadi saat pool membesar/mengecil hanya user di
+         slot yang berubah yang pindah IP.
+    Hasil di-cache per username, lookup berikutnya cuma satu dict get."""
+
+    CACHE_MAX = 65536
+
+    def __init__(self, pool, base_user="user", mapping=None, mode="index"):
+        self.pool      = list(pool)
+        self.base_user = base_user
+        self.mapping   = mapping or {}
+        self.hash_all  = mode == "hash"
+        self.cache     = {}
+        self.seeds     = [hashlib.blake2b(str(i).encode(), digest_size=8).digest()
+                          for i in range(len(self.pool))]
+
+    def resolve(self, username):
+        if not username:
+            return None
+        try:
+            return self.cache[username]
+        except KeyError:
+            pass
+        ip = self._lookup(username)
+        if len(self.cache) >= self.CACHE_MAX:
+            self.cache.clear()
+        self.cache[username] = ip
+        return ip
+
+    def _lookup(self, username):
+        target = self.mapping.get(username)
+        if target is not None:
+            if target == "hash":
+                return self._hashed(username)
+            if target.isdigit():
+                return self._slot(int(target) - 1)
+            return target
+        base = self.base_user
+        if username == base:
+            return self._slot(0)
+        if username.startswith(base) and username[len(base):].isdigit():
+            return self._slot(int(username[len(base):]) - 1)
+        if self.hash_all:
+            return self._hashed(username)
         return None
+
+    def _slot(self, idx):
+        return self.pool[idx] if 0 <= idx < len(self.pool) else None
+
+    def _hashed(self, username):
+        if not self.pool:
+            return None
+        key = username.encode()
+        best, best_idx = b"", 0
+        for idx, seed in enumerate(self.seeds):
+            h = hashlib.blake2b(key, digest_size=8, key=seed).digest()
+            if h > best:
+                best, best_idx = h, idx
+        return self.pool[best_idx]
+
+def load_user_map():
+    """user_map.txt: satu mapping per baris, `nama=N | nama=IPv6 | nama=hash`."""
+    mapping = {}
     try:
-        if username.startswith(base_user) and username != base_user:
-            suffix = username[len(base_user):]
-            idx = int(suffix) - 1
-            if 0 <= idx < len(pool):
-                return pool[idx]
-        elif username == base_user:
-            # Exact match base user → first IP
-            return pool[0] if pool else None
-    except (ValueError, IndexError):
+        with open(USER_MAP) as f:
+            for line in f:
+                line = line.strip()
+                if "=" in line and not line.startswith("#"):
+                    k, _, v = line.partition("=")
+                    mapping[k.strip()] = v.strip()
+    except FileNotFoundError:
         pass
-    return None
+    return mapping
+
+def build_resolver(cfg, pool):
+    return IPResolver(pool,
+                      base_user=cfg.get("SOCKS_USERNAME", "user") or "user",
+                      mapping=load_user_map(),
+                      mode=cfg.get("STICKY_MODE", "index").lower())
+
+# ── Buffer Pool ───────────────────────────────────────────────
+class BufferPool:
+    """Free-list bytearray per ukuran, supaya relay tidak alokasi ulang
+    buffer tiap chunk / tiap tunnel (lebih sedikit churn & GC di HP)."""
+
+    def __init__(self, sizes, keep=64):
+        self.sizes = sizes
+        self.keep  = keep
+        self.free  = {sz: [] for sz in sizes}
+        self.lock  = threading.Lock()
+
+    def acquire(self, size):
+        with self.lock:
+            lst = self.free.get(size)
+            if lst:
+                return lst.pop()
+        return bytearray(size)
+
+    def release(self, buf):
+        with self.lock:
+            lst = self.free.get(len(buf))
+            if lst is not None and len(lst) < self.keep:
+                lst.append(buf)
+
+CHUNK_MIN  = 16 * 1024
+CHUNK_MAX  = 256 * 1024
+buffer_pool = BufferPool([CHUNK_MIN << i for i in range(5)])   # 16K … 256K
 
 # ── Socket Helpers ────────────────────────────────────────────
 def recv_exact(sock, n):
-    data = b""
-    while len(data) < n:
-        chunk = sock.recv(n - len(data))
-        if not chunk:
+    buf  = bytearray(n)
+    view = memoryview(buf)
+    pos  = 0
+    while pos < n:
+        got = sock.recv_into(view[pos:], n - pos)
+        if not got:
             raise ConnectionError("connection closed")
-        data += chunk
-    return data
+        pos += got
+    return buf
+
+def wait_fd(fd, events, timeout):
+    """Tunggu satu fd / socket → revents (0 = timeout). Pakai poll karena
+    select.select gagal (ValueError) untuk fd ≥ 1024."""
+    p = select.poll()
+    p.register(fd, events)
+    r = p.poll(None if timeout is None else timeout * 1000)
+    return r[0][1] if r else 0
 
 def make_outbound_socket(bind_ip=None, target_host=None, timeout=10):
     """Buat socket outbound, optionally bound ke IPv6 tertentu."""
@@ -108,35 +872,859 @@ def make_outbound_socket(bind_ip=None, target_host=None, timeout=10):
             sock.bind((bind_ip, 0, 0, 0))
         except OSError as e:
             s5_log.warning(f"Bind {bind_ip} failed: {e}, using default")
+    tcp_tuning.apply(sock, tcp_tuning.outbound)
     sock.settimeout(timeout)
     return sock
 
-def relay(c1, c2, log_ref, label=""):
-    """Bidirectional relay antara dua socket."""
-    socks = [c1, c2]
+# ── TCP Tuning ────────────────────────────────────────────────
+# Profil opsi socket (TCP_PROFILE, bisa beda per sisi lewat
+# TCP_PROFILE_INBOUND / _OUTBOUND). Inbound dipasang di socket LISTEN —
+# Linux menyalin opsi listener ke socket hasil accept(), jadi tidak ada
+# syscall tambahan per koneksi. Outbound dipasang sebelum connect() supaya
+# ukuran buffer ikut menentukan window scale.
+#   keepalive = (idle, interval, count) detik
+#   buffer    = SO_SNDBUF / SO_RCVBUF; kalau dibatasi net.core.*mem_max
+#               opsi dilewati (autotuning kernel lebih baik dari buffer kecil)
+TCP_PROFILES = {
+    "off":           {},
+    "interactive":   {"nodelay": 1, "keepalive": (60, 10, 6), "notsent_lowat": 16384},
+    "bulk":          {"nodelay": 0, "keepalive": (300, 30, 4),
+                      "sndbuf": 4 << 20, "rcvbuf": 4 << 20},
+    "mobile-uplink": {"nodelay": 1, "keepalive": (30, 10, 3), "user_timeout": 30000,
+                      "notsent_lowat": 131072, "sndbuf": 2 << 20, "rcvbuf": 2 << 20},
+}
+
+def _tcp_opts(profile, congestion=""):
+    """Profil → [(nama, level, opt, value)]; opsi yang tidak ada di
+    platform ini ikut dengan opt None supaya dilaporkan saat probe."""
+    T, S = socket.IPPROTO_TCP, socket.SOL_SOCKET
+    tcp  = lambda name: getattr(socket, name, None)
+    out  = []
+    if "nodelay" in profile:
+        out.append(("TCP_NODELAY", T, socket.TCP_NODELAY, profile["nodelay"]))
+    if "keepalive" in profile:
+        idle, intvl, cnt = profile["keepalive"]
+        out += [("SO_KEEPALIVE", S, socket.SO_KEEPALIVE, 1),
+                ("TCP_KEEPIDLE", T, tcp("TCP_KEEPIDLE"), idle),
+                ("TCP_KEEPINTVL", T, tcp("TCP_KEEPINTVL"), intvl),
+                ("TCP_KEEPCNT", T, tcp("TCP_KEEPCNT"), cnt)]
+    if "user_timeout" in profile:
+        out.append(("TCP_USER_TIMEOUT", T, tcp("TCP_USER_TIMEOUT"), profile["user_timeout"]))
+    if "notsent_lowat" in profile:
+        # Konstanta baru ada di Python 3.12+, nilai Linux = 25
+        out.append(("TCP_NOTSENT_LOWAT", T, tcp("TCP_NOTSENT_LOWAT") or
+                    (25 if sys.platform.startswith("linux") else None), profile["notsent_lowat"]))
+    for key, name in (("sndbuf", "SO_SNDBUF"), ("rcvbuf", "SO_RCVBUF")):
+        if key in profile:
+            out.append((name, S, getattr(socket, name), profile[key]))
+    if congestion:
+        out.append(("TCP_CONGESTION", T, tcp("TCP_CONGESTION"), congestion.encode()))
+    return out
+
+class TCPTuning:
+    """Opsi yang lolos probe saat configure(). Kegagalan (opsi tidak ada,
+    ditolak kernel, buffer dibatasi) dilaporkan sekali di sini; apply()
+    per koneksi diam saja kalau setsockopt gagal."""
+
+    def __init__(self):
+        self.conf     = None
+        self.inbound  = []
+        self.outbound = []
+
+    def configure(self, cfg):
+        base  = cfg.get("TCP_PROFILE", "off").lower() or "off"
+        sides = (cfg.get("TCP_PROFILE_INBOUND", "").lower() or base,
+                 cfg.get("TCP_PROFILE_OUTBOUND", "").lower() or base)
+        congestion = cfg.get("TCP_CONGESTION", "").strip()
+        conf = sides + (congestion,)
+        if conf == self.conf:
+            return False
+        self.conf = conf
+        log = logging.getLogger("MAIN ")
+        reported = set()
+        names, result = [], []
+        for name in sides:
+            if name not in TCP_PROFILES:
+                log.warning(f"  TCP_PROFILE {name} tidak dikenal — off ({', '.join(TCP_PROFILES)})")
+                name = "off"
+            names.append(name)
+            result.append(self._probe(_tcp_opts(TCP_PROFILES[name], congestion), log, reported))
+        self.inbound, self.outbound = result
+        log.info(f"  TCP    → in {names[0]}, out {names[1]}"
+                 + (f", cc {congestion}" if congestion else ""))
+        return True
+
+    @staticmethod
+    def _probe(opts, log, reported):
+        ok = []
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+            for name, level, opt, value in opts:
+                err = None
+                if opt is None:
+                    err = "tidak tersedia di platform ini"
+                else:
+                    try:
+                        probe.setsockopt(level, opt, value)
+                        if name in ("SO_SNDBUF", "SO_RCVBUF"):
+                            # Linux melaporkan 2× nilai yang dipakai
+                            got = probe.getsockopt(level, opt) // 2
+                            if got < value:
+                                sysctl = "wmem_max" if name == "SO_SNDBUF" else "rmem_max"
+                                err = f"dibatasi net.core.{sysctl} ({got}), dilewati"
+                    except OSError as e:
+                        err = e.strerror or str(e)
+                if err is None:
+                    ok.append((level, opt, value))
+                elif name not in reported:
+                    reported.add(name)
+                    shown = value.decode() if isinstance(value, bytes) else value
+                    log.warning(f"  {name}={shown}: {err}")
+        return ok
+
+    @staticmethod
+    def apply(sock, opts):
+        for level, opt, value in opts:
+            try:
+                sock.setsockopt(level, opt, value)
+            except OSError:
+                pass
+
+tcp_tuning = TCPTuning()
+
+# ── DNS Resolver ──────────────────────────────────────────────
+# Cache DNS in-process supaya getaddrinfo tidak jalan di setiap connect.
+#   DNS_MODE=system — getaddrinfo sistem, TTL = DNS_CACHE_TTL
+#   DNS_MODE=udp    — query A/AAAA langsung ke DNS_SERVER, TTL dari jawaban
+QTYPE_A, QTYPE_AAAA = 1, 28
+
+def _dns_query(qid, name, qtype):
+    labels = name.rstrip(".").encode("idna").split(b".")
+    qname  = b"".join(bytes([len(l)]) + l for l in labels) + b"\0"
+    return struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0) + qname + struct.pack("!HH", qtype, 1)
+
+def _dns_skip_name(buf, pos):
+    while True:
+        n = buf[pos]
+        if n == 0:
+            return pos + 1
+        if n & 0xC0 == 0xC0:
+            return pos + 2
+        pos += n + 1
+
+def _dns_parse(buf):
+    """Parse response → (qid, flags, [(family, ip)], min_ttl)."""
+    qid, flags, qd, an, _, _ = struct.unpack_from("!HHHHHH", buf)
+    pos = 12
+    for _ in range(qd):
+        pos = _dns_skip_name(buf, pos) + 4
+    addrs, ttl = [], None
+    for _ in range(an):
+        pos = _dns_skip_name(buf, pos)
+        rtype, _, rttl, rdlen = struct.unpack_from("!HHIH", buf, pos)
+        pos += 10
+        rdata = buf[pos:pos + rdlen]
+        pos += rdlen
+        if rtype == QTYPE_A and rdlen == 4:
+            addrs.append((socket.AF_INET, socket.inet_ntop(socket.AF_INET, rdata)))
+        elif rtype == QTYPE_AAAA and rdlen == 16:
+            addrs.append((socket.AF_INET6, socket.inet_ntop(socket.AF_INET6, rdata)))
+        else:
+            continue
+        ttl = rttl if ttl is None else min(ttl, rttl)
+    return qid, flags, addrs, ttl
+
+class _Pending:
+    __slots__ = ("event", "result")
+
+    def __init__(self):
+        self.event  = threading.Event()
+        self.result = None
+
+class DNSCache:
+    """Resolver dengan cache TTL positif/negatif + LRU.
+
+    Lookup konkuren untuk nama yang sama digabung: satu thread query,
+    sisanya menunggu hasil yang sama."""
+
+    def __init__(self, mode="system", server="", size=1024, ttl=60,
+                 neg_ttl=10, prefer_v6=True, nat64_prefix=""):
+        self.mode      = mode
+        self.server    = server
+        self.size      = size
+        self.ttl       = ttl
+        self.neg_ttl   = neg_ttl
+        self.prefer_v6 = prefer_v6
+        self.nat64     = _nat64_network(nat64_prefix)
+        self.entries   = collections.OrderedDict()   # host → (expires, addrs, err)
+        self.inflight  = {}
+        self.lock      = threading.Lock()
+        self.hits      = 0
+        self.misses    = 0
+
+    def configure(self, cfg):
+        """Terapkan DNS_* dari config di tempat — entry yang sudah ada
+        tetap dipakai sampai TTL-nya habis."""
+        self.mode      = cfg.get("DNS_MODE", "system").lower()
+        self.server    = cfg.get("DNS_SERVER", "")
+        self.size      = int(cfg.get("DNS_CACHE_SIZE", 1024) or 1024)
+        self.ttl       = int(cfg.get("DNS_CACHE_TTL", 60) or 60)
+        self.neg_ttl   = int(cfg.get("DNS_NEG_TTL", 10) or 10)
+        self.prefer_v6 = cfg.get("DNS_PREFER_IPV6", "true").lower() == "true"
+        self.nat64     = _nat64_network(cfg.get("NAT64_PREFIX", "")) or self.nat64
+        with self.lock:
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def cached(self, host):
+        """Hasil dari cache saja (None kalau miss). Negatif → raise."""
+        with self.lock:
+            e = self.entries.get(host)
+            if e is None or e[0] <= time.monotonic():
+                return None
+            self.entries.move_to_end(host)
+            self.hits += 1
+        if e[2]:
+            raise e[2]
+        return e[1]
+
+    def lookup(self, host):
+        """[(family, ip), ...] sesuai preferensi family. Gagal → socket.gaierror."""
+        addrs = self.cached(host)
+        if addrs is not None:
+            return addrs
+        with self.lock:
+            self.misses += 1
+            p = self.inflight.get(host)
+            owner = p is None
+            if owner:
+                p = self.inflight[host] = _Pending()
+        if not owner:
+            if not p.event.wait(10) or p.result is None:
+                raise socket.gaierror(socket.EAI_AGAIN, "lookup timeout")
+        else:
+            try:
+                p.result = self._resolve(host)
+            except Exception as e:
+                # Nama tidak valid (idna / UnicodeError dsb.) → cache negatif juga
+                p.result = (time.monotonic() + self.neg_ttl, None,
+                            socket.gaierror(socket.EAI_NONAME, f"{host}: {e}"))
+            finally:
+                with self.lock:
+                    if p.result is not None:
+                        self.entries[host] = p.result
+                        self.entries.move_to_end(host)
+                        while len(self.entries) > self.size:
+                            self.entries.popitem(last=False)
+                    self.inflight.pop(host, None)
+                p.event.set()
+        if p.result[2]:
+            raise p.result[2]
+        return p.result[1]
+
+    def _resolve(self, host):
+        now = time.monotonic()
+        try:
+            addrs, ttl = None, self.ttl
+            if self.mode == "udp" and self.server:
+                try:
+                    addrs, ttl = self._query_udp(host)
+                except (OSError, struct.error, IndexError):
+                    addrs = None   # server gagal/truncated → fallback sistem
+            if addrs is None:
+                addrs, ttl = self._query_system(host), self.ttl
+            if not addrs:
+                raise socket.gaierror(socket.EAI_NONAME, f"{host}: no address")
+        except socket.gaierror as e:
+            return (now + self.neg_ttl, None, e)
+        v6 = [a for a in addrs if a[0] == socket.AF_INET6]
+        v4 = [a for a in addrs if a[0] == socket.AF_INET]
+        # RFC 8305 §4: family bergantian, mulai dari yang diutamakan (default AAAA)
+        addrs = _interleave(v6, v4) if self.prefer_v6 else _interleave(v4, v6)
+        return (now + max(1, min(ttl, 3600)), addrs, None)
+
+    def _query_system(self, host):
+        seen = []
+        for fam, _, _, _, sa in socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM):
+            if (fam, sa[0]) not in seen:
+                seen.append((fam, sa[0]))
+        return seen
+
+    def _query_udp(self, host, timeout=2.0):
+        family = socket.AF_INET6 if ":" in self.server else socket.AF_INET
+        with socket.socket(family, socket.SOCK_DGRAM) as s:
+            s.settimeout(timeout)
+            s.connect((self.server, 53))
+            base = int.from_bytes(os.urandom(2), "big") & 0xFFFE
+            want = {base: QTYPE_A, base + 1: QTYPE_AAAA}
+            for qid, qtype in want.items():
+                s.send(_dns_query(qid, host, qtype))
+            addrs, ttl, nx = [], None, 0
+            deadline = time.monotonic() + timeout
+            while want:
+                s.settimeout(max(0.01, deadline - time.monotonic()))
+                qid, flags, got, rttl = _dns_parse(s.recv(4096))
+                if qid not in want:
+                    continue
+                if flags & 0x0200:
+                    raise OSError("truncated")
+                want.pop(qid)
+                if flags & 0xF == 3:
+                    nx += 1
+                addrs += got
+                if rttl is not None:
+                    ttl = rttl if ttl is None else min(ttl, rttl)
+        if not addrs and nx:
+            raise socket.gaierror(socket.EAI_NONAME, f"{host}: NXDOMAIN")
+        return addrs, self.ttl if ttl is None else ttl
+
+    def synthesize(self, ipv4):
+        """IPv4 → alamat NAT64 (RFC 6052, prefix /96)."""
+        net = self.nat64 or _nat64_network("64:ff9b::")
+        return str(ipaddress.IPv6Address(int(net) | int(ipaddress.IPv4Address(ipv4))))
+
+    def detect_nat64(self):
+        """RFC 7050: prefix NAT64 dari AAAA ipv4only.arpa (kalau belum di-set)."""
+        if self.nat64:
+            return
+        try:
+            for fam, ip in self.lookup("ipv4only.arpa"):
+                if fam == socket.AF_INET6:
+                    self.nat64 = _nat64_network(ip)
+                    logging.getLogger("DNS  ").info(f"NAT64 prefix: {self.nat64}/96")
+                    return
+        except OSError:
+            pass
+
+def _interleave(a, b):
+    """a0, b0, a1, b1, ... — sisa list yang lebih panjang di belakang."""
+    out = []
+    for i in range(max(len(a), len(b))):
+        if i < len(a): out.append(a[i])
+        if i < len(b): out.append(b[i])
+    return out
+
+def _nat64_network(prefix):
+    """Prefix NAT64 (/96) sebagai IPv6Address dengan 32 bit bawah nol."""
+    if not prefix:
+        return None
+    try:
+        addr = ipaddress.IPv6Address(prefix.split("/")[0])
+    except ValueError:
+        return None
+    return ipaddress.IPv6Address(int(addr) & ~0xFFFFFFFF)
+
+dns_cache = DNSCache()
+
+def _is_ip(host, family):
     try:
+        socket.inet_pton(family, host)
+        return True
+    except OSError:
+        return False
+
+def _literal_addrs(host):
+    if _is_ip(host, socket.AF_INET6):
+        return [(socket.AF_INET6, host)]
+    if _is_ip(host, socket.AF_INET):
+        return [(socket.AF_INET, host)]
+    return None
+
+# ── Happy Eyeballs (RFC 8305) ─────────────────────────────────
+# Kandidat IPv6/IPv4 dicoba bergantian dengan jeda HE_DELAY; yang
+# pertama tersambung menang, family pemenang diingat per tujuan.
+HE_DELAY        = 0.25
+HE_MAX_ATTEMPTS = 6
+HE_MEMORY_TTL   = 600
+
+family_memory = {}   # (host, port) → (family, expires)
+
+def _remember_family(host, port, family):
+    if len(family_memory) >= 4096:
+        family_memory.clear()
+    family_memory[(host, port)] = (family, time.monotonic() + HE_MEMORY_TTL)
+
+def _candidates(host, port, addrs, bind_ip=None, ipv6_only=False):
+    """[(family, ip)] untuk di-race, family bergantian.
+
+    Sticky bind → hanya IPv6 (bind tetap ke IP user): kandidat IPv4
+    dibuang, jadi user sticky praktis tidak di-race antar family — hanya
+    antar alamat IPv6 kalau tujuan punya lebih dari satu AAAA. IPV6_ONLY →
+    IPv4 di-synthesize ke prefix NAT64."""
+    v6 = [ip for fam, ip in addrs if fam == socket.AF_INET6]
+    v4 = [ip for fam, ip in addrs if fam == socket.AF_INET]
+    if ipv6_only:
+        v6 += [dns_cache.synthesize(ip) for ip in v4]
+        v4 = []
+    elif bind_ip:
+        v4 = []
+    if not v6 and not v4:
+        raise socket.gaierror(socket.EAI_ADDRFAMILY, f"{host}: no usable address")
+
+    first = addrs[0][0]
+    mem = family_memory.get((host, port))
+    if mem and mem[1] > time.monotonic():
+        first = mem[0]
+    v6 = [(socket.AF_INET6, ip) for ip in v6]
+    v4 = [(socket.AF_INET, ip) for ip in v4]
+    out = _interleave(v6, v4) if first == socket.AF_INET6 else _interleave(v4, v6)
+    return out[:HE_MAX_ATTEMPTS]
+
+def _attempt_socket(family, ip, bind_ip, timeout):
+    return make_outbound_socket(bind_ip if family == socket.AF_INET6 else None, ip, timeout)
+
+def open_outbound(bind_ip, host, port, ipv6_only=False, timeout=10, stat=None):
+    """Resolve (via cache) + connect dengan Happy Eyeballs.
+    Socket IPv6 di-bind ke sticky IP kalau ada. `stat` = stats_key untuk
+    mencatat latency connect / error."""
+    started  = time.monotonic()
+    pending, last_err = {}, None
+    fds      = {}             # fd → socket yang sedang connect
+    poller   = select.poll()
+    deadline = started + timeout
+    next_at  = 0.0
+    try:
+        addrs = _literal_addrs(host)
+        if addrs is None:
+            addrs = dns_cache.lookup(host)
+            traffic.observe(H_DNS, time.monotonic() - started)
+            started = time.monotonic()
+        cands = _candidates(host, port, addrs, bind_ip, ipv6_only)
         while True:
-            r, _, err = select.select(socks, [], socks, 60)
-            if err:
+            now = time.monotonic()
+            if cands and (now >= next_at or not pending):
+                family, ip = cands.pop(0)
+                sock = _attempt_socket(family, ip, bind_ip, timeout)
+                sock.setblocking(False)
+                err = sock.connect_ex((ip, port))
+                if err == 0:
+                    pending[sock] = family
+                    winner = sock
+                    break
+                if err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                    pending[sock] = family
+                    fds[sock.fileno()] = sock
+                    poller.register(sock, select.POLLOUT)
+                    next_at = now + HE_DELAY
+                else:
+                    sock.close()
+                    last_err = OSError(err, os.strerror(err))
+                continue
+            if not pending:
+                raise last_err or OSError(errno.EHOSTUNREACH, "no candidates")
+            if now >= deadline:
+                raise socket.timeout("connect timed out")
+            wait = min(next_at if cands else deadline, deadline) - now
+            winner = None
+            for fd, _ in poller.poll(max(0, wait) * 1000):
+                sock = fds.pop(fd)
+                poller.unregister(fd)
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err == 0:
+                    winner = sock
+                    break
+                pending.pop(sock)
+                sock.close()
+                last_err = OSError(err, os.strerror(err))
+                next_at = 0.0    # attempt gagal → langsung coba kandidat berikutnya
+            if winner:
                 break
+    except:
+        for sock in pending:
+            sock.close()
+        if stat:
+            traffic.add(stat, F_ERRORS)
+        raise
+    family = pending.pop(winner)
+    for sock in pending:
+        sock.close()
+    _remember_family(host, port, family)
+    if stat:
+        traffic.connected(stat, started)
+    winner.settimeout(timeout)
+    return winner
+
+# ── Relay ─────────────────────────────────────────────────────
+# RELAY_MODE: auto | splice | copy | reactor
+#   splice  — byte dipindah di kernel (socket → pipe → socket), Linux only
+#   copy    — recv/sendall lewat Python (fallback)
+#   reactor — semua tunnel di-multiplex di thread epoll bersama,
+#             worker thread langsung bebas setelah handshake
+RELAY_MODE  = "auto"
+RELAY_IDLE  = 60
+SPLICE_SIZE = 1 << 16
+HAS_SPLICE  = hasattr(os, "splice") and sys.platform.startswith("linux")
+HAS_EPOLL   = hasattr(select, "epoll")
+reactors    = []
+
+def relay(c1, c2, log_ref, label="", tunnel=None):
+    """Bidirectional relay antara dua socket (c1 = client, c2 = remote).
+
+    Return True kalau tunnel diserahkan ke reactor — caller tidak boleh
+    menutup socket-nya lagi."""
+    tunnel = tunnel or Tunnel()
+    if not tunnel.opened:       # tunnel HTTP yang di-upgrade (101) sudah terbuka
+        tunnel_open(tunnel)
+    if reactors:
+        reactors[c1.fileno() % len(reactors)].add(c1, c2, tunnel)
+        return True
+    try:
+        if HAS_SPLICE and RELAY_MODE in ("auto", "splice"):
+            _relay_splice(c1, c2, tunnel)
+        else:
+            _relay_copy(c1, c2, tunnel)
+    except:
+        pass
+    finally:
+        tunnel_close(tunnel)
+    return False
+
+class _Direction:
+    """State satu arah relay: buffer dari pool + chunk size adaptif."""
+    __slots__ = ("buf", "view", "size", "small")
+
+    def __init__(self):
+        self.size  = CHUNK_MIN
+        self.buf   = buffer_pool.acquire(self.size)
+        self.view  = memoryview(self.buf)
+        self.small = 0
+
+    def adapt(self, n):
+        # Chunk penuh → transfer bulk, naikkan ukuran; banyak chunk kecil → turunkan
+        if n == self.size and self.size < CHUNK_MAX:
+            self._resize(self.size * 2)
+        elif n < self.size // 4 and self.size > CHUNK_MIN:
+            self.small += 1
+            if self.small >= 8:
+                self._resize(self.size // 2)
+        else:
+            self.small = 0
+
+    def _resize(self, size):
+        self.release()
+        self.size  = size
+        self.buf   = buffer_pool.acquire(size)
+        self.view  = memoryview(self.buf)
+        self.small = 0
+
+    def release(self):
+        self.view.release()
+        buffer_pool.release(self.buf)
+
+def _poll_pair(c1, c2):
+    """poll() untuk dua sisi relay → (poller, fd → socket)."""
+    poller = select.poll()
+    for sock in (c1, c2):
+        poller.register(sock, select.POLLIN)
+    return poller, {c1.fileno(): c1, c2.fileno(): c2}
+
+def _readable(poller, by_fd):
+    """Sisi yang bisa dibaca; [] kalau idle RELAY_IDLE atau ada error."""
+    events = poller.poll(RELAY_IDLE * 1000)
+    if any(ev & (select.POLLERR | select.POLLNVAL) for _, ev in events):
+        return []
+    return [by_fd[fd] for fd, _ in events]
+
+def _relay_copy(c1, c2, tunnel):
+    poller, by_fd = _poll_pair(c1, c2)
+    dirs  = {c1: _Direction(), c2: _Direction()}
+    try:
+        while True:
+            r = _readable(poller, by_fd)
             if not r:
                 break
             for s in r:
                 other = c2 if s is c1 else c1
+                d = dirs[s]
                 try:
-                    data = s.recv(8192)
-                    if not data:
+                    n = s.recv_into(d.view, limiter.chunk(tunnel, d.size))
+                    if not n:
                         return
-                    other.sendall(data)
-                    with stats_lock:
-                        if s is c1:
-                            stats["bytes_up"] += len(data)
-                        else:
-                            stats["bytes_down"] += len(data)
+                    other.sendall(d.view[:n])
+                    if s is c1:
+                        tunnel.bytes_up += n
+                    else:
+                        if not tunnel.bytes_down:
+                            traffic.first_byte(tunnel)
+                        tunnel.bytes_down += n
+                    d.adapt(n)
+                    wait = limiter.delay(tunnel, n, s is c1)
+                    if wait:
+                        time.sleep(wait)
                 except:
                     return
-    except:
-        pass
+    finally:
+        for d in dirs.values():
+            d.release()
+
+def _relay_splice(c1, c2, tunnel):
+    """Zero-copy relay: src → pipe → dst via os.splice, tanpa buffer di Python."""
+    up, down = os.pipe(), os.pipe()
+    flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+    moved = False
+    poller, by_fd = _poll_pair(c1, c2)
+    try:
+        while True:
+            r = _readable(poller, by_fd)
+            if not r:
+                return
+            for s in r:
+                if s is c1:
+                    other, (pr, pw) = c2, up
+                else:
+                    other, (pr, pw) = c1, down
+                try:
+                    n = os.splice(s.fileno(), pw, limiter.chunk(tunnel, SPLICE_SIZE), flags=flags)
+                except BlockingIOError:
+                    continue
+                except OSError as e:
+                    # Socket/kernel tidak support splice → pakai loop biasa
+                    if not moved and e.errno in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                        return _relay_copy(c1, c2, tunnel)
+                    return
+                if n == 0:
+                    return
+                moved = True
+                left = n
+                while left:
+                    try:
+                        left -= os.splice(pr, other.fileno(), left, flags=flags)
+                    except BlockingIOError:
+                        # Send buffer tujuan penuh, tunggu writable
+                        if not wait_fd(other, select.POLLOUT, RELAY_IDLE):
+                            return
+                    except OSError:
+                        return
+                if s is c1:
+                    tunnel.bytes_up += n
+                else:
+                    if not tunnel.bytes_down:
+                        traffic.first_byte(tunnel)
+                    tunnel.bytes_down += n
+                wait = limiter.delay(tunnel, n, s is c1)
+                if wait:
+                    time.sleep(wait)
+    finally:
+        for fd in up + down:
+            os.close(fd)
+
+# ── Relay Reactor ─────────────────────────────────────────────
+WHEEL_SLOTS = 64
+
+class _Side:
+    __slots__ = ("sock", "fd", "peer", "link", "up", "pending", "readable", "resume")
+
+    def __init__(self, sock, link, up):
+        self.sock     = sock
+        self.fd       = sock.fileno()
+        self.link     = link
+        self.up       = up        # data yang dibaca dari sisi ini = upload
+        self.peer     = None
+        self.pending  = None      # data yang belum terkirim KE sisi ini
+        self.readable = False
+        self.resume   = 0.0       # kena rate limit → jangan baca sebelum waktu ini
+
+class _Link:
+    __slots__ = ("a", "b", "tunnel", "last", "closed")
+
+    def __init__(self, c1, c2, tunnel, now):
+        self.a, self.b = _Side(c1, self, True), _Side(c2, self, False)
+        self.a.peer, self.b.peer = self.b, self.a
+        self.tunnel = tunnel
+        self.last   = now
+        self.closed = False
+
+class RelayReactor:
+    """Satu thread epoll (edge-triggered) untuk banyak tunnel sekaligus.
+
+    Backpressure: kalau send ke satu sisi kena EAGAIN, sisanya disimpan
+    di sisi itu dan sisi lawan berhenti dibaca sampai buffer kosong.
+    Sisi yang kena rate limit masuk heap `paced` sampai waktunya lanjut.
+    Idle timeout lewat timer wheel dengan slot per detik."""
+
+    BUDGET = 16   # recv per sisi per putaran, supaya tunnel bulk tidak memonopoli
+
+    def __init__(self, name, idle=RELAY_IDLE):
+        self.ep       = select.epoll()
+        self.idle     = idle
+        self.sides    = {}
+        self.incoming = collections.deque()
+        self.ready    = set()
+        self.paced    = []        # heap (resume, seq, side)
+        self.seq      = 0
+        self.wheel    = [set() for _ in range(WHEEL_SLOTS)]
+        self.now      = time.monotonic()
+        self.tick     = int(self.now)
+        self.buf      = bytearray(CHUNK_MAX)
+        self.view     = memoryview(self.buf)
+        self.events   = select.EPOLLIN | select.EPOLLOUT | select.EPOLLRDHUP | select.EPOLLET
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        self.ep.register(self.wake_r, select.EPOLLIN)
+        threading.Thread(target=self._run, daemon=True, name=f"reactor-{name}").start()
+
+    def add(self, c1, c2, tunnel):
+        self.incoming.append((c1, c2, tunnel))
+        try:
+            os.write(self.wake_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _run(self):
+        while True:
+            timeout = 0 if self.ready else 1.0
+            if self.paced and not self.ready:
+                timeout = min(timeout, max(0.0, self.paced[0][0] - time.monotonic()))
+            try:
+                events = self.ep.poll(timeout)
+            except InterruptedError:
+                continue
+            self.now = time.monotonic()
+            while self.paced and self.paced[0][0] <= self.now:
+                self.ready.add(heapq.heappop(self.paced)[2])
+            for fd, ev in events:
+                if fd == self.wake_r:
+                    self._register_incoming()
+                    continue
+                side = self.sides.get(fd)
+                if side is None or side.link.closed:
+                    continue
+                try:
+                    self._dispatch(side, ev)
+                except Exception:
+                    self._fail(side.link)
+            ready, self.ready = self.ready, set()
+            for side in ready:
+                try:
+                    self._pump(side)
+                except Exception:
+                    self._fail(side.link)
+            self._expire()
+
+    def _dispatch(self, side, ev):
+        if ev & select.EPOLLERR:
+            return self._close(side.link)
+        if ev & select.EPOLLOUT and side.pending:
+            self._flush(side)
+        if ev & (select.EPOLLIN | select.EPOLLHUP | select.EPOLLRDHUP):
+            side.readable = True
+            self._pump(side)
+
+    def _fail(self, link):
+        """Error tak terduga di satu tunnel: tutup tunnel itu saja, reactor jalan terus."""
+        t = link.tunnel
+        relay_log.exception(f"Reactor: tunnel {t.user or 'anon'} → {t.target or '?'} error, ditutup")
+        try:
+            self._close(link)
+        except Exception:
+            link.closed = True
+            relay_log.exception("Reactor: gagal menutup tunnel")
+
+    def _register_incoming(self):
+        try:
+            while os.read(self.wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.incoming:
+            c1, c2, tunnel = self.incoming.popleft()
+            link = _Link(c1, c2, tunnel, self.now)
+            try:
+                for side in (link.a, link.b):
+                    side.sock.setblocking(False)
+                    self.sides[side.fd] = side
+                    self.ep.register(side.fd, self.events)
+            except OSError:
+                self._close(link)
+                continue
+            self._schedule(link, self.now + self.idle)
+
+    def _pump(self, src):
+        """Baca dari src, kirim ke src.peer sampai EAGAIN / backpressure / budget habis."""
+        dst, link, view = src.peer, src.link, self.view
+        if src.resume > self.now:
+            return
+        for _ in range(self.BUDGET):
+            if link.closed or not src.readable or dst.pending:
+                return
+            try:
+                n = src.sock.recv_into(view, limiter.chunk(link.tunnel, len(view)))
+            except BlockingIOError:
+                src.readable = False
+                return
+            except OSError:
+                return self._close(link)
+            if not n:
+                return self._close(link)
+            try:
+                sent = dst.sock.send(view[:n])
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                return self._close(link)
+            if sent < n:
+                dst.pending = bytes(view[sent:n])
+            if src.up:
+                link.tunnel.bytes_up += n
+            else:
+                if not link.tunnel.bytes_down:
+                    traffic.first_byte(link.tunnel)
+                link.tunnel.bytes_down += n
+            link.last = self.now
+            wait = limiter.delay(link.tunnel, n, src.up)
+            if wait:
+                src.resume = self.now + wait
+                self.seq += 1
+                heapq.heappush(self.paced, (src.resume, self.seq, src))
+                return
+        self.ready.add(src)
+
+    def _flush(self, dst):
+        try:
+            sent = dst.sock.send(dst.pending)
+        except BlockingIOError:
+            return
+        except OSError:
+            return self._close(dst.link)
+        dst.pending = dst.pending[sent:] or None
+        if dst.pending is None:
+            # Buffer tujuan kosong lagi → lanjutkan baca sisi lawan
+            self._pump(dst.peer)
+
+    def _schedule(self, link, when):
+        when = min(when, self.now + WHEEL_SLOTS - 1)
+        self.wheel[(int(when) + 1) % WHEEL_SLOTS].add(link)
+
+    def _expire(self):
+        now_tick = int(self.now)
+        while self.tick <= now_tick:
+            idx = self.tick % WHEEL_SLOTS
+            slot, self.wheel[idx] = self.wheel[idx], set()
+            for link in slot:
+                if link.closed:
+                    continue
+                deadline = link.last + self.idle
+                if deadline > self.now:
+                    self._schedule(link, deadline)
+                    continue
+                try:
+                    self._close(link)
+                except Exception:
+                    self._fail(link)
+            self.tick += 1
+
+    def _close(self, link):
+        if link.closed:
+            return
+        link.closed = True
+        for side in (link.a, link.b):
+            self.sides.pop(side.fd, None)
+            self.ready.discard(side)
+            try: self.ep.unregister(side.fd)
+            except: pass
+            try: side.sock.close()
+            except: pass
+        tunnel_close(link.tunnel)
 
 # ════════════════════════════════════════════
 # SOCKS5 SERVER
@@ -146,24 +1734,27 @@ AUTH_USER_PASS = 0x02
 AUTH_NONE      = 0x00
 AUTH_NO_ACCEPT = 0xFF
 CMD_CONNECT    = 0x01
+CMD_UDP        = 0x03
 ATYP_IPV4      = 0x01
 ATYP_DOMAIN    = 0x03
 ATYP_IPV6      = 0x04
 
-def handle_socks5_client(client_sock, cfg, pool):
+def handle_socks5_client(client_sock, cfg, resolver):
+    handed = False
     try:
-        _socks5_session(client_sock, cfg, pool)
+        # True → socket sudah diserahkan ke relay reactor
+        handed = _socks5_session(client_sock, cfg, resolver)
     except Exception as e:
         s5_log.debug(f"Session error: {e}")
     finally:
-        try: client_sock.close()
-        except: pass
+        if not handed:
+            try: client_sock.close()
+            except: pass
 
-def _socks5_session(client, cfg, pool):
-    base_user = cfg.get("SOCKS_USERNAME", "user") or "user"
+def _socks5_session(client, cfg, resolver):
+    started   = time.monotonic()
     password  = cfg.get("SOCKS_PASSWORD", "")
     ipv6_only = cfg.get("IPV6_ONLY", "false").lower() == "true"
-    nat64     = "64:ff9b::"
 
     # ── Greeting ──────────────────────────
     ver = recv_exact(client, 1)[0]
@@ -176,8 +1767,7 @@ def _socks5_session(client, cfg, pool):
         client.sendall(bytes([SOCKS5_VER, AUTH_USER_PASS]))
     elif not password and AUTH_NONE in methods:
         client.sendall(bytes([SOCKS5_VER, AUTH_NONE]))
-        _socks5_request(client, None, ipv6_only, nat64, "anon", cfg)
-        return
+        return _socks5_request(client, None, ipv6_only, "anon", cfg)
     else:
         client.sendall(bytes([SOCKS5_VER, AUTH_NO_ACCEPT]))
         return
@@ -194,30 +1784,29 @@ def _socks5_session(client, cfg, pool):
         s5_log.warning(f"Auth fail: {username}")
         return
     client.sendall(bytes([0x01, 0x00]))
+    traffic.observe(H_AUTH, time.monotonic() - started)
 
     # ── Sticky IP ─────────────────────────
-    bind_ip = resolve_user_ip(username, base_user, pool)
+    bind_ip = resolver.resolve(username)
     s5_log.info(f"✅ {username} → {bind_ip or 'default'}")
 
-    with stats_lock:
-        stats["connections"] += 1
+    traffic.add(stats_key(username, bind_ip, "socks5"), F_CONNS)
 
-    _socks5_request(client, bind_ip, ipv6_only, nat64, username, cfg)
+    return _socks5_request(client, bind_ip, ipv6_only, username, cfg)
 
-def _socks5_request(client, bind_ip, ipv6_only, nat64, username, cfg):
+def _socks5_request(client, bind_ip, ipv6_only, username, cfg):
     hdr = recv_exact(client, 4)
     ver, cmd, _, atyp = hdr
 
-    if ver != SOCKS5_VER or cmd != CMD_CONNECT:
+    if ver != SOCKS5_VER or cmd not in (CMD_CONNECT, CMD_UDP) or \
+            (cmd == CMD_UDP and not UDP_ASSOCIATE):
         client.sendall(bytes([SOCKS5_VER, 0x07, 0x00, 0x01]) + b'\x00'*4 + b'\x00\x00')
         return
 
     # Parse target
-    is_ipv4 = False
     if atyp == ATYP_IPV4:
         raw = recv_exact(client, 4)
         host = socket.inet_ntop(socket.AF_INET, raw)
-        is_ipv4 = True
     elif atyp == ATYP_DOMAIN:
         dlen = recv_exact(client, 1)[0]
         host = recv_exact(client, dlen).decode()
@@ -228,16 +1817,18 @@ def _socks5_request(client, bind_ip, ipv6_only, nat64, username, cfg):
         return
 
     port = struct.unpack("!H", recv_exact(client, 2))[0]
-
-    # NAT64
-    if ipv6_only and is_ipv4:
-        host = f"{nat64}{host}"
-        s5_log.debug(f"NAT64 → {host}")
+    if cmd == CMD_UDP:
+        return _socks5_udp(client, bind_ip, ipv6_only, username, host, port)
 
     # Connect
+    tunnel = Tunnel(username, bind_ip, "socks5")
+    if not limiter.admit(tunnel):
+        s5_log.warning(f"Limit koneksi: {username} ({bind_ip or 'default'})")
+        client.sendall(bytes([SOCKS5_VER, 0x02, 0x00, ATYP_IPV4]) + b'\x00'*4 + b'\x00\x00')
+        return
     try:
-        remote = make_outbound_socket(bind_ip, host)
-        remote.connect((host, port))
+        remote = open_outbound(bind_ip, host, port, ipv6_only,
+                               stat=stats_key(username, bind_ip, "socks5"))
         remote.settimeout(None)
 
         local_addr = remote.getsockname()
@@ -254,76 +1845,468 @@ def _socks5_request(client, bind_ip, ipv6_only, nat64, username, cfg):
         reply += struct.pack("!H", local_port)
         client.sendall(reply)
 
+        tunnel.target = f"{host}:{port}"
         s5_log.info(f"► {username} {host}:{port}")
-        relay(client, remote, s5_log, f"{username}→{host}:{port}")
+        if relay(client, remote, s5_log, f"{username}→{host}:{port}", tunnel):
+            return True
         remote.close()
     except Exception as e:
+        limiter.release(tunnel)
         s5_log.debug(f"Connect {host}:{port} failed: {e}")
         err_reply = bytes([SOCKS5_VER, 0x05, 0x00, ATYP_IPV4]) + b'\x00'*4 + b'\x00\x00'
         try: client.sendall(err_reply)
         except: pass
 
+# ── UDP Relay (SOCKS5 UDP ASSOCIATE) ──────────────────────────
+# Satu thread epoll untuk semua asosiasi. Per asosiasi dua socket UDP:
+#   client — di IP lokal koneksi kontrol, datagram ber-header SOCKS5
+#   remote — IPv6, di-bind ke sticky IP user (dual stack kalau tanpa bind)
+# Pemilihan alamat tujuan sama dengan TCP (_candidates): sticky → hanya
+# IPv6, IPV6_ONLY → IPv4 di-synthesize ke prefix NAT64.
+# Python tidak punya recvmmsg/sendmmsg, jadi tiap wakeup (edge-triggered)
+# socket dikuras sampai EAGAIN / UDP_BUDGET datagram dengan satu buffer
+# bersama; balasan ke client dikirim sendmsg scatter (header + payload).
+# Asosiasi selesai saat koneksi kontrol TCP tutup atau idle UDP_IDLE_TIMEOUT.
+UDP_ASSOCIATE    = True
+UDP_IDLE_TIMEOUT = 60
+UDP_BUDGET       = 64
+UDP_NAMES_MAX    = 1024      # alamat remote → header balasan, per asosiasi
+UDP_DNS_WORKERS  = 4         # thread lookup DNS cache miss (bersama semua asosiasi)
+UDP_DNS_PENDING  = 256       # lookup antri maksimum, lebih → datagram dibuang
+udp_relay        = None
+_udp_relay_lock  = threading.Lock()
+
+class UDPAssoc:
+    __slots__ = ("tunnel", "client", "remote", "ctrl", "peer_ip", "client_addr",
+                 "ipv6_only", "names", "resolving", "last", "closed", "on_close")
+
+    def __init__(self, tunnel, local_ip, peer_ip, expect, ipv6_only):
+        family = socket.AF_INET6 if ":" in local_ip else socket.AF_INET
+        self.client = socket.socket(family, socket.SOCK_DGRAM)
+        self.remote = None
+        try:
+            self.client.bind((local_ip, 0))
+            self.remote = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            self.remote.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+            try:
+                self.remote.bind((tunnel.bind_ip or "::", 0))
+            except OSError as e:
+                s5_log.warning(f"Bind {tunnel.bind_ip} failed: {e}, using default")
+                self.remote.bind(("::", 0))
+        except OSError:
+            self.close_sockets()
+            raise
+        self.client.setblocking(False)
+        self.remote.setblocking(False)
+        self.tunnel      = tunnel
+        self.ctrl        = None
+        self.peer_ip     = peer_ip
+        self.client_addr = expect        # None → dipelajari dari datagram pertama
+        self.ipv6_only   = ipv6_only
+        self.names       = {}
+        self.resolving   = set()
+        self.last        = time.monotonic()
+        self.closed      = False
+        self.on_close    = None
+
+    def close_sockets(self):
+        for s in (self.client, self.remote, self.ctrl):
+            if s is not None:
+                try: s.close()
+                except: pass
+
+def _udp_parse(buf, n):
+    """Datagram client (RSV(2) FRAG ATYP DST.ADDR DST.PORT DATA) →
+    (host, port, header, offset data). `header` = ATYP..DST.PORT, dipakai
+    ulang apa adanya untuk balasan dari tujuan itu. Fragmen / header
+    rusak → ValueError."""
+    if n < 4 or buf[2] != 0:
+        raise ValueError("fragment")
+    atyp = buf[3]
+    if atyp == ATYP_IPV4:
+        host, pos = socket.inet_ntop(socket.AF_INET, buf[4:8]), 8
+    elif atyp == ATYP_IPV6:
+        host, pos = socket.inet_ntop(socket.AF_INET6, buf[4:20]), 20
+    elif atyp == ATYP_DOMAIN:
+        pos  = 5 + buf[4]
+        host = bytes(buf[5:pos]).decode()
+    else:
+        raise ValueError("atyp")
+    if n < pos + 2:
+        raise ValueError("short")
+    return host, buf[pos] << 8 | buf[pos + 1], bytes(buf[3:pos + 2]), pos + 2
+
+def _udp_header(ip, port):
+    """Header balasan (ATYP + alamat + port) untuk sumber yang tidak ada di names."""
+    raw = socket.inet_pton(socket.AF_INET6, ip)
+    if raw[:12] == b"\0" * 10 + b"\xff\xff":
+        return bytes([ATYP_IPV4]) + raw[12:] + struct.pack("!H", port)
+    return bytes([ATYP_IPV6]) + raw + struct.pack("!H", port)
+
+class UDPRelay:
+    """Thread epoll untuk datagram semua asosiasi UDP."""
+
+    def __init__(self):
+        self.ep       = select.epoll()
+        self.fds      = {}          # fd → (assoc, sisi)
+        self.assocs   = set()
+        self.ready    = set()       # (assoc, sisi) yang budget-nya habis
+        self.incoming = collections.deque()
+        self.buf      = bytearray(65536)
+        self.view     = memoryview(self.buf)
+        self.dropped  = 0
+        self.dns      = ThreadPoolExecutor(max_workers=UDP_DNS_WORKERS, thread_name_prefix="udp-dns")
+        self.lookups  = 0           # lookup di executor, hanya disentuh thread relay
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        self.ep.register(self.wake_r, select.EPOLLIN)
+        threading.Thread(target=self._run, daemon=True, name="udp-relay").start()
+
+    def add(self, assoc, ctrl=None):
+        """Mulai relay. `ctrl` = socket kontrol TCP (engine thread) yang
+        ikut dipegang relay; EOF di situ mengakhiri asosiasi."""
+        assoc.ctrl = ctrl
+        self._call(self._register, assoc)
+
+    def close(self, assoc):
+        self._call(self._close, assoc)
+
+    def _call(self, fn, *args):
+        self.incoming.append((fn, args))
+        try:
+            os.write(self.wake_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def _run(self):
+        next_sweep = time.monotonic() + 1
+        while True:
+            try:
+                events = self.ep.poll(0 if self.ready else 1.0)
+            except InterruptedError:
+                continue
+            for fd, ev in events:
+                if fd == self.wake_r:
+                    self._wakeup()
+                    continue
+                entry = self.fds.get(fd)
+                if entry is None or entry[0].closed:
+                    continue
+                assoc, side = entry
+                try:
+                    if side == "ctrl":
+                        self._ctrl(assoc)
+                    elif side == "client":
+                        self._from_client(assoc)
+                    else:
+                        self._from_remote(assoc)
+                except Exception:
+                    self._fail(assoc)
+            ready, self.ready = self.ready, set()
+            for assoc, side in ready:
+                if assoc.closed:
+                    continue
+                try:
+                    (self._from_client if side == "client" else self._from_remote)(assoc)
+                except Exception:
+                    self._fail(assoc)
+            now = time.monotonic()
+            if now >= next_sweep:
+                next_sweep = now + 1
+                for assoc in [a for a in self.assocs if now - a.last > UDP_IDLE_TIMEOUT]:
+                    try:
+                        self._close(assoc)
+                    except Exception:
+                        self._fail(assoc)
+
+    def _wakeup(self):
+        try:
+            while os.read(self.wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.incoming:
+            fn, args = self.incoming.popleft()
+            try:
+                fn(*args)
+            except Exception:
+                self._fail(args[0])     # semua _call membawa assoc sebagai argumen pertama
+
+    def _fail(self, assoc):
+        """Error tak terduga di satu asosiasi: tutup asosiasi itu saja."""
+        t = assoc.tunnel
+        relay_log.exception(f"UDP: asosiasi {t.user or 'anon'} → {t.target or '?'} error, ditutup")
+        try:
+            self._close(assoc)
+        except Exception:
+            assoc.closed = True
+            self.assocs.discard(assoc)
+            relay_log.exception("UDP: gagal menutup asosiasi")
+
+    def _register(self, assoc):
+        socks = [(assoc.client, "client", select.EPOLLIN | select.EPOLLET),
+                 (assoc.remote, "remote", select.EPOLLIN | select.EPOLLET)]
+        if assoc.ctrl is not None:
+            assoc.ctrl.setblocking(False)
+            socks.append((assoc.ctrl, "ctrl", select.EPOLLIN | select.EPOLLRDHUP))
+        self.assocs.add(assoc)
+        tunnel_open(assoc.tunnel)
+        try:
+            for sock, side, events in socks:
+                self.fds[sock.fileno()] = (assoc, side)
+                self.ep.register(sock.fileno(), events)
+        except OSError:
+            self._close(assoc)
+
+    def _ctrl(self, assoc):
+        # Client tidak mengirim apa-apa lagi di koneksi kontrol; EOF = selesai
+        try:
+            if assoc.ctrl.recv(4096):
+                return
+        except BlockingIOError:
+            return
+        except OSError:
+            pass
+        self._close(assoc)
+
+    def _drop(self):
+        self.dropped += 1
+
+    def _from_client(self, assoc):
+        view = self.view
+        for _ in range(UDP_BUDGET):
+            try:
+                n, addr = assoc.client.recvfrom_into(view)
+            except BlockingIOError:
+                return
+            except OSError:
+                return self._close(assoc)
+            if addr[0] != assoc.peer_ip or (assoc.client_addr and addr[:2] != assoc.client_addr):
+                self._drop()
+                continue
+            assoc.client_addr = addr[:2]
+            assoc.last = time.monotonic()
+            try:
+                host, port, header, pos = _udp_parse(view, n)
+            except (ValueError, IndexError, OSError):
+                self._drop()
+                continue
+            addrs  = _literal_addrs(host)
+            if addrs is None:
+                try:
+                    addrs = dns_cache.cached(host)
+                except OSError:
+                    self._drop()
+                    continue
+                if addrs is None:
+                    self._resolve(assoc, host, port, header, bytes(view[pos:n]))
+                    continue
+            self._send_remote(assoc, host, port, addrs, header, view[pos:n])
+        self.ready.add((assoc, "client"))
+
+    def _resolve(self, assoc, host, port, header, payload):
+        """Cache miss: lookup di executor kecil supaya relay tidak blok.
+        Datagram lain ke nama yang sama selama lookup, atau saat antrian
+        lookup penuh, dibuang."""
+        if host in assoc.resolving or self.lookups >= UDP_DNS_PENDING:
+            return self._drop()
+        assoc.resolving.add(host)
+        self.lookups += 1
+
+        def _lookup():
+            try:
+                addrs = dns_cache.lookup(host)
+            except Exception:
+                addrs = None
+            self._call(self._resolved, assoc, host, port, addrs, header, payload)
+
+        self.dns.submit(_lookup)
+
+    def _resolved(self, assoc, host, port, addrs, header, payload):
+        self.lookups -= 1
+        assoc.resolving.discard(host)
+        if assoc.closed:
+            return
+        if not addrs:
+            return self._drop()
+        self._send_remote(assoc, host, port, addrs, header, payload)
+
+    def _send_remote(self, assoc, host, port, addrs, header, payload):
+        tunnel = assoc.tunnel
+        try:
+            family, ip = _candidates(host, port, addrs, tunnel.bind_ip, assoc.ipv6_only)[0]
+        except OSError:
+            return self._drop()
+        if family == socket.AF_INET:
+            ip = "::ffff:" + ip
+        else:
+            ip = socket.inet_ntop(socket.AF_INET6, socket.inet_pton(socket.AF_INET6, ip))
+        if not limiter.police(tunnel, len(payload), True):
+            return self._drop()
+        try:
+            assoc.remote.sendto(payload, (ip, port))
+        except BlockingIOError:
+            return self._drop()
+        except OSError as e:
+            s5_log.debug(f"UDP {host}:{port} failed: {e}")
+            traffic.add(tunnel.key(), F_ERRORS)
+            return
+        if (ip, port) not in assoc.names:
+            if len(assoc.names) >= UDP_NAMES_MAX:
+                assoc.names.clear()
+            assoc.names[(ip, port)] = header
+            if tunnel.target is None:
+                tunnel.target = f"{host}:{port}"
+        tunnel.bytes_up += len(payload)
+
+    def _from_remote(self, assoc):
+        view, tunnel = self.view, assoc.tunnel
+        for _ in range(UDP_BUDGET):
+            try:
+                n, addr = assoc.remote.recvfrom_into(view)
+            except BlockingIOError:
+                return
+            except OSError:
+                return self._close(assoc)
+            if assoc.client_addr is None or not limiter.police(tunnel, n, False):
+                self._drop()
+                continue
+            key    = addr[:2]
+            header = assoc.names.get(key) or _udp_header(*key)
+            try:
+                assoc.client.sendmsg([b"\0\0\0", header, view[:n]], [], 0, assoc.client_addr)
+            except BlockingIOError:
+                self._drop()
+                continue
+            except OSError:
+                return self._close(assoc)
+            if not tunnel.bytes_down:
+                traffic.first_byte(tunnel)
+            tunnel.bytes_down += n
+            assoc.last = time.monotonic()
+        self.ready.add((assoc, "remote"))
+
+    def _close(self, assoc):
+        if assoc.closed:
+            return
+        assoc.closed = True
+        self.assocs.discard(assoc)
+        for sock in (assoc.client, assoc.remote, assoc.ctrl):
+            if sock is None:
+                continue
+            try:
+                fd = sock.fileno()
+                self.fds.pop(fd, None)
+                self.ep.unregister(fd)
+            except (OSError, ValueError):
+                pass
+        assoc.close_sockets()
+        tunnel_close(assoc.tunnel)
+        if assoc.on_close:
+            assoc.on_close()
+
+def configure_udp(cfg):
+    """Dibaca saat start dan setiap reload (SIGHUP); asosiasi yang sudah
+    jalan ikut idle timeout baru."""
+    global UDP_ASSOCIATE, UDP_IDLE_TIMEOUT
+    UDP_ASSOCIATE    = cfg.get("UDP_ASSOCIATE", "true").lower() == "true" and HAS_EPOLL
+    UDP_IDLE_TIMEOUT = int(cfg.get("UDP_IDLE_TIMEOUT", 60) or 60)
+
+def get_udp_relay():
+    global udp_relay
+    if udp_relay is None:
+        with _udp_relay_lock:
+            if udp_relay is None:
+                udp_relay = UDPRelay()
+    return udp_relay
+
+def _socks5_bound_reply(rep, sockname):
+    """Reply SOCKS5 dengan BND.ADDR / BND.PORT dari getsockname()."""
+    ip, port = (sockname[0], sockname[1]) if sockname else ("0.0.0.0", 0)
+    if ":" in ip:
+        return bytes([SOCKS5_VER, rep, 0x00, ATYP_IPV6]) + socket.inet_pton(socket.AF_INET6, ip) \
+            + struct.pack("!H", port)
+    return bytes([SOCKS5_VER, rep, 0x00, ATYP_IPV4]) + socket.inet_aton(ip) + struct.pack("!H", port)
+
+def _udp_expect(host, port, peer_ip):
+    """DST.ADDR / DST.PORT di request UDP ASSOCIATE → alamat client yang
+    diharapkan. Dipakai hanya kalau sama dengan peer koneksi kontrol
+    (client di balik NAT biasanya mengirim 0.0.0.0:0 / alamat privat)."""
+    return (peer_ip, port) if port and host == peer_ip else None
+
+def _open_assoc(username, bind_ip, ipv6_only, local, peer, host, port):
+    """→ (UDPAssoc, None) atau (None, kode reply SOCKS5 gagal)."""
+    tunnel = Tunnel(username, bind_ip, "udp")
+    if not limiter.admit(tunnel):
+        s5_log.warning(f"Limit koneksi: {username} ({bind_ip or 'default'})")
+        return None, 0x02
+    try:
+        return UDPAssoc(tunnel, local[0], peer[0], _udp_expect(host, port, peer[0]), ipv6_only), None
+    except OSError as e:
+        limiter.release(tunnel)
+        s5_log.debug(f"UDP associate failed: {e}")
+        return None, 0x01
+
+def _socks5_udp(client, bind_ip, ipv6_only, username, host, port):
+    assoc, err = _open_assoc(username, bind_ip, ipv6_only, client.getsockname(),
+                             client.getpeername(), host, port)
+    if assoc is None:
+        client.sendall(bytes([SOCKS5_VER, err, 0x00, ATYP_IPV4]) + b'\x00'*4 + b'\x00\x00')
+        return
+    try:
+        client.sendall(_socks5_bound_reply(0x00, assoc.client.getsockname()))
+    except OSError:
+        limiter.release(assoc.tunnel)
+        assoc.close_sockets()
+        return
+    s5_log.info(f"► {username} UDP via {bind_ip or 'default'}")
+    get_udp_relay().add(assoc, ctrl=client)
+    return True
+
 # ════════════════════════════════════════════
 # HTTP PROXY SERVER
 # ════════════════════════════════════════════
 
-def handle_http_client(client_sock, cfg, pool):
+def handle_http_client(client_sock, cfg, resolver):
+    handed = False
     try:
-        _http_session(client_sock, cfg, pool)
+        # True → socket sudah diserahkan ke relay reactor
+        handed = _http_session(client_sock, cfg, resolver)
     except Exception as e:
         http_log.debug(f"HTTP session error: {e}")
     finally:
-        try: client_sock.close()
-        except: pass
+        if not handed:
+            try: client_sock.close()
+            except: pass
 
-def _http_session(client, cfg, pool):
-    base_user = cfg.get("SOCKS_USERNAME", "user") or "user"
+def _http_session(client, cfg, resolver):
+    started   = time.monotonic()
     password  = cfg.get("SOCKS_PASSWORD", "")
+    ipv6_only = cfg.get("IPV6_ONLY", "false").lower() == "true"
 
     # Baca request pertama
-    raw = b""
-    while b"\r\n\r\n" not in raw:
-        chunk = client.recv(4096)
-        if not chunk:
-            return
-        raw += chunk
-
+    reader = SockReader(client)
     try:
-        header_part = raw.split(b"\r\n\r\n")[0].decode("utf-8", "ignore")
-    except:
+        raw = reader.read_head(_header_limit(cfg))
+        if raw is None:
+            return
+        req = parse_request(raw)
+    except HeaderTooLarge:
+        _http_send(client, "431 Request Header Fields Too Large")
         return
-
-    lines = header_part.split("\r\n")
-    if not lines:
+    if not req:
         return
-
-    req_line = lines[0]
-    parts = req_line.split(" ")
-    if len(parts) < 3:
-        return
-
-    method   = parts[0].upper()
-    target   = parts[1]
-    username = None
-    bind_ip  = None
+    method, target = req.method, req.target
+    bind_ip = None
 
     # ── Parse Proxy-Authorization ─────────
-    for line in lines[1:]:
-        if line.lower().startswith("proxy-authorization:"):
-            try:
-                enc = line.split(":", 1)[1].strip()
-                if enc.lower().startswith("basic "):
-                    decoded = base64.b64decode(enc[6:]).decode("utf-8", "ignore")
-                    u, _, p = decoded.partition(":")
-                    if p != password:
-                        _http_send(client, "407 Proxy Authentication Required",
-                                   'Proxy-Authenticate: Basic realm="KuyProxy"\r\n')
-                        http_log.warning(f"Auth fail: {u}")
-                        return
-                    username = u
-            except:
-                pass
-            break
+    ok, username = _http_proxy_auth(req, password)
+    if not ok:
+        _http_send(client, "407 Proxy Authentication Required",
+                   'Proxy-Authenticate: Basic realm="KuyProxy"\r\n')
+        http_log.warning(f"Auth fail: {username}")
+        return
 
     # Auth required
     if password and username is None:
@@ -333,101 +2316,1480 @@ def _http_session(client, cfg, pool):
 
     # Sticky IP
     if username:
-        bind_ip = resolve_user_ip(username, base_user, pool)
+        bind_ip = resolver.resolve(username)
     user_label = username or "anon"
+    traffic.observe(H_AUTH, time.monotonic() - started)
     http_log.info(f"✅ {user_label} → {bind_ip or 'default'}")
 
-    with stats_lock:
-        stats["connections"] += 1
+    traffic.add(stats_key(user_label, bind_ip, "http"), F_CONNS)
 
     if method == "CONNECT":
         # HTTPS tunneling
-        host, _, port_str = target.partition(":")
-        port = int(port_str) if port_str else 443
+        host, port = _split_hostport(target, 443)
+        tunnel = Tunnel(user_label, bind_ip, "http")
+        if not limiter.admit(tunnel):
+            http_log.warning(f"Limit koneksi: {user_label} ({bind_ip or 'default'})")
+            _http_send(client, "429 Too Many Requests")
+            return
         try:
-            remote = make_outbound_socket(bind_ip, host)
-            remote.connect((host, port))
+            remote = open_outbound(bind_ip, host, port, ipv6_only,
+                                   stat=stats_key(user_label, bind_ip, "http"))
             remote.settimeout(None)
             client.sendall(b"HTTP/1.1 200 Connection Established\r\n\r\n")
+            if reader.pending:
+                remote.sendall(reader.take())
+            tunnel.target = f"{host}:{port}"
             http_log.info(f"► {user_label} CONNECT {host}:{port}")
-            relay(client, remote, http_log, f"{user_label}→{host}:{port}")
+            if relay(client, remote, http_log, f"{user_label}→{host}:{port}", tunnel):
+                return True
             remote.close()
         except Exception as e:
+            limiter.release(tunnel)
             http_log.debug(f"CONNECT {host}:{port} failed: {e}")
             _http_send(client, "502 Bad Gateway")
     else:
-        # Plain HTTP (GET/POST/etc)
-        from urllib.parse import urlparse
-        parsed = urlparse(target)
-        host   = parsed.hostname or ""
-        port   = parsed.port or 80
-        path   = parsed.path or "/"
-        if parsed.query:
-            path += "?" + parsed.query
-
-        # Rebuild request tanpa Proxy headers
-        new_req = f"{method} {path} HTTP/1.1\r\n"
-        for line in lines[1:]:
-            if line.lower().startswith(("proxy-auth", "proxy-connection")):
-                continue
-            new_req += line + "\r\n"
-        new_req += "\r\n"
-        body = raw.split(b"\r\n\r\n", 1)[1] if b"\r\n\r\n" in raw else b""
+        # Plain HTTP (GET/POST/etc), keep-alive + upstream pool
+        return _http_forward(client, reader, req, username, bind_ip,
+                             ipv6_only, resolver, password)
+
+# ── HTTP Header Parser ────────────────────────────────────────
+HTTP_MAX_HEADER_BYTES = 32768
+HTTP_MAX_HEADER_LINES = 100
+_HOP_DROP = (b"proxy-auth", b"proxy-connection")
+
+class HeaderTooLarge(ValueError):
+    pass
+
+def _header_limit(cfg):
+    """HTTP_MAX_HEADER_BYTES dari snapshot config, dibaca per request."""
+    try:
+        return int(cfg.get("HTTP_MAX_HEADER_BYTES", 0) or 0) or HTTP_MAX_HEADER_BYTES
+    except ValueError:
+        return HTTP_MAX_HEADER_BYTES
+
+class HTTPHead:
+    """Header HTTP ter-parse. `lines` = baris header mentah (bytes) untuk
+    diteruskan apa adanya, `headers` = nama lowercase → nilai."""
+    __slots__ = ("method", "target", "version", "status", "lines", "headers")
+
+def _split_head(raw, max_lines):
+    lines = raw[:-4].split(b"\r\n")
+    if len(lines) - 1 > max_lines:
+        raise HeaderTooLarge("too many header lines")
+    head = HTTPHead()
+    head.lines, head.headers = lines[1:], {}
+    for line in head.lines:
+        k, sep, v = line.partition(b":")
+        if sep:
+            head.headers[k.strip().lower().decode("latin-1")] = v.strip().decode("latin-1")
+    return lines[0].decode("latin-1"), head
+
+def parse_request(raw, max_lines=None):
+    """Header request → HTTPHead atau None kalau request line rusak."""
+    start, head = _split_head(raw, max_lines or HTTP_MAX_HEADER_LINES)
+    parts = start.split(" ")
+    if len(parts) < 3:
+        return None
+    head.method, head.target, head.version = parts[0].upper(), parts[1], parts[-1]
+    head.status = None
+    return head
+
+def parse_response(raw):
+    start, head = _split_head(raw, 1 << 16)
+    parts = start.split(" ", 2)
+    head.version, head.status = parts[0], int(parts[1])
+    head.method = head.target = None
+    return head
+
+def _http_proxy_auth(head, password):
+    """Cek Proxy-Authorization → (ok, username). ok=False berarti password salah."""
+    enc = head.headers.get("proxy-authorization")
+    if enc is None:
+        return True, None
+    try:
+        if enc.lower().startswith("basic "):
+            decoded = base64.b64decode(enc[6:]).decode("utf-8", "ignore")
+            u, _, p = decoded.partition(":")
+            if p != password:
+                return False, u
+            return True, u
+    except:
+        pass
+    return True, None
+
+def _split_hostport(target, default):
+    """"host:port" / "[v6]:port" / "host" → (host, port)."""
+    name, sep, p = target.rpartition(":")
+    if sep and p.isdigit() and (not name.startswith("[") or name.endswith("]")) \
+            and (name.startswith("[") or ":" not in name):
+        return name.strip("[]"), int(p)
+    return target.strip("[]"), default
+
+def _http_rewrite_request(head, drop_expect=False):
+    """Absolute-URI request → (host, port, path, request bytes tanpa Proxy headers).
+    Request dibangun dengan satu join dari baris header mentah."""
+    from urllib.parse import urlparse
+    parsed = urlparse(head.target)
+    host   = parsed.hostname or ""
+    port   = parsed.port or 80
+    path   = parsed.path or "/"
+    if parsed.query:
+        path += "?" + parsed.query
+    if not host:
+        # Origin-form ("/path") → tujuan dari header Host
+        host, port = _split_hostport(head.headers.get("host", ""), 80)
+
+    drop  = _HOP_DROP + (b"expect",) if drop_expect else _HOP_DROP
+    parts = [f"{head.method} {path} {head.version}".encode("latin-1")]
+    parts += [l for l in head.lines if not l[:16].lower().startswith(drop)]
+    parts += [b"", b""]
+    return host, port, path, b"\r\n".join(parts)
+
+# ── HTTP/1.1 Forwarding ───────────────────────────────────────
+# Request plain-HTTP di-parse satu per satu pada koneksi client yang
+# persistent; koneksi upstream disimpan per (bind_ip, host, port) dan
+# dipakai ulang selama masih segar.
+UPSTREAM_MAX_IDLE     = 4      # per (bind_ip, host, port)
+UPSTREAM_IDLE_TIMEOUT = 30
+UPSTREAM_MAX_AGE      = 300
+
+class SockReader:
+    """Reader ber-buffer di atas socket blocking.
+
+    Terminator hanya dicari di byte yang baru masuk. Sisa buffer (body
+    pipelined yang ikut terbaca bersama header) diteruskan lewat
+    memoryview tanpa disalin ulang."""
+
+    def __init__(self, sock):
+        self.sock    = sock
+        self.buf     = bytearray()
+        self.pos     = 0
+        self.scratch = None
+
+    def _compact(self):
+        if self.pos and (self.pos == len(self.buf) or self.pos >= 65536):
+            del self.buf[:self.pos]
+            self.pos = 0
+
+    def _fill(self):
+        chunk = self.sock.recv(65536)
+        if not chunk:
+            return False
+        self.buf += chunk
+        return True
 
+    def _until(self, sep, limit):
+        self._compact()
+        start = self.pos
+        while True:
+            i = self.buf.find(sep, start)
+            if i >= 0:
+                end = i + len(sep)
+                if end - self.pos > limit:
+                    raise HeaderTooLarge("header too large")
+                data = bytes(self.buf[self.pos:end])
+                self.pos = end
+                return data
+            if len(self.buf) - self.pos > limit:
+                raise HeaderTooLarge("header too large")
+            start = max(self.pos, len(self.buf) - len(sep) + 1)
+            if not self._fill():
+                if len(self.buf) > self.pos:
+                    raise ConnectionError("connection closed mid-message")
+                return None
+
+    def read_head(self, limit=65536):
+        """Header sampai CRLFCRLF, None kalau EOF bersih sebelum byte pertama."""
+        return self._until(b"\r\n\r\n", limit)
+
+    def read_line(self, limit=8192):
+        line = self._until(b"\r\n", limit)
+        if line is None:
+            raise ConnectionError("connection closed")
+        return line
+
+    def forward(self, dst, n):
+        """Kirim maksimal n byte ke dst: dari buffer dulu, lalu langsung
+        recv_into scratch. Return jumlah byte (0 = EOF)."""
+        avail = len(self.buf) - self.pos
+        if avail:
+            k = min(n, avail)
+            with memoryview(self.buf) as mv:
+                dst.sendall(mv[self.pos:self.pos + k])
+            self.pos += k
+            self._compact()
+            return k
+        if self.scratch is None:
+            self.scratch = buffer_pool.acquire(CHUNK_MIN * 4)
+        with memoryview(self.scratch) as mv:
+            got = self.sock.recv_into(mv, min(n, len(self.scratch)))
+            if got:
+                dst.sendall(mv[:got])
+        return got
+
+    @property
+    def pending(self):
+        return len(self.buf) - self.pos
+
+    def take(self):
+        data = bytes(self.buf[self.pos:])
+        self.buf.clear()
+        self.pos = 0
+        return data
+
+    def release(self):
+        if self.scratch is not None:
+            buffer_pool.release(self.scratch)
+            self.scratch = None
+
+def _body_framing(hdrs, method=None, status=None):
+    """→ ("none" | "length" | "chunked" | "close", length)."""
+    if status is not None and (method == "HEAD" or 100 <= status < 200 or status in (204, 304)):
+        return "none", 0
+    if "chunked" in hdrs.get("transfer-encoding", "").lower():
+        return "chunked", 0
+    if "content-length" in hdrs:
+        return "length", int(hdrs["content-length"])
+    return ("close", 0) if status is not None else ("none", 0)
+
+def _keep_alive(version, hdrs):
+    conn = hdrs.get("connection", "").lower()
+    if version == "HTTP/1.0":
+        return "keep-alive" in conn
+    return "close" not in conn
+
+def _pace(shape, n):
+    """shape = (tunnel, up) → jeda sesuai RateLimiter setelah n byte."""
+    if shape:
+        wait = limiter.delay(shape[0], n, shape[1])
+        if wait:
+            time.sleep(wait)
+
+def _forward_fixed(reader, dst, n, shape=None):
+    total = n
+    while n > 0:
+        got = reader.forward(dst, limiter.chunk(shape[0], n) if shape else n)
+        if not got:
+            raise ConnectionError("connection closed mid-body")
+        n -= got
+        _pace(shape, got)
+    return total
+
+def _forward_chunked(reader, dst, shape=None):
+    total = 0
+    while True:
+        line = reader.read_line()
+        dst.sendall(line)
+        total += len(line)
+        size = int(line.split(b";")[0].strip() or b"0", 16)
+        if size == 0:
+            while True:
+                trailer = reader.read_line()
+                dst.sendall(trailer)
+                total += len(trailer)
+                if trailer == b"\r\n":
+                    return total
+        total += _forward_fixed(reader, dst, size + 2, shape)
+
+def _forward_body(reader, dst, framing, shape=None):
+    kind, length = framing
+    if kind == "length":
+        return _forward_fixed(reader, dst, length, shape)
+    if kind == "chunked":
+        return _forward_chunked(reader, dst, shape)
+    if kind == "close":
+        total = 0
+        while True:
+            got = reader.forward(dst, limiter.chunk(shape[0], 1 << 16) if shape else 1 << 16)
+            if not got:
+                return total
+            total += got
+            _pace(shape, got)
+    return 0
+
+class Upstream:
+    __slots__ = ("sock", "reader", "writer", "created", "used")
+
+    def __init__(self, sock=None, reader=None, writer=None):
+        self.sock    = sock
+        self.reader  = reader if reader is not None else SockReader(sock)
+        self.writer  = writer
+        self.created = self.used = time.monotonic()
+
+    def alive(self):
+        if self.writer is not None:      # asyncio stream
+            return not self.reader.at_eof() and not self.writer.is_closing()
+        if self.reader.pending:
+            return False
+        return not wait_fd(self.sock, select.POLLIN, 0)   # idle tapi readable = EOF / sampah
+
+    def close(self):
+        if self.writer is None:
+            self.reader.release()
         try:
-            remote = make_outbound_socket(bind_ip, host)
-            remote.connect((host, port))
-            remote.settimeout(None)
-            remote.sendall(new_req.encode() + body)
+            (self.writer or self.sock).close()
+        except:
+            pass
+
+class UpstreamPool:
+    """Koneksi upstream idle per (bind_ip, host, port) dengan batas
+    jumlah idle, idle timeout, dan umur maksimum."""
+
+    def __init__(self):
+        self.idle  = {}
+        self.lock  = threading.Lock()
+        self.swept = time.monotonic()
+
+    def _fresh(self, conn, now):
+        return (now - conn.used <= UPSTREAM_IDLE_TIMEOUT
+                and now - conn.created <= UPSTREAM_MAX_AGE)
+
+    def get(self, key):
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                lst = self.idle.get(key)
+                if not lst:
+                    return None
+                conn = lst.pop()
+            if self._fresh(conn, now) and conn.alive():
+                return conn
+            conn.close()
+
+    def put(self, key, conn):
+        now = time.monotonic()
+        conn.used = now
+        if UPSTREAM_MAX_IDLE <= 0 or not self._fresh(conn, now):
+            return conn.close()
+        evict = []
+        with self.lock:
+            lst = self.idle.setdefault(key, [])
+            lst.append(conn)
+            while len(lst) > UPSTREAM_MAX_IDLE:
+                evict.append(lst.pop(0))
+            if now - self.swept >= UPSTREAM_IDLE_TIMEOUT:
+                self.swept = now
+                for k in list(self.idle):
+                    keep = [c for c in self.idle[k] if self._fresh(c, now)]
+                    evict += [c for c in self.idle[k] if c not in keep]
+                    if keep:
+                        self.idle[k] = keep
+                    else:
+                        del self.idle[k]
+        for c in evict:
+            c.close()
+
+    def retire(self, bind_ip):
+        """Tutup semua koneksi idle yang keluar dari `bind_ip` (IP dirotasi)."""
+        with self.lock:
+            keys = [k for k in self.idle if k[0] == bind_ip]
+            conns = [c for k in keys for c in self.idle.pop(k)]
+        for c in conns:
+            c.close()
+        return len(conns)
+
+upstream_pool = UpstreamPool()
+
+def _http_forward(client, reader, req, username, bind_ip, ipv6_only, resolver, password):
+    """Loop request/response HTTP/1.1 di satu koneksi client."""
+    user_label = username or "anon"
+    tunnel = Tunnel(user_label, bind_ip, "http")
+    if not limiter.admit(tunnel):
+        http_log.warning(f"Limit koneksi: {user_label} ({bind_ip or 'default'})")
+        _http_send(client, "429 Too Many Requests")
+        return
+    tunnel_open(tunnel)
+    handed = False                  # True → tunnel ditutup oleh relay
+    try:
+        while True:
+            method  = req.method
+            expect  = req.headers.get("expect", "").lower() == "100-continue"
+            host, port, path, head = _http_rewrite_request(req, expect)
+            framing = _body_framing(req.headers)
+            key     = (bind_ip, host, port)
+            tunnel.target = f"{host}:{port}"
             http_log.info(f"► {user_label} {method} {host}:{port}{path}")
-            relay(client, remote, http_log)
-            remote.close()
-        except Exception as e:
-            http_log.debug(f"HTTP {host}:{port} failed: {e}")
-            _http_send(client, "502 Bad Gateway")
 
-def _http_send(client, status, extra_headers="", body=""):
+            if expect:
+                # Proxy jawab 100 sendiri, header Expect tidak diteruskan
+                client.sendall(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+            up = upstream_pool.get(key)
+            reused = up is not None
+            while True:
+                if up is None:
+                    try:
+                        sock = open_outbound(bind_ip, host, port, ipv6_only,
+                                             stat=tunnel.key())
+                    except Exception as e:
+                        http_log.debug(f"HTTP {host}:{port} failed: {e}")
+                        _http_send(client, "502 Bad Gateway")
+                        return
+                    sock.settimeout(RELAY_IDLE)
+                    up = Upstream(sock)
+                try:
+                    up.sock.sendall(head)
+                    sent = len(head) + _forward_body(reader, up.sock, framing, (tunnel, True))
+                    sent_at = time.monotonic()
+                    resp = up.reader.read_head()
+                    if resp is None:
+                        raise ConnectionError("upstream closed")
+                    traffic.observe(H_FIRST_BYTE, time.monotonic() - sent_at)
+                    break
+                except (OSError, ValueError) as e:
+                    up.close()
+                    up = None
+                    # Koneksi pool basi → ulang sekali dengan koneksi baru
+                    if reused and framing[0] == "none":
+                        reused = False
+                        continue
+                    http_log.debug(f"HTTP {host}:{port} failed: {e}")
+                    _http_send(client, "502 Bad Gateway")
+                    return
+            tunnel.bytes_up += sent
+
+            try:
+                r_head = parse_response(resp)
+                while 100 <= r_head.status < 200 and r_head.status != 101:
+                    if not expect:
+                        client.sendall(resp)
+                    resp = up.reader.read_head()
+                    if resp is None:
+                        up.close()
+                        return
+                    r_head = parse_response(resp)
+
+                client.sendall(resp)
+                if r_head.status == 101:
+                    # Upgrade (WebSocket dsb.) → relay mentah, tunnel yang
+                    # sudah di-admit ikut diserahkan (relay yang menutupnya)
+                    if reader.pending:
+                        up.sock.sendall(reader.take())
+                    if up.reader.pending:
+                        client.sendall(up.reader.take())
+                    up.sock.settimeout(None)
+                    handed = True
+                    if relay(client, up.sock, http_log, tunnel=tunnel):
+                        return True
+                    up.close()
+                    return
+
+                r_frame = _body_framing(r_head.headers, method, r_head.status)
+                tunnel.bytes_down += len(resp) + _forward_body(up.reader, client, r_frame, (tunnel, False))
+            except:
+                # Putus di tengah respons → posisi stream upstream tidak
+                # jelas, jangan balik ke pool
+                up.close()
+                raise
+
+            if r_frame[0] != "close" and _keep_alive(r_head.version, r_head.headers):
+                upstream_pool.put(key, up)
+            else:
+                up.close()
+            if r_frame[0] == "close" or not _keep_alive(req.version, req.headers):
+                return
+
+            # ── Request berikutnya di koneksi yang sama ──
+            try:
+                raw = reader.read_head(_header_limit(config_store.get().cfg))
+                if raw is None:
+                    return
+                req = parse_request(raw)
+            except HeaderTooLarge:
+                _http_send(client, "431 Request Header Fields Too Large")
+                return
+            if not req:
+                return
+            if req.method == "CONNECT":
+                # CONNECT hanya boleh sebagai request pertama koneksi
+                _http_send(client, "405 Method Not Allowed")
+                return
+            ok, u = _http_proxy_auth(req, password)
+            if not ok:
+                _http_send(client, "407 Proxy Authentication Required",
+                           'Proxy-Authenticate: Basic realm="KuyProxy"\r\n')
+                return
+            # Resolve ulang tiap request: user bisa ganti, atau IP-nya
+            # baru dirotasi → request berikut sudah keluar dari IP baru
+            u  = u or username
+            ip = config_store.get().resolver.resolve(u) if u else bind_ip
+            if u != username or ip != bind_ip:
+                username, bind_ip = u, ip
+                user_label = tunnel.user = u or "anon"
+                tunnel.bind_ip = bind_ip
+                tunnel.limits_gen = -1      # limit ikut user / IP baru
+                # Slot tunnel bersamaan pindah ke user / IP baru
+                limiter.release(tunnel)
+                if not limiter.admit(tunnel):
+                    http_log.warning(f"Limit koneksi: {user_label} ({bind_ip or 'default'})")
+                    _http_send(client, "429 Too Many Requests")
+                    return
+    finally:
+        reader.release()
+        if not handed:
+            tunnel_close(tunnel)
+
+def _http_response(status, extra_headers="", body=""):
     body_bytes = body.encode() if isinstance(body, str) else body
     resp = (f"HTTP/1.1 {status}\r\n"
             f"Content-Length: {len(body_bytes)}\r\n"
             f"{extra_headers}"
             f"\r\n")
+    return resp.encode() + body_bytes
+
+def _http_send(client, status, extra_headers="", body=""):
+    try:
+        client.sendall(_http_response(status, extra_headers, body))
+    except:
+        pass
+
+# ════════════════════════════════════════════
+# ASYNC ENGINE (PROXY_ENGINE=async)
+# ════════════════════════════════════════════
+# Semua sesi jalan sebagai coroutine di satu event loop, jadi tunnel
+# yang idle tidak memegang thread. Protokol & sticky IP sama persis
+# dengan engine thread di atas.
+
+HANDSHAKE_TIMEOUT = 30
+IDLE_TIMEOUT      = 60
+
+async def recv_exact_async(reader, n):
+    try:
+        return await asyncio.wait_for(reader.readexactly(n), HANDSHAKE_TIMEOUT)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("connection closed")
+
+async def _send_async(writer, data):
+    writer.write(data)
+    await writer.drain()
+
+async def _close_writer(writer):
     try:
-        client.sendall(resp.encode() + body_bytes)
+        writer.close()
+        await writer.wait_closed()
     except:
         pass
 
+async def _target_addrs_async(host):
+    """Literal / cache hit langsung, cache miss di-resolve di executor."""
+    addrs = _literal_addrs(host) or dns_cache.cached(host)
+    if addrs is not None:
+        return addrs
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, dns_cache.lookup, host)
+
+async def open_outbound_async(bind_ip, host, port, ipv6_only=False, timeout=10, stat=None):
+    """Versi async dari open_outbound (Happy Eyeballs, sticky bind tetap)."""
+    loop    = asyncio.get_running_loop()
+    started = time.monotonic()
+
+    async def attempt(family, ip):
+        sock = _attempt_socket(family, ip, bind_ip, None)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, (ip, port))
+        except:
+            sock.close()
+            raise
+        return sock, family
+
+    tasks, last_err, winner = set(), None, None
+    deadline = loop.time() + timeout
+    try:
+        addrs = _literal_addrs(host)
+        if addrs is None:
+            addrs = await _target_addrs_async(host)
+            traffic.observe(H_DNS, time.monotonic() - started)
+            started = time.monotonic()
+        cands = _candidates(host, port, addrs, bind_ip, ipv6_only)
+        while winner is None:
+            if cands:
+                tasks.add(asyncio.ensure_future(attempt(*cands.pop(0))))
+            if not tasks:
+                raise last_err or OSError(errno.EHOSTUNREACH, "no candidates")
+            left = deadline - loop.time()
+            if left <= 0:
+                raise asyncio.TimeoutError()
+            done, _ = await asyncio.wait(tasks, timeout=min(HE_DELAY, left) if cands else left,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                tasks.discard(t)
+                if t.exception():
+                    last_err = t.exception()
+                elif winner is None:
+                    winner = t.result()
+                else:
+                    t.result()[0].close()
+    except:
+        if stat:
+            traffic.add(stat, F_ERRORS)
+        raise
+    finally:
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    sock, family = winner
+    _remember_family(host, port, family)
+    if stat:
+        traffic.connected(stat, started)
+    try:
+        return await asyncio.open_connection(sock=sock)
+    except:
+        sock.close()
+        raise
+
+async def relay_async(r1, w1, r2, w2, tunnel=None, idle=IDLE_TIMEOUT):
+    """Bidirectional relay antara dua stream, selesai saat salah satu EOF/idle."""
+    loop = asyncio.get_running_loop()
+    last = [loop.time()]
+    tunnel = tunnel or Tunnel()
+
+    async def pipe(reader, writer, key):
+        up = key == "bytes_up"
+        while True:
+            data = await reader.read(limiter.chunk(tunnel, 65536))
+            if not data:
+                return
+            if not up and not tunnel.bytes_down:
+                traffic.first_byte(tunnel)
+            writer.write(data)
+            await writer.drain()
+            last[0] = loop.time()
+            setattr(tunnel, key, getattr(tunnel, key) + len(data))
+            wait = limiter.delay(tunnel, len(data), up)
+            if wait:
+                await asyncio.sleep(wait)
+
+    if not tunnel.opened:
+        tunnel_open(tunnel)
+    tasks = {asyncio.ensure_future(pipe(r1, w2, "bytes_up")),
+             asyncio.ensure_future(pipe(r2, w1, "bytes_down"))}
+    try:
+        while True:
+            done, _ = await asyncio.wait(tasks, timeout=idle,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if done or loop.time() - last[0] >= idle:
+                break
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        tunnel_close(tunnel)
+
+async def handle_socks5_client_async(reader, writer, cfg, resolver):
+    try:
+        await _socks5_session_async(reader, writer, cfg, resolver)
+    except Exception as e:
+        s5_log.debug(f"Session error: {e}")
+    finally:
+        await _close_writer(writer)
+
+async def _socks5_session_async(reader, writer, cfg, resolver):
+    started   = time.monotonic()
+    password  = cfg.get("SOCKS_PASSWORD", "")
+    ipv6_only = cfg.get("IPV6_ONLY", "false").lower() == "true"
+
+    # ── Greeting ──────────────────────────
+    ver = (await recv_exact_async(reader, 1))[0]
+    if ver != SOCKS5_VER:
+        return
+    n = (await recv_exact_async(reader, 1))[0]
+    methods = set(await recv_exact_async(reader, n))
+
+    if password and AUTH_USER_PASS in methods:
+        await _send_async(writer, bytes([SOCKS5_VER, AUTH_USER_PASS]))
+    elif not password and AUTH_NONE in methods:
+        await _send_async(writer, bytes([SOCKS5_VER, AUTH_NONE]))
+        await _socks5_request_async(reader, writer, None, ipv6_only, "anon", cfg)
+        return
+    else:
+        await _send_async(writer, bytes([SOCKS5_VER, AUTH_NO_ACCEPT]))
+        return
+
+    # ── Auth ──────────────────────────────
+    await recv_exact_async(reader, 1)  # sub-ver
+    ulen = (await recv_exact_async(reader, 1))[0]
+    username = (await recv_exact_async(reader, ulen)).decode("utf-8", "ignore")
+    plen = (await recv_exact_async(reader, 1))[0]
+    sent_pass = (await recv_exact_async(reader, plen)).decode("utf-8", "ignore")
+
+    if sent_pass != password:
+        await _send_async(writer, bytes([0x01, 0x01]))
+        s5_log.warning(f"Auth fail: {username}")
+        return
+    await _send_async(writer, bytes([0x01, 0x00]))
+    traffic.observe(H_AUTH, time.monotonic() - started)
+
+    # ── Sticky IP ─────────────────────────
+    bind_ip = resolver.resolve(username)
+    s5_log.info(f"✅ {username} → {bind_ip or 'default'}")
+
+    traffic.add(stats_key(username, bind_ip, "socks5"), F_CONNS)
+
+    await _socks5_request_async(reader, writer, bind_ip, ipv6_only, username, cfg)
+
+async def _socks5_request_async(reader, writer, bind_ip, ipv6_only, username, cfg):
+    hdr = await recv_exact_async(reader, 4)
+    ver, cmd, _, atyp = hdr
+
+    if ver != SOCKS5_VER or cmd not in (CMD_CONNECT, CMD_UDP) or \
+            (cmd == CMD_UDP and not UDP_ASSOCIATE):
+        await _send_async(writer, bytes([SOCKS5_VER, 0x07, 0x00, 0x01]) + b'\x00'*4 + b'\x00\x00')
+        return
+
+    # Parse target
+    if atyp == ATYP_IPV4:
+        raw = await recv_exact_async(reader, 4)
+        host = socket.inet_ntop(socket.AF_INET, raw)
+    elif atyp == ATYP_DOMAIN:
+        dlen = (await recv_exact_async(reader, 1))[0]
+        host = (await recv_exact_async(reader, dlen)).decode()
+    elif atyp == ATYP_IPV6:
+        raw = await recv_exact_async(reader, 16)
+        host = socket.inet_ntop(socket.AF_INET6, raw)
+    else:
+        return
+
+    port = struct.unpack("!H", await recv_exact_async(reader, 2))[0]
+    if cmd == CMD_UDP:
+        await _socks5_udp_async(reader, writer, bind_ip, ipv6_only, username, host, port)
+        return
+
+    # Connect
+    tunnel = Tunnel(username, bind_ip, "socks5")
+    if not limiter.admit(tunnel):
+        s5_log.warning(f"Limit koneksi: {username} ({bind_ip or 'default'})")
+        await _send_async(writer, bytes([SOCKS5_VER, 0x02, 0x00, ATYP_IPV4]) + b'\x00'*4 + b'\x00\x00')
+        return
+    try:
+        r_reader, r_writer = await open_outbound_async(
+            bind_ip, host, port, ipv6_only, stat=stats_key(username, bind_ip, "socks5"))
+    except Exception as e:
+        limiter.release(tunnel)
+        s5_log.debug(f"Connect {host}:{port} failed: {e}")
+        err_reply = bytes([SOCKS5_VER, 0x05, 0x00, ATYP_IPV4]) + b'\x00'*4 + b'\x00\x00'
+        try: await _send_async(writer, err_reply)
+        except: pass
+        return
+
+    try:
+        local_addr = r_writer.get_extra_info("sockname")
+        local_ip   = local_addr[0] if local_addr else "0.0.0.0"
+        local_port = local_addr[1] if local_addr else 0
+
+        if ":" in local_ip:
+            addr_bytes = socket.inet_pton(socket.AF_INET6, local_ip)
+            reply = bytes([SOCKS5_VER, 0x00, 0x00, ATYP_IPV6]) + addr_bytes
+        else:
+            addr_bytes = socket.inet_aton(local_ip)
+            reply = bytes([SOCKS5_VER, 0x00, 0x00, ATYP_IPV4]) + addr_bytes
+
+        reply += struct.pack("!H", local_port)
+        await _send_async(writer, reply)
+
+        tunnel.target = f"{host}:{port}"
+        s5_log.info(f"► {username} {host}:{port}")
+        await relay_async(reader, writer, r_reader, r_writer, tunnel)
+    finally:
+        limiter.release(tunnel)
+        await _close_writer(r_writer)
+
+async def _socks5_udp_async(reader, writer, bind_ip, ipv6_only, username, host, port):
+    assoc, err = _open_assoc(username, bind_ip, ipv6_only, writer.get_extra_info("sockname"),
+                             writer.get_extra_info("peername"), host, port)
+    if assoc is None:
+        await _send_async(writer, bytes([SOCKS5_VER, err, 0x00, ATYP_IPV4]) + b'\x00'*4 + b'\x00\x00')
+        return
+    try:
+        await _send_async(writer, _socks5_bound_reply(0x00, assoc.client.getsockname()))
+    except Exception:
+        limiter.release(assoc.tunnel)
+        assoc.close_sockets()
+        raise
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def _closed():
+        try:
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+        except RuntimeError:
+            pass    # loop sudah berhenti
+
+    async def _watch_ctrl():
+        try:
+            while await reader.read(4096):
+                pass
+        except (ConnectionError, OSError):
+            pass
+
+    # Socket kontrol tetap milik event loop; relay hanya diberi tahu saat EOF
+    assoc.on_close = _closed
+    relay = get_udp_relay()
+    relay.add(assoc)
+    s5_log.info(f"► {username} UDP via {bind_ip or 'default'}")
+    watch = asyncio.ensure_future(_watch_ctrl())
+    try:
+        await asyncio.wait({watch, done}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watch.cancel()
+        relay.close(assoc)
+
+async def handle_http_client_async(reader, writer, cfg, resolver):
+    try:
+        await _http_session_async(reader, writer, cfg, resolver)
+    except Exception as e:
+        http_log.debug(f"HTTP session error: {e}")
+    finally:
+        await _close_writer(writer)
+
+async def _http_session_async(reader, writer, cfg, resolver):
+    started   = time.monotonic()
+    password  = cfg.get("SOCKS_PASSWORD", "")
+    ipv6_only = cfg.get("IPV6_ONLY", "false").lower() == "true"
+
+    # Baca request pertama (sisa body tetap di buffer reader)
+    try:
+        raw = await asyncio.wait_for(read_head_async(reader, _header_limit(cfg)), HANDSHAKE_TIMEOUT)
+        if raw is None:
+            return
+        req = parse_request(raw)
+    except HeaderTooLarge:
+        await _send_async(writer, _http_response("431 Request Header Fields Too Large"))
+        return
+    if not req:
+        return
+    method, target = req.method, req.target
+    bind_ip = None
+
+    # ── Parse Proxy-Authorization ─────────
+    ok, username = _http_proxy_auth(req, password)
+    if not ok:
+        await _send_async(writer, _http_response("407 Proxy Authentication Required",
+                          'Proxy-Authenticate: Basic realm="KuyProxy"\r\n'))
+        http_log.warning(f"Auth fail: {username}")
+        return
+
+    # Auth required
+    if password and username is None:
+        await _send_async(writer, _http_response("407 Proxy Authentication Required",
+                          'Proxy-Authenticate: Basic realm="KuyProxy"\r\n'))
+        return
+
+    # Sticky IP
+    if username:
+        bind_ip = resolver.resolve(username)
+    user_label = username or "anon"
+    traffic.observe(H_AUTH, time.monotonic() - started)
+    http_log.info(f"✅ {user_label} → {bind_ip or 'default'}")
+
+    traffic.add(stats_key(user_label, bind_ip, "http"), F_CONNS)
+
+    if method != "CONNECT":
+        # Plain HTTP (GET/POST/etc), keep-alive + upstream pool
+        await _http_forward_async(reader, writer, req, username, bind_ip,
+                                  ipv6_only, resolver, password)
+        return
+
+    # HTTPS tunneling
+    host, port = _split_hostport(target, 443)
+    tunnel = Tunnel(user_label, bind_ip, "http")
+    if not limiter.admit(tunnel):
+        http_log.warning(f"Limit koneksi: {user_label} ({bind_ip or 'default'})")
+        await _send_async(writer, _http_response("429 Too Many Requests"))
+        return
+    try:
+        r_reader, r_writer = await open_outbound_async(
+            bind_ip, host, port, ipv6_only, stat=stats_key(user_label, bind_ip, "http"))
+    except Exception as e:
+        limiter.release(tunnel)
+        http_log.debug(f"CONNECT {host}:{port} failed: {e}")
+        try: await _send_async(writer, _http_response("502 Bad Gateway"))
+        except: pass
+        return
+
+    try:
+        await _send_async(writer, b"HTTP/1.1 200 Connection Established\r\n\r\n")
+        tunnel.target = f"{host}:{port}"
+        http_log.info(f"► {user_label} CONNECT {host}:{port}")
+        await relay_async(reader, writer, r_reader, r_writer, tunnel)
+    finally:
+        limiter.release(tunnel)
+        await _close_writer(r_writer)
+
+async def read_head_async(reader, limit=65536):
+    """Header sampai CRLFCRLF, None kalau EOF bersih sebelum byte pertama.
+    `limit` dicek di sini, bukan lewat limit StreamReader (yang tetap
+    sejak listener dibuat), jadi HTTP_MAX_HEADER_BYTES ikut reload."""
+    head = b""
+    while True:
+        try:
+            head += await reader.readuntil(b"\r\n\r\n")
+            done = True
+        except asyncio.IncompleteReadError as e:
+            if head or e.partial:
+                raise ConnectionError("connection closed mid-message")
+            return None
+        except asyncio.LimitOverrunError as e:
+            # Buffer reader penuh → ambil yang pasti bukan terminator, cari lagi
+            head += await reader.readexactly(e.consumed)
+            done = False
+        if len(head) > limit:
+            raise HeaderTooLarge("header too large")
+        if done:
+            return head
+
+async def _read_line_async(reader):
+    try:
+        return await asyncio.wait_for(reader.readuntil(b"\r\n"), RELAY_IDLE)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("connection closed mid-body")
+    except asyncio.LimitOverrunError:
+        raise ValueError("chunk line too long")
+
+async def _pace_async(shape, n):
+    if shape:
+        wait = limiter.delay(shape[0], n, shape[1])
+        if wait:
+            await asyncio.sleep(wait)
+
+async def _forward_fixed_async(reader, writer, n, shape=None):
+    total = n
+    size  = limiter.chunk(shape[0], 65536) if shape else 65536
+    while n > 0:
+        # Idle timeout sama dengan socket engine thread (RELAY_IDLE)
+        data = await asyncio.wait_for(reader.read(min(n, size)), RELAY_IDLE)
+        if not data:
+            raise ConnectionError("connection closed mid-body")
+        await _send_async(writer, data)
+        n -= len(data)
+        await _pace_async(shape, len(data))
+    return total
+
+async def _forward_body_async(reader, writer, framing, shape=None):
+    kind, length = framing
+    if kind == "length":
+        return await _forward_fixed_async(reader, writer, length, shape)
+    total = 0
+    if kind == "chunked":
+        while True:
+            line = await _read_line_async(reader)
+            await _send_async(writer, line)
+            total += len(line)
+            size = int(line.split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                while True:
+                    trailer = await _read_line_async(reader)
+                    await _send_async(writer, trailer)
+                    total += len(trailer)
+                    if trailer == b"\r\n":
+                        return total
+            total += await _forward_fixed_async(reader, writer, size + 2, shape)
+    if kind == "close":
+        size = limiter.chunk(shape[0], 65536) if shape else 65536
+        while True:
+            data = await asyncio.wait_for(reader.read(size), RELAY_IDLE)
+            if not data:
+                return total
+            await _send_async(writer, data)
+            total += len(data)
+            await _pace_async(shape, len(data))
+    return 0
+
+async def _http_forward_async(reader, writer, req, username, bind_ip, ipv6_only, resolver, password):
+    """Versi async dari _http_forward."""
+    user_label = username or "anon"
+    tunnel = Tunnel(user_label, bind_ip, "http")
+    if not limiter.admit(tunnel):
+        http_log.warning(f"Limit koneksi: {user_label} ({bind_ip or 'default'})")
+        await _send_async(writer, _http_response("429 Too Many Requests"))
+        return
+    tunnel_open(tunnel)
+    handed = False
+    try:
+        while True:
+            method  = req.method
+            expect  = req.headers.get("expect", "").lower() == "100-continue"
+            host, port, path, head = _http_rewrite_request(req, expect)
+            framing = _body_framing(req.headers)
+            key     = (bind_ip, host, port)
+            tunnel.target = f"{host}:{port}"
+            http_log.info(f"► {user_label} {method} {host}:{port}{path}")
+
+            if expect:
+                await _send_async(writer, b"HTTP/1.1 100 Continue\r\n\r\n")
+
+            up = upstream_pool.get(key)
+            reused = up is not None
+            try:
+                while True:
+                    if up is None:
+                        try:
+                            r_reader, r_writer = await open_outbound_async(
+                                bind_ip, host, port, ipv6_only, stat=tunnel.key())
+                        except Exception as e:
+                            http_log.debug(f"HTTP {host}:{port} failed: {e}")
+                            await _send_async(writer, _http_response("502 Bad Gateway"))
+                            return
+                        up = Upstream(reader=r_reader, writer=r_writer)
+                    try:
+                        await _send_async(up.writer, head)
+                        sent = len(head) + await _forward_body_async(reader, up.writer, framing, (tunnel, True))
+                        sent_at = time.monotonic()
+                        resp = await asyncio.wait_for(read_head_async(up.reader), RELAY_IDLE)
+                        if resp is None:
+                            raise ConnectionError("upstream closed")
+                        traffic.observe(H_FIRST_BYTE, time.monotonic() - sent_at)
+                        break
+                    except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                        up.close()
+                        up = None
+                        if reused and framing[0] == "none":
+                            reused = False
+                            continue
+                        http_log.debug(f"HTTP {host}:{port} failed: {e}")
+                        await _send_async(writer, _http_response("502 Bad Gateway"))
+                        return
+                tunnel.bytes_up += sent
+
+                r_head = parse_response(resp)
+                while 100 <= r_head.status < 200 and r_head.status != 101:
+                    if not expect:
+                        await _send_async(writer, resp)
+                    resp = await asyncio.wait_for(read_head_async(up.reader), RELAY_IDLE)
+                    if resp is None:
+                        return
+                    r_head = parse_response(resp)
+
+                await _send_async(writer, resp)
+                if r_head.status == 101:
+                    handed = True
+                    try:
+                        await relay_async(reader, writer, up.reader, up.writer, tunnel)
+                    finally:
+                        await _close_writer(up.writer)
+                        up = None
+                    return
+
+                r_frame = _body_framing(r_head.headers, method, r_head.status)
+                tunnel.bytes_down += len(resp) + await _forward_body_async(up.reader, writer, r_frame, (tunnel, False))
+                if r_frame[0] != "close" and _keep_alive(r_head.version, r_head.headers):
+                    upstream_pool.put(key, up)
+                    up = None
+            finally:
+                # Selain yang masuk pool / diserahkan ke relay: upstream
+                # ditutup, termasuk saat putus di tengah body
+                if up is not None:
+                    up.close()
+            if r_frame[0] == "close" or not _keep_alive(req.version, req.headers):
+                return
+
+            # ── Request berikutnya di koneksi yang sama ──
+            try:
+                raw = await asyncio.wait_for(read_head_async(reader, _header_limit(config_store.get().cfg)),
+                                             HANDSHAKE_TIMEOUT)
+                if raw is None:
+                    return
+                req = parse_request(raw)
+            except HeaderTooLarge:
+                await _send_async(writer, _http_response("431 Request Header Fields Too Large"))
+                return
+            if not req:
+                return
+            if req.method == "CONNECT":
+                await _send_async(writer, _http_response("405 Method Not Allowed"))
+                return
+            ok, u = _http_proxy_auth(req, password)
+            if not ok:
+                await _send_async(writer, _http_response("407 Proxy Authentication Required",
+                                  'Proxy-Authenticate: Basic realm="KuyProxy"\r\n'))
+                return
+            # Resolve ulang tiap request: user bisa ganti, atau IP-nya
+            # baru dirotasi → request berikut sudah keluar dari IP baru
+            u  = u or username
+            ip = config_store.get().resolver.resolve(u) if u else bind_ip
+            if u != username or ip != bind_ip:
+                username, bind_ip = u, ip
+                user_label = tunnel.user = u or "anon"
+                tunnel.bind_ip = bind_ip
+                tunnel.limits_gen = -1      # limit ikut user / IP baru
+                limiter.release(tunnel)
+                if not limiter.admit(tunnel):
+                    http_log.warning(f"Limit koneksi: {user_label} ({bind_ip or 'default'})")
+                    await _send_async(writer, _http_response("429 Too Many Requests"))
+                    return
+    finally:
+        if not handed:
+            tunnel_close(tunnel)
+
+async def start_server_async(sock, handler, name):
+    async def _on_client(reader, writer):
+        snap = config_store.get()
+        loop_stats["sessions"] += 1
+        try:
+            await handler(reader, writer, snap.cfg, snap.resolver)
+        finally:
+            loop_stats["sessions"] -= 1
+
+    # asyncio sendiri sudah menguras sampai `backlog` accept per wakeup
+    srv = await asyncio.start_server(_on_client, sock=sock, backlog=LISTEN_BACKLOG)
+    listeners[name.strip().lower()] = sock
+    host, port = sock.getsockname()[:2]
+    logging.getLogger(name).info(f"Listening on {host}:{port}")
+    return srv
+
+async def _loop_monitor(interval=0.25):
+    """Lag event loop = seberapa telat sleep(interval) bangun (maks per detik)."""
+    loop = asyncio.get_running_loop()
+    worst, since = 0.0, loop.time()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        now = loop.time()
+        worst = max(worst, now - t0 - interval)
+        if now - since >= 1.0:
+            loop_stats["lag"], worst, since = worst, 0.0, now
+
+async def _serve_async(socks, handoff=None):
+    loop  = asyncio.get_running_loop()
+    wake  = asyncio.Event()
+    state = {"mode": None}
+
+    def _set(mode):
+        if state["mode"] != "stop":
+            state["mode"] = mode
+        wake.set()
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, _set, "stop")
+    loop.add_signal_handler(signal.SIGHUP, reload_config)
+    loop.add_signal_handler(signal.SIGQUIT, _set, "drain")
+    if handoff is not None:
+        def _upgrade():
+            # Tunggu proses baru di thread lain supaya loop tetap melayani
+            fut = loop.run_in_executor(None, upgrade, handoff)
+            fut.add_done_callback(lambda f: f.result() and _set("drain"))
+        loop.add_signal_handler(signal.SIGUSR2, _upgrade)
+
+    servers = [await start_server_async(socks["socks5"], handle_socks5_client_async, "SOCKS5"),
+               await start_server_async(socks["http"],   handle_http_client_async,   "HTTP  ")]
+    monitor = asyncio.ensure_future(_loop_monitor())
+    notify_ready()
+
+    await wake.wait()
+    for srv in servers:
+        srv.close()
+    if state["mode"] == "drain":
+        _stop_publishing()
+        log = logging.getLogger("MAIN ")
+        log.info(f"Draining {len(active_tunnels)} tunnel (maks {DRAIN_TIMEOUT}s)...")
+        deadline = loop.time() + DRAIN_TIMEOUT
+        while active_tunnels and state["mode"] == "drain" and loop.time() < deadline:
+            await asyncio.sleep(0.5)
+        _drained(log)
+    logging.getLogger("MAIN ").info("Shutting down...")
+    monitor.cancel()
+
 # ════════════════════════════════════════════
 # MAIN — Jalankan Kedua Server
 # ════════════════════════════════════════════
 
-def start_server(host, port, handler, executor, name):
+# ── Listener ────────────────────────────────────────────────
+LISTEN_BACKLOG      = 1024   # dibatasi kernel oleh net.core.somaxconn
+LISTEN_DEFER_ACCEPT = 5      # detik; 0 = mati
+LISTEN_FASTOPEN     = 256    # panjang antrian TFO; 0 = mati
+
+def tune_listener(sock):
+    """TCP_DEFER_ACCEPT: koneksi baru masuk accept queue setelah client
+    kirim byte pertama (SOCKS5 & HTTP selalu client duluan), jadi scanner
+    yang cuma SYN tidak memakan worker. TCP_FASTOPEN: data ikut di SYN.
+    Profil TCP inbound juga dipasang di sini (diwarisi socket accept)."""
+    tcp_tuning.apply(sock, tcp_tuning.inbound)
+    for opt, val in (("TCP_DEFER_ACCEPT", LISTEN_DEFER_ACCEPT),
+                     ("TCP_FASTOPEN", LISTEN_FASTOPEN)):
+        if val and hasattr(socket, opt):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, opt), val)
+            except OSError as e:
+                logging.getLogger("MAIN ").warning(f"  {opt} gagal: {e}")
+
+# Socket LISTEN warisan proses lama (upgrade SIGUSR2): nama → fd
+inherited_fds = {}
+
+def _parse_inherited():
+    for item in os.environ.pop("KUY_LISTEN_FDS", "").split(","):
+        name, _, fd = item.partition("=")
+        if fd.isdigit():
+            inherited_fds[name] = int(fd)
+
+def open_listener(name, port, host="0.0.0.0"):
+    """Socket LISTEN untuk `name` ("socks5.0", "http.0", ...). Kalau
+    diwariskan proses lama dan port-nya masih sama, socket itu dipakai
+    ulang — koneksi yang sudah antri di accept queue tidak hilang."""
+    fd = inherited_fds.pop(name, None)
+    if fd is not None:
+        srv = socket.socket(fileno=fd)
+        if srv.getsockname()[1] == port:
+            srv.listen(LISTEN_BACKLOG)          # backlog baru ikut berlaku
+            tune_listener(srv)
+            return srv
+        srv.close()                              # port diganti di config
     srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        # Kernel membagi koneksi masuk rata ke semua worker; juga supaya
+        # worker tambahan proses pengganti bisa bind saat upgrade
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     srv.bind((host, port))
-    srv.listen(128)
-    logging.getLogger(name).info(f"Listening on {host}:{port}")
+    srv.listen(LISTEN_BACKLOG)
+    tune_listener(srv)
+    return srv
+
+def open_listeners(worker_id, s5_port, http_port):
+    return {"socks5": open_listener(f"socks5.{worker_id}", s5_port),
+            "http":   open_listener(f"http.{worker_id}", http_port)}
+
+def _close_inherited():
+    # Warisan yang tidak terpakai (jumlah worker dikurangi, dll)
+    for fd in inherited_fds.values():
+        try: os.close(fd)
+        except: pass
+    inherited_fds.clear()
+
+def _run_handler(handler, conn, cfg, resolver):
+    traffic.set_busy(1)
+    try:
+        handler(conn, cfg, resolver)
+    finally:
+        traffic.set_busy(0)
+
+def start_server(srv, handler, executor, name):
+    srv.setblocking(False)
+    listeners[name.strip().lower()] = srv
+    host, port = srv.getsockname()[:2]
+    logging.getLogger(name).info(f"Listening on {host}:{port} (backlog {LISTEN_BACKLOG})")
 
     def _accept_loop():
+        # Listener non-blocking: tiap wakeup kuras semua koneksi yang antri
+        # sampai EAGAIN, snapshot config cukup diambil sekali per batch
+        poller = select.poll()
+        poller.register(srv, select.POLLIN)
+        while srv.fileno() != -1:
+            if not poller.poll(1000):
+                continue
+            snap = config_store.get()
+            n = 0
+            while True:
+                try:
+                    conn, addr = srv.accept()
+                except BlockingIOError:
+                    break
+                except OSError as e:
+                    if srv.fileno() == -1:
+                        return
+                    if e.errno in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+                        logging.getLogger(name).error(f"Accept error: {e}")
+                        time.sleep(0.1)    # fd habis: beri waktu sesi lain tutup
+                        break
+                    continue               # ECONNABORTED dll: client sudah pergi
+                try:
+                    conn.settimeout(30)
+                    executor.submit(_run_handler, handler, conn, snap.cfg, snap.resolver)
+                    n += 1
+                except Exception as e:
+                    conn.close()
+                    logging.getLogger(name).error(f"Accept error: {e}")
+            if n > accept_stats["batch_max"]:
+                accept_stats["batch_max"] = n
+
+    t = threading.Thread(target=_accept_loop, daemon=True, name=f"accept-{name}")
+    t.start()
+    return srv
+
+def apply_settings(cfg):
+    """Setting yang aman diganti saat jalan — dipanggil main() dan SIGHUP.
+    True kalau opsi TCP berubah (listener perlu di-tune ulang)."""
+    global HE_DELAY, DRAIN_TIMEOUT, STATS_INTERVAL, STATS_LOG_INTERVAL
+    global UPSTREAM_MAX_IDLE, UPSTREAM_IDLE_TIMEOUT, UPSTREAM_MAX_AGE
+    global HTTP_MAX_HEADER_BYTES, HTTP_MAX_HEADER_LINES
+    log_pipeline.configure(cfg)
+    dns_cache.configure(cfg)
+    configure_udp(cfg)
+    HTTP_MAX_HEADER_BYTES = int(cfg.get("HTTP_MAX_HEADER_BYTES", 32768) or 32768)
+    HTTP_MAX_HEADER_LINES = int(cfg.get("HTTP_MAX_HEADER_LINES", 100) or 100)
+    UPSTREAM_MAX_IDLE     = int(cfg.get("UPSTREAM_MAX_IDLE", 4) or 0)
+    UPSTREAM_IDLE_TIMEOUT = int(cfg.get("UPSTREAM_IDLE_TIMEOUT", 30) or 30)
+    UPSTREAM_MAX_AGE      = int(cfg.get("UPSTREAM_MAX_AGE", 300) or 300)
+    HE_DELAY           = int(cfg.get("HE_DELAY_MS", 250) or 250) / 1000
+    STATS_INTERVAL     = max(0.1, float(cfg.get("STATS_INTERVAL", 1) or 1))
+    STATS_LOG_INTERVAL = int(cfg.get("STATS_LOG_INTERVAL", 60) or 60)
+    DRAIN_TIMEOUT      = int(cfg.get("DRAIN_TIMEOUT", 300) or 0)
+    return tcp_tuning.configure(cfg)
+
+def reload_config(*_):
+    snap = config_store.reload()
+    if apply_settings(snap.cfg):
+        for sock in list(listeners.values()):
+            tune_listener(sock)
+    logging.getLogger("MAIN ").info(f"Config reloaded — pool {len(snap.pool)} IPs")
+
+# ── Hot Reload & Upgrade ──────────────────────────────────────
+# SIGHUP  → reload config.cfg + IP pool di tempat, tunnel tidak tersentuh.
+#           Yang ikut: limit, log, DNS_*, HE_DELAY_MS, HTTP_MAX_HEADER_*
+#           (engine async: limit byte header tetap nilai lama), UPSTREAM_*,
+#           STATS_*, DRAIN_TIMEOUT, UDP_*, TCP_*. Port, PROXY_ENGINE,
+#           PROXY_WORKERS, RELAY_MODE / RELAY_REACTORS dan LISTEN_* baru
+#           berlaku setelah upgrade (SIGUSR2) atau restart.
+# SIGUSR2 → jalankan proxy_server.py baru yang mewarisi socket LISTEN,
+#           setelah proses baru siap, proses lama berhenti accept dan
+#           drain tunnel yang masih jalan (maks DRAIN_TIMEOUT) lalu exit.
+# SIGQUIT → drain lalu exit tanpa pengganti.
+
+PID_FILE        = os.path.join(KUYDIR, "proxy.pid")
+DRAIN_TIMEOUT   = 300      # detik
+UPGRADE_TIMEOUT = 30       # detik menunggu proses baru siap
+
+def upgrade(socks):
+    """Start proses pengganti dengan `socks` ({nama: socket}) diwariskan.
+    True kalau proses baru sudah siap melayani (lalu proxy.pid ditulis ulang)."""
+    global stats_writer
+    log = logging.getLogger("MAIN ")
+    fds = {name: s.fileno() for name, s in socks.items()}
+    # stats.shm diserahkan ke proses baru (writer ganda merusak seqlock)
+    paused, stats_writer = stats_writer, None
+    r, w = os.pipe()
+    env = dict(os.environ, KUY_READY_FD=str(w),
+               KUY_LISTEN_FDS=",".join(f"{n}={fd}" for n, fd in fds.items()))
+    try:
+        child = subprocess.Popen([sys.executable, os.path.abspath(sys.argv[0])] + sys.argv[1:],
+                                 env=env, pass_fds=[*fds.values(), w])
+    except Exception as e:
+        log.error(f"Upgrade gagal: {e}")
+        os.close(r)
+        stats_writer = paused
+        return False
+    finally:
+        os.close(w)
+    try:
+        ready = wait_fd(r, select.POLLIN, UPGRADE_TIMEOUT) and os.read(r, 1) == b"1"
+    finally:
+        os.close(r)
+    if not ready:
+        log.error(f"Upgrade gagal: pid {child.pid} tidak siap — proses lama tetap melayani")
+        try: child.kill()
+        except: pass
+        stats_writer = paused
+        return False
+    try:
+        with open(PID_FILE, "w") as f:
+            f.write(f"{child.pid}\n")
+    except: pass
+    log.info(f"Upgrade: pid {child.pid} mengambil alih listener, pid {os.getpid()} drain")
+    return True
+
+def notify_ready():
+    """Dipanggil proses pengganti begitu listener aktif."""
+    fd = os.environ.pop("KUY_READY_FD", "")
+    if fd.isdigit():
+        try:
+            os.write(int(fd), b"1")
+            os.close(int(fd))
+        except: pass
+
+def _stop_publishing():
+    # Segmen stats dipakai proses / worker pengganti
+    global stats_writer
+    stats_writer = None
+
+def wait_drained():
+    _stop_publishing()
+    log = logging.getLogger("MAIN ")
+    log.info(f"Draining {len(active_tunnels)} tunnel (maks {DRAIN_TIMEOUT}s)...")
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while active_tunnels and time.monotonic() < deadline:
+        time.sleep(0.5)
+    _drained(log)
+
+def _drained(log):
+    if active_tunnels:
+        log.warning(f"Drain timeout — {len(active_tunnels)} tunnel diputus")
+    else:
+        log.info("Drain selesai")
+
+# ── Control Socket ────────────────────────────────────────────
+# Unix socket proxy.ctl (proxy-w<N>.ctl per worker), satu baris JSON per
+# request. Dipakai pool_manager.py untuk mendorong pool IPv6 baru.
+CTL_MAX = 1 << 20
+
+def _ctl_pool(msg):
+    ips  = [str(ipaddress.ip_address(ip)) for ip in msg.get("ips", [])]
+    snap = config_store.set_pool(ips)
+    logging.getLogger("MAIN ").info(f"Pool updated — {len(snap.pool)} IPs")
+    return {"pool": len(snap.pool)}
+
+def _ctl_drain_ip(msg):
+    """Dipanggil pool_manager selama rotasi: koneksi idle di IP lama
+    ditutup, tunnel aktif dibiarkan selesai → sisa tunnel per IP."""
+    ips  = {str(ipaddress.ip_address(ip)) for ip in msg.get("ips") or [msg["ip"]]}
+    busy = {}
+    for t in list(active_tunnels):
+        if t.bind_ip in ips:
+            busy[t.bind_ip] = busy.get(t.bind_ip, 0) + 1
+    return {"idle_closed": sum(upstream_pool.retire(ip) for ip in ips),
+            "tunnels": sum(busy.values()), "busy": busy}
+
+CTL_COMMANDS = {
+    "ping":     lambda msg: {"pid": os.getpid()},
+    "pool":     _ctl_pool,
+    "drain_ip": _ctl_drain_ip,
+}
+
+def _ctl_handle(conn):
+    try:
+        conn.settimeout(5)
+        buf = b""
+        while not buf.endswith(b"\n") and len(buf) < CTL_MAX:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            buf += chunk
+        msg = json.loads(buf)
+        fn  = CTL_COMMANDS.get(msg.get("cmd"))
+        reply = dict(fn(msg), ok=True) if fn else {"ok": False, "error": "unknown command"}
+    except Exception as e:
+        reply = {"ok": False, "error": str(e)}
+    try:
+        conn.sendall(json.dumps(reply).encode() + b"\n")
+    except OSError:
+        pass
+
+def serve_control(path):
+    try:
+        os.unlink(path)         # sisa proses lama / proses yang di-upgrade
+    except FileNotFoundError:
+        pass
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(path)
+    os.chmod(path, 0o600)
+    srv.listen(8)
+
+    def _loop():
         while True:
             try:
-                conn, addr = srv.accept()
-                conn.settimeout(30)
-                cfg  = load_cfg()
-                pool = get_ip_pool()
-                executor.submit(handler, conn, cfg, pool)
+                conn, _ = srv.accept()
             except OSError:
-                break
-            except Exception as e:
-                logging.getLogger(name).error(f"Accept error: {e}")
+                return
+            with conn:
+                _ctl_handle(conn)
 
-    t = threading.Thread(target=_accept_loop, daemon=True, name=f"accept-{name}")
-    t.start()
+    threading.Thread(target=_loop, daemon=True, name="control").start()
     return srv
 
 def main():
-    cfg  = load_cfg()
-    pool = get_ip_pool()
+    global config_store
+    config_store = ConfigStore()
+    cfg  = config_store.snapshot.cfg
+    pool = config_store.snapshot.pool
 
     s5_port   = int(cfg.get("LOCAL_SOCKS_PORT", 1080))
     http_port = int(cfg.get("LOCAL_HTTP_PORT", 8118))
@@ -441,36 +3803,232 @@ def main():
     logging.getLogger("MAIN ").info(f"  IPv6 Pool → {len(pool)} IPs")
     logging.getLogger("MAIN ").info(f"  Mode   → {'IPv6-only' if cfg.get('IPV6_ONLY')=='true' else 'Dual stack'}")
 
-    executor = ThreadPoolExecutor(max_workers=300, thread_name_prefix="worker")
+    engine    = cfg.get("PROXY_ENGINE", "thread").lower()
+    logging.getLogger("MAIN ").info(f"  Engine → {engine}")
+    workers   = int(cfg.get("PROXY_WORKERS", 1) or 0) or os.cpu_count() or 1
+    if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        logging.getLogger("MAIN ").warning("  SO_REUSEPORT tidak tersedia — 1 worker")
+        workers = 1
+    logging.getLogger("MAIN ").info(f"  Workers → {workers}")
+
+    global RELAY_MODE, LISTEN_BACKLOG, LISTEN_DEFER_ACCEPT, LISTEN_FASTOPEN
+    apply_settings(cfg)
+    logging.getLogger("MAIN ").info(f"  DNS    → {dns_cache.mode} {dns_cache.server if dns_cache.mode == 'udp' else ''}")
+    RELAY_MODE = cfg.get("RELAY_MODE", "auto").lower() or "auto"
+    if RELAY_MODE in ("auto", "splice") and not HAS_SPLICE:
+        RELAY_MODE = "copy"
+    if RELAY_MODE == "reactor" and not HAS_EPOLL:
+        RELAY_MODE = "copy"
+    logging.getLogger("MAIN ").info(f"  Relay  → {RELAY_MODE}")
+    LISTEN_BACKLOG      = max(16, int(cfg.get("LISTEN_BACKLOG", 1024) or 1024))
+    LISTEN_DEFER_ACCEPT = int(cfg.get("LISTEN_DEFER_ACCEPT", 5) or 0)
+    LISTEN_FASTOPEN     = int(cfg.get("LISTEN_FASTOPEN", 256) or 0)
+
+    _parse_inherited()
+    if inherited_fds:
+        logging.getLogger("MAIN ").info(f"  Upgrade → mewarisi {len(inherited_fds)} listener")
+    if workers > 1:
+        supervise(workers, engine, s5_port, http_port)
+    else:
+        socks = open_listeners(0, s5_port, http_port)
+        _close_inherited()
+        run_worker(None, engine, socks)
+
+# ── Prefork Workers ───────────────────────────
+# PROXY_WORKERS > 1: supervisor membuka satu pasang listener SO_REUSEPORT
+# per worker lalu fork N proses. Semua thread dibuat SETELAH fork
+# (run_worker), supervisor sendiri tidak melayani koneksi. Listener tetap
+# dipegang supervisor, jadi worker yang restart / upgrade tidak membuang
+# koneksi yang sedang antri.
+
+WORKER_RESTART_MIN = 5     # detik; worker mati lebih cepat dari ini → backoff
+WORKER_BACKOFF_MAX = 30
+
+def run_worker(worker_id, engine, socks):
+    """Satu proses proxy lengkap. worker_id None = mode single process
+    (sekaligus pemilik listener, jadi SIGUSR2 upgrade ditangani di sini)."""
+    global stats_writer, worker_pool
+    cfg = config_store.get().cfg
+    log = logging.getLogger("MAIN ")
+    single = worker_id is None
+    if not single:
+        log.info(f"Worker {worker_id} started (pid {os.getpid()})")
+    handoff = {f"{name}.0": s for name, s in socks.items()} if single else None
+
+    if cfg.get("IPV6_ONLY") == "true":
+        threading.Thread(target=dns_cache.detect_nat64, daemon=True).start()
+    if RELAY_MODE == "reactor":
+        n = max(1, int(cfg.get("RELAY_REACTORS", 1) or 1))
+        reactors.extend(RelayReactor(i) for i in range(n))
+
+    # Agregasi stats per user / IP / proto, dipublish ke stats.shm
+    try:
+        stats_writer = StatsWriter(SHM_FILE if single else worker_shm_file(worker_id))
+        stats_writer.publish(traffic.last)
+    except Exception as e:
+        log.warning(f"  Stats shm disabled: {e}")
+    threading.Thread(target=stats_loop, daemon=True).start()
+    try:
+        serve_control(CTL_FILE if single else worker_ctl_file(worker_id))
+    except Exception as e:
+        log.warning(f"  Control socket disabled: {e}")
+
+    if engine == "async":
+        asyncio.run(_serve_async(socks, handoff))
+        return
 
-    srv5    = start_server("0.0.0.0", s5_port,   handle_socks5_client, executor, "SOCKS5")
-    srv_http = start_server("0.0.0.0", http_port, handle_http_client,   executor, "HTTP  ")
+    executor = worker_pool = ThreadPoolExecutor(max_workers=300, thread_name_prefix="worker")
+
+    srv5    = start_server(socks["socks5"], handle_socks5_client, executor, "SOCKS5")
+    srv_http = start_server(socks["http"],   handle_http_client,   executor, "HTTP  ")
+    if single:
+        notify_ready()
 
     def shutdown(sig, frame):
         logging.getLogger("MAIN ").info("Shutting down...")
         srv5.close()
         srv_http.close()
-        executor.shutdown(wait=False)
-        sys.exit(0)
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Jangan tunggu thread handler (atexit ThreadPoolExecutor join):
+        # sesi keep-alive yang idle bisa menahan exit sampai timeout
+        logging.shutdown()
+        os._exit(0)
+
+    draining  = []
+    upgrading = []
+
+    def graceful(sig, frame):
+        draining.append(sig)
+
+    def on_upgrade(sig, frame):
+        # upgrade() menunggu proses baru sampai UPGRADE_TIMEOUT — jangan di
+        # dalam handler, cukup ditandai lalu dikerjakan loop di bawah
+        upgrading.append(sig)
 
     signal.signal(signal.SIGTERM, shutdown)
     signal.signal(signal.SIGINT, shutdown)
-
-    # Stats printer setiap 60 detik
-    def print_stats():
-        while True:
-            time.sleep(60)
-            with stats_lock:
-                s = dict(stats)
-            logging.getLogger("STATS").info(
-                f"Connections: {s['connections']} | "
-                f"↑{s['bytes_up']//1024}KB ↓{s['bytes_down']//1024}KB"
-            )
-    threading.Thread(target=print_stats, daemon=True).start()
+    signal.signal(signal.SIGHUP, reload_config)
+    signal.signal(signal.SIGQUIT, graceful)
+    if single:
+        signal.signal(signal.SIGUSR2, on_upgrade)
 
     # Keep alive
-    while True:
+    while not draining:
+        if upgrading:
+            upgrading.clear()
+            if upgrade(handoff):
+                break
         time.sleep(1)
+    srv5.close()
+    srv_http.close()
+    wait_drained()
+    shutdown(None, None)
+
+def _spawn_worker(worker_id, engine, socks):
+    pid = os.fork()
+    if pid:
+        return pid
+    # Anak: handler milik supervisor tidak boleh ikut jalan di sini.
+    # SIGHUP diabaikan sampai worker memasang reload_config sendiri
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGQUIT, signal.SIG_DFL)
+    for i, pair in socks.items():
+        if i != worker_id:
+            for s in pair.values():
+                s.close()
+    code = 0
+    try:
+        run_worker(worker_id, engine, socks[worker_id])
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 0
+    except BaseException:
+        logging.getLogger("MAIN ").exception(f"Worker {worker_id} crashed")
+        code = 1
+    finally:
+        logging.shutdown()
+    os._exit(code)
+
+def supervise(n, engine, s5_port, http_port):
+    """Jaga N worker tetap hidup. SIGHUP diteruskan ke semua worker
+    (masing-masing reload config sendiri), SIGTERM/SIGINT menghentikan
+    semua, SIGQUIT / SIGUSR2 (setelah pengganti siap) drain semua worker."""
+    log      = logging.getLogger("MAIN ")
+    socks    = {i: open_listeners(i, s5_port, http_port) for i in range(n)}
+    _close_inherited()
+    children = {}                       # pid → worker_id
+    started  = {}                       # worker_id → waktu spawn
+    backoff  = dict.fromkeys(range(n), 0)
+    stopping = False
+    upgrading = []
+
+    def forward(sig, frame=None):
+        for pid in list(children):
+            try: os.kill(pid, sig)
+            except: pass
+
+    def stop(sig, frame):
+        nonlocal stopping
+        stopping = True
+        log.info("Shutting down workers...")
+        forward(signal.SIGTERM)
+
+    def on_upgrade(sig, frame):
+        # Dikerjakan loop utama, handler tidak boleh blok menunggu proses baru
+        upgrading.append(sig)
+
+    def drain(sig=None, frame=None):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        log.info("Draining workers...")
+        forward(signal.SIGQUIT)
+        for pair in socks.values():
+            for s in pair.values():
+                s.close()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, forward)
+    signal.signal(signal.SIGQUIT, drain)
+    signal.signal(signal.SIGUSR2, on_upgrade)
+
+    for i in range(n):
+        children[_spawn_worker(i, engine, socks)] = i
+        started[i] = time.monotonic()
+    notify_ready()
+
+    while children:
+        if upgrading:
+            upgrading.clear()
+            if not stopping and upgrade(
+                    {f"{name}.{i}": s for i, pair in socks.items() for name, s in pair.items()}):
+                drain()
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if not pid:
+            time.sleep(0.5)         # os.wait() tidak bangun oleh sinyal (PEP 475)
+            continue
+        i = children.pop(pid, None)
+        if i is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - started[i] < WORKER_RESTART_MIN:
+            backoff[i] = min(WORKER_BACKOFF_MAX, backoff[i] * 2 or 1)
+        else:
+            backoff[i] = 0
+        log.warning(f"Worker {i} (pid {pid}) exited ({code}) — restart in {backoff[i]}s")
+        time.sleep(backoff[i])
+        if stopping:
+            continue
+        children[_spawn_worker(i, engine, socks)] = i
+        started[i] = time.monotonic()
+    log.info("All workers stopped")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+stats_shm.py — Shared memory stats KuyProxy
+============================================
+proxy_server.py menulis counter live ke ~/kuyproxy/stats.shm (mmap,
+layout tetap), api_server.py membacanya. Tidak ada lock antar proses:
+writer menaikkan `seq` jadi ganjil → tulis body → genap lagi (seqlock),
+reader mengulang kalau `seq` ganjil atau berubah selama membaca.
+
+Mode prefork (PROXY_WORKERS > 1): tiap worker punya segmen sendiri
+(stats-w<N>.shm), StatsReader menjumlahkan semua worker yang hidup.
+
+Layout (little endian):
+  header  64 byte  : magic "KUYS", version, seq, pid, count, started, updated
+  gauges           : len(GAUGES) × f64
+  histogram        : per HIST_NAMES → count per bucket HIST_BOUNDS + "+Inf",
+                     lalu jumlah durasi (mikrodetik), semua u64
+  entry  104 byte  : kind (u8), name (47 byte utf-8), 7 × u64 counter
+  entry ke-0 selalu total, lalu protos, users, ips (urut byte terbanyak)
+"""
+
+import os, mmap, struct, time, glob
+
+KUYDIR   = os.path.expanduser("~/kuyproxy")
+SHM_FILE = os.path.join(KUYDIR, "stats.shm")
+
+def worker_shm_file(worker_id):
+    return os.path.join(KUYDIR, f"stats-w{worker_id}.shm")
+
+MAGIC       = b"KUYS"
+VERSION     = 5
+HEADER      = struct.Struct("<4sIQIIdd")
+HEADER_SIZE = 64
+SEQ_OFFSET  = 8
+FIELDS      = ("connections", "bytes_up", "bytes_down", "errors",
+               "connects", "connect_ms", "active")
+ENTRY       = struct.Struct("<B47s7Q")
+MAX_ENTRIES = 1024
+KINDS       = ("total", "protos", "users", "ips")
+_SEQ        = struct.Struct("<Q")
+
+# Latency setup koneksi (detik), bucket tetap supaya murah di jalur panas
+HIST_NAMES  = ("auth", "dns", "connect", "first_byte")
+HIST_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+               0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+HIST_WIDTH  = len(HIST_BOUNDS) + 2          # bucket + "+Inf" + sum_us
+HIST        = struct.Struct(f"<{len(HIST_NAMES) * HIST_WIDTH}Q")
+
+GAUGES = ("accept_queue_socks5", "accept_backlog_socks5",
+          "accept_queue_http", "accept_backlog_http",
+          "pool_max", "pool_threads", "pool_busy", "pool_queue",
+          "loop_lag_seconds", "loop_sessions", "reactor_links",
+          "upstream_idle", "dns_hits", "dns_misses",
+          "accept_batch_max", "listen_overflows", "listen_drops",
+          "log_queue", "log_dropped", "udp_assocs", "udp_dropped")
+GAUGE       = struct.Struct(f"<{len(GAUGES)}d")
+
+GAUGE_OFFSET = HEADER_SIZE
+HIST_OFFSET  = GAUGE_OFFSET + GAUGE.size
+ENTRY_OFFSET = HIST_OFFSET + HIST.size
+SIZE         = ENTRY_OFFSET + ENTRY.size * MAX_ENTRIES
+
+class StatsWriter:
+    """Sisi proxy. File dibuat sekali dan di-reuse (inode sama) supaya
+    reader yang sudah mmap tetap melihat update setelah proxy restart."""
+
+    def __init__(self, path=SHM_FILE):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != SIZE:
+                os.ftruncate(fd, SIZE)
+            self.mm = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        self.seq     = _SEQ.unpack_from(self.mm, SEQ_OFFSET)[0] & ~1
+        self.started = time.time()
+        self.pid     = os.getpid()
+
+    def _entries(self, summary):
+        yield 0, "total", summary["total"]
+        for kind in (1, 2, 3):
+            group = summary.get(KINDS[kind], {})
+            ranked = sorted(group.items(),
+                            key=lambda kv: -(kv[1]["bytes_up"] + kv[1]["bytes_down"]))
+            for name, d in ranked:
+                yield kind, name, d
+
+    def publish(self, summary):
+        """Tulis hasil TrafficStats.collect() ke shared memory."""
+        body = bytearray()
+        count = 0
+        for kind, name, d in self._entries(summary):
+            if count >= MAX_ENTRIES:
+                break
+            body += ENTRY.pack(kind, str(name).encode("utf-8", "ignore")[:47],
+                               *(max(0, int(d.get(f, 0))) for f in FIELDS))
+            count += 1
+
+        gauges = summary.get("gauges", {})
+        hist   = summary.get("hist") or [[0] * HIST_WIDTH for _ in HIST_NAMES]
+
+        mm = self.mm
+        self.seq += 1
+        _SEQ.pack_into(mm, SEQ_OFFSET, self.seq)          # ganjil: sedang ditulis
+        GAUGE.pack_into(mm, GAUGE_OFFSET, *(float(gauges.get(g, 0)) for g in GAUGES))
+        HIST.pack_into(mm, HIST_OFFSET, *(v for row in hist for v in row))
+        mm[ENTRY_OFFSET:ENTRY_OFFSET + len(body)] = body
+        HEADER.pack_into(mm, 0, MAGIC, VERSION, self.seq, self.pid, count,
+                         self.started, time.time())
+        self.seq += 1
+        _SEQ.pack_into(mm, SEQ_OFFSET, self.seq)          # genap: konsisten
+
+    def close(self):
+        try: self.mm.close()
+        except: pass
+
+class SegmentReader:
+    """Baca satu segmen. Read-only mmap, dibuka ulang kalau file belum ada
+    atau inode-nya berganti."""
+
+    RETRIES = 50
+
+    def __init__(self, path=SHM_FILE):
+        self.path = path
+        self.mm   = None
+        self.ino  = None
+
+    def _open(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        if self.mm is not None and st.st_ino == self.ino:
+            return self.mm
+        if st.st_size < SIZE:
+            return None
+        with open(self.path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), SIZE, prot=mmap.PROT_READ)
+        if self.mm is not None:
+            self.mm.close()
+        self.mm, self.ino = mm, st.st_ino
+        return mm
+
+    def read(self):
+        """Snapshot konsisten → dict (format sama dengan TrafficStats.collect()
+        + pid/alive/started/updated), atau None kalau belum ada data."""
+        mm = self._open()
+        if mm is None:
+            return None
+        for _ in range(self.RETRIES):
+            seq1 = _SEQ.unpack_from(mm, SEQ_OFFSET)[0]
+            if seq1 & 1:
+                time.sleep(0)
+                continue
+            magic, version, _, pid, count, started, updated = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or version != VERSION:
+                return None
+            gauges = GAUGE.unpack_from(mm, GAUGE_OFFSET)
+            hist   = HIST.unpack_from(mm, HIST_OFFSET)
+            body   = mm[ENTRY_OFFSET:ENTRY_OFFSET + ENTRY.size * min(count, MAX_ENTRIES)]
+            if _SEQ.unpack_from(mm, SEQ_OFFSET)[0] != seq1:
+                continue
+            return self._decode(body, gauges, hist, pid, started, updated)
+        return None
+
+    @staticmethod
+    def _decode(body, gauges, hist, pid, started, updated):
+        out = {"pid": pid, "alive": _pid_alive(pid),
+               "started": started, "updated": updated,
+               "gauges": dict(zip(GAUGES, gauges)),
+               "hist": {name: {"buckets": list(hist[i * HIST_WIDTH:(i + 1) * HIST_WIDTH - 1]),
+                               "sum": hist[(i + 1) * HIST_WIDTH - 1] / 1e6}
+                        for i, name in enumerate(HIST_NAMES)},
+               "total": dict.fromkeys(FIELDS, 0),
+               "protos": {}, "users": {}, "ips": {}}
+        for kind, name, *vals in ENTRY.iter_unpack(body):
+            d = dict(zip(FIELDS, vals))
+            d["connect_avg_ms"] = d["connect_ms"] // d["connects"] if d["connects"] else 0
+            if kind == 0:
+                out["total"] = d
+            elif kind < len(KINDS):
+                out[KINDS[kind]][name.rstrip(b"\0").decode("utf-8", "ignore")] = d
+        return out
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except:
+        return False
+
+# Gauge yang digabung dengan max, sisanya dijumlah antar worker
+# (listen_* adalah counter seluruh host, sama di semua worker)
+_GAUGE_MAX = {"loop_lag_seconds", "accept_batch_max", "listen_overflows", "listen_drops"}
+
+class StatsReader:
+    """Sisi api_server: gabungan semua segmen (stats.shm + stats-w*.shm)
+    dari proses yang masih hidup. Kalau tidak ada yang hidup, segmen
+    yang paling baru di-update dikembalikan apa adanya (alive=False)."""
+
+    def __init__(self):
+        self.segments = {}
+
+    def read(self):
+        paths = [SHM_FILE] + glob.glob(os.path.join(KUYDIR, "stats-w*.shm"))
+        snaps = []
+        for path in paths:
+            seg = self.segments.get(path)
+            if seg is None:
+                seg = self.segments[path] = SegmentReader(path)
+            snap = seg.read()
+            if snap is not None:
+                snaps.append(snap)
+        if not snaps:
+            return None
+        live = [s for s in snaps if s["alive"]]
+        if not live:
+            return max(snaps, key=lambda s: s["updated"])
+        if len(live) == 1:
+            return dict(live[0], workers=1)
+        return _merge(live)
+
+def _add(dst, src):
+    for k, v in src.items():
+        if k != "connect_avg_ms":
+            dst[k] = dst.get(k, 0) + v
+    dst["connect_avg_ms"] = dst["connect_ms"] // dst["connects"] if dst["connects"] else 0
+
+def _merge(snaps):
+    out = {"pid": min(s["pid"] for s in snaps), "alive": True, "workers": len(snaps),
+           "started": min(s["started"] for s in snaps),
+           "updated": max(s["updated"] for s in snaps),
+           "gauges": dict.fromkeys(GAUGES, 0.0),
+           "hist": {name: {"buckets": [0] * (HIST_WIDTH - 1), "sum": 0.0} for name in HIST_NAMES},
+           "total": dict.fromkeys(FIELDS, 0),
+           "protos": {}, "users": {}, "ips": {}}
+    for snap in snaps:
+        for k, v in snap["gauges"].items():
+            out["gauges"][k] = max(out["gauges"][k], v) if k in _GAUGE_MAX else out["gauges"][k] + v
+        for name, h in snap["hist"].items():
+            dst = out["hist"][name]
+            dst["buckets"] = [a + b for a, b in zip(dst["buckets"], h["buckets"])]
+            dst["sum"] += h["sum"]
+        _add(out["total"], snap["total"])
+        for group in KINDS[1:]:
+            for key, d in snap[group].items():
+                _add(out[group].setdefault(key, {}), d)
+    return out
@@ -0,0 +1,84 @@
+import os, sys, socket, tempfile, threading
+
+import pytest
+
+# proxy_server / stats_shm membuat ~/kuyproxy saat di-import → HOME sementara
+os.environ["HOME"] = tempfile.mkdtemp(prefix="kuyproxy-test-")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class Origin:
+    """Origin HTTP mentah di thread. routes[path] = bytes respons, atau
+    callable(conn) yang menulis sendiri (lalu koneksi ditutup)."""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.srv = socket.create_server(("127.0.0.1", 0))
+        self.port = self.srv.getsockname()[1]
+        self.conns = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.srv.accept()
+            except OSError:
+                return
+            self.conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        buf = b""
+        try:
+            while True:
+                while b"\r\n\r\n" not in buf:
+                    d = conn.recv(65536)
+                    if not d:
+                        return
+                    buf += d
+                head, buf = buf.split(b"\r\n\r\n", 1)
+                resp = self.routes[head.split(b" ")[1].decode()]
+                if callable(resp):
+                    resp(conn)
+                    return
+                conn.sendall(resp)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self.srv.close()
+        for c in self.conns:
+            try: c.close()
+            except OSError: pass
+
+@pytest.fixture
+def origin():
+    made = []
+    def make(routes):
+        made.append(Origin(routes))
+        return made[-1]
+    yield make
+    for o in made:
+        o.close()
+
+class _Resolver:
+    def resolve(self, username):
+        return None
+
+class _Snap:
+    cfg      = {}
+    resolver = _Resolver()
+
+class _Store:
+    def get(self):
+        return _Snap()
+
+@pytest.fixture
+def proxy(monkeypatch):
+    """proxy_server dengan config_store palsu (tanpa sticky IP) dan
+    limiter yang dikembalikan ke tanpa-batas setelah test."""
+    import proxy_server
+    monkeypatch.setattr(proxy_server, "config_store", _Store())
+    yield proxy_server
+    proxy_server.limiter.configure({})
@@ -0,0 +1,45 @@
+import json, signal
+
+import pytest
+
+import api_server
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    conf = tmp_path / "config.cfg"
+    conf.write_text("LOCAL_SOCKS_PORT=1080\nRELAY_MODE=auto\nDNS_MODE=system\n"
+                    "LIMIT_USER_CONNS=0\nSOCKS_USERNAME=user\n")
+    pool = tmp_path / "added_ips.txt"
+    pool.write_text("".join(f"2001:db8::{i}\n" for i in range(1, 6)))
+    monkeypatch.setattr(api_server, "CONFIG", str(conf))
+    monkeypatch.setattr(api_server, "IP_LIST", str(pool))
+    monkeypatch.setitem(api_server._config_cache, "sig", None)
+    monkeypatch.setitem(api_server._status, "pool", [])
+    return api_server
+
+@pytest.fixture
+def signals(monkeypatch):
+    sent = []
+    monkeypatch.setattr(api_server, "signal_service", lambda pid, sig: sent.append(sig) or True)
+    return sent
+
+@pytest.mark.parametrize("updates, mode", [
+    ({"LIMIT_USER_CONNS": "4"}, "reload"),
+    ({"DNS_MODE": "udp", "DNS_SERVER": "1.1.1.1"}, "reload"),
+    ({"HE_DELAY_MS": "100", "UPSTREAM_MAX_IDLE": "8", "HTTP_MAX_HEADER_BYTES": "65536",
+      "STATS_INTERVAL": "2", "DRAIN_TIMEOUT": "60", "NAT64_PREFIX": "64:ff9b::"}, "reload"),
+    ({"RELAY_MODE": "reactor"}, "upgrade"),
+    ({"LOCAL_SOCKS_PORT": "1081"}, "upgrade"),
+    ({"PROXY_WORKERS": "2", "LIMIT_USER_CONNS": "4"}, "upgrade"),
+    ({"LISTEN_BACKLOG": "2048"}, "upgrade"),
+])
+def test_post_config_reload_or_upgrade(api, signals, updates, mode):
+    r = api.action_post_config(json.dumps(updates).encode())
+    assert r["ok"] and r["mode"] == mode
+    assert signals == [signal.SIGUSR2 if mode == "upgrade" else signal.SIGHUP]
+    for k, v in updates.items():
+        assert api.cfg(k) == v
+
+def test_post_config_unchanged_value_is_reload(api, signals):
+    r = api.action_post_config(b'{"RELAY_MODE": "auto"}')
+    assert r["mode"] == "reload"
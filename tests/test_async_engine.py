@@ -0,0 +1,161 @@
+import asyncio, base64, socket, time
+
+import pytest
+
+import proxy_server
+from proxy_server import HeaderTooLarge, read_head_async, _forward_body_async
+
+async def _stream(*chunks, eof=True):
+    r = asyncio.StreamReader(limit=1024)
+    for c in chunks:
+        r.feed_data(c)
+    if eof:
+        r.feed_eof()
+    return r
+
+class Sink:
+    def __init__(self):
+        self.data = bytearray()
+    def write(self, b):
+        self.data += b
+    async def drain(self):
+        pass
+
+def run(coro):
+    return asyncio.run(coro)
+
+def head(data, limit=65536):
+    async def go():
+        return await read_head_async(await _stream(data, eof=True), limit)
+    return run(go())
+
+def test_read_head_beyond_stream_limit():
+    raw = b"GET / HTTP/1.1\r\n" + b"X-Pad: " + b"a" * 5000 + b"\r\n\r\n"
+    assert head(raw + b"body", limit=8192) == raw
+    with pytest.raises(HeaderTooLarge):
+        head(raw, limit=4096)
+
+def test_read_head_eof():
+    assert head(b"") is None
+    with pytest.raises(ConnectionError):
+        head(b"GET / HT")
+    with pytest.raises(ConnectionError):
+        head(b"x" * 3000)            # lewat limit reader, lalu EOF
+
+def test_chunked_upstream_closes_mid_body():
+    out = Sink()
+    async def go():
+        await _forward_body_async(await _stream(b"5\r\nabcde\r\n3"), out, ("chunked", 0))
+    with pytest.raises(ConnectionError):
+        run(go())
+    assert bytes(out.data) == b"5\r\nabcde\r\n"
+
+def test_body_read_idle_timeout(monkeypatch):
+    monkeypatch.setattr(proxy_server, "RELAY_IDLE", 0.1)
+    async def go():
+        await _forward_body_async(await _stream(b"abc", eof=False), Sink(), ("length", 10))
+    with pytest.raises(asyncio.TimeoutError):
+        run(go())
+
+# ── Lewat proxy async lengkap ─────────────────────────────────
+
+def _request(port, path, close=False):
+    auth = base64.b64encode(b"u1:pw").decode()
+    return (f"GET http://127.0.0.1:{port}{path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+            f"Proxy-Authorization: Basic {auth}\r\n"
+            + ("Connection: close\r\n" if close else "") + "\r\n").encode()
+
+@pytest.fixture
+def upstreams(monkeypatch, proxy):
+    made = []
+    class Tracked(proxy_server.Upstream):
+        __slots__ = ()
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            made.append(self)
+    monkeypatch.setattr(proxy_server, "Upstream", Tracked)
+    monkeypatch.setattr(proxy_server, "RELAY_IDLE", 0.3)
+    return made
+
+async def _through_proxy(data, wait=2.0):
+    """Kirim `data` ke proxy async, kumpulkan balasan sampai koneksi ditutup."""
+    snap = proxy_server.config_store.get()
+    done = asyncio.Event()
+    async def handler(r, w):
+        try:
+            await proxy_server.handle_http_client_async(r, w, dict(snap.cfg, SOCKS_PASSWORD="pw"),
+                                                        snap.resolver)
+        finally:
+            done.set()
+    srv = await asyncio.start_server(handler, "127.0.0.1", 0)
+    port = srv.sockets[0].getsockname()[1]
+    r, w = await asyncio.open_connection("127.0.0.1", port)
+    w.write(data)
+    got = b""
+    try:
+        got = await asyncio.wait_for(r.read(1 << 20), wait)
+        while True:
+            more = await asyncio.wait_for(r.read(1 << 20), wait)
+            if not more:
+                break
+            got += more
+    except asyncio.TimeoutError:
+        pass
+    await asyncio.wait_for(done.wait(), wait)
+    w.close()
+    srv.close()
+    return got
+
+def _closed(ups):
+    return all(u.writer.is_closing() for u in ups)
+
+def test_upstream_closes_mid_chunked_body(proxy, origin, upstreams):
+    def broken(conn):
+        conn.sendall(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nabcde\r\n3")
+    o = origin({"/": broken})
+    got = run(_through_proxy(_request(o.port, "/")))
+    assert got.startswith(b"HTTP/1.1 200 OK")
+    assert len(upstreams) == 1 and _closed(upstreams)
+    assert not proxy.upstream_pool.idle
+
+def test_stalled_upstream_times_out(proxy, origin, upstreams):
+    seen = []
+    def stall(conn):
+        conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\nabc")
+        conn.settimeout(5)
+        t0 = time.monotonic()
+        try:
+            seen.append(conn.recv(1))        # b"" = proxy menutup upstream
+        except OSError:
+            pass
+        seen.append(time.monotonic() - t0)
+    o = origin({"/": stall})
+    run(_through_proxy(_request(o.port, "/")))
+    deadline = time.monotonic() + 3
+    while len(seen) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert seen[0] == b"" and seen[1] < 3
+    assert _closed(upstreams)
+
+def test_stalled_interim_response_times_out(proxy, origin, upstreams):
+    def interim(conn):
+        conn.sendall(b"HTTP/1.1 102 Processing\r\n\r\n")
+        conn.settimeout(5)
+        try:
+            conn.recv(1)
+        except socket.timeout:
+            pass
+    o = origin({"/": interim})
+    t0 = time.monotonic()
+    run(_through_proxy(_request(o.port, "/")))
+    assert time.monotonic() - t0 < 3
+    assert _closed(upstreams)
+
+def test_header_limit_read_per_request(proxy, origin, monkeypatch):
+    o = origin({"/": b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n"})
+    # 100 KB: lewat limit default StreamReader (64 KB), tetap lolos kalau config mengizinkan
+    big = _request(o.port, "/", close=True).replace(b"\r\n\r\n", b"\r\nX-Pad: " + b"a" * 100000 + b"\r\n\r\n")
+    monkeypatch.setattr(type(proxy.config_store.get()), "cfg", {"HTTP_MAX_HEADER_BYTES": "1024"})
+    assert run(_through_proxy(big)).startswith(b"HTTP/1.1 431")
+    monkeypatch.setattr(type(proxy.config_store.get()), "cfg", {"HTTP_MAX_HEADER_BYTES": "200000"})
+    assert run(_through_proxy(big)).startswith(b"HTTP/1.1 200")
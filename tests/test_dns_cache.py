@@ -0,0 +1,96 @@
+import socket, time
+
+import pytest
+
+import proxy_server
+from proxy_server import DNSCache
+
+V4 = (socket.AF_INET, "192.0.2.1")
+V6 = (socket.AF_INET6, "2001:db8::1")
+
+def _cache(answer, **kw):
+    c = DNSCache(**kw)
+    c.calls = 0
+    def query(host):
+        c.calls += 1
+        if isinstance(answer, BaseException):
+            raise answer
+        return list(answer)
+    c._query_system = query
+    return c
+
+def _expire(c, host):
+    c.entries[host] = (time.monotonic() - 1,) + c.entries[host][1:]
+
+def test_positive_entry_cached_until_ttl():
+    c = _cache([V4], ttl=60)
+    assert c.lookup("a.test") == [V4]
+    assert c.lookup("a.test") == [V4]
+    assert (c.calls, c.hits) == (1, 1)
+    assert 55 < c.entries["a.test"][0] - time.monotonic() <= 60
+    _expire(c, "a.test")
+    assert c.cached("a.test") is None
+    c.lookup("a.test")
+    assert c.calls == 2
+
+def test_family_order():
+    assert _cache([V4, V6]).lookup("a.test") == [V6, V4]
+    assert _cache([V6, V4], prefer_v6=False).lookup("a.test") == [V4, V6]
+
+def test_families_interleaved():
+    v4 = [(socket.AF_INET, f"192.0.2.{i}") for i in range(3)]
+    v6 = [(socket.AF_INET6, f"2001:db8::{i}") for i in range(2)]
+    assert _cache(v4 + v6).lookup("a.test") == [v6[0], v4[0], v6[1], v4[1], v4[2]]
+    assert _cache(v6 + v4, prefer_v6=False).lookup("a.test") == [v4[0], v6[0], v4[1], v6[1], v4[2]]
+
+def test_prefer_v6_default_from_config():
+    c = DNSCache(prefer_v6=False)
+    c.configure({})
+    assert c.prefer_v6
+    c.configure({"DNS_PREFER_IPV6": "false"})
+    assert not c.prefer_v6
+
+def test_negative_entry_uses_neg_ttl():
+    c = _cache(socket.gaierror(socket.EAI_NONAME, "nope"), ttl=60, neg_ttl=5)
+    for _ in range(2):
+        with pytest.raises(socket.gaierror):
+            c.lookup("nx.test")
+    assert c.calls == 1
+    assert c.entries["nx.test"][0] - time.monotonic() <= 5
+    _expire(c, "nx.test")
+    with pytest.raises(socket.gaierror):
+        c.lookup("nx.test")
+    assert c.calls == 2
+
+def test_empty_answer_is_negative():
+    c = _cache([])
+    with pytest.raises(socket.gaierror):
+        c.lookup("empty.test")
+    assert c.entries["empty.test"][1] is None
+
+def test_resolver_exception_becomes_negative_gaierror():
+    c = _cache(UnicodeError("label empty or too long"), neg_ttl=5)
+    for _ in range(2):
+        with pytest.raises(socket.gaierror):
+            c.lookup("bad..test")
+    assert c.calls == 1
+    assert not c.inflight
+
+def test_lru_bound_and_configure_in_place():
+    c = _cache([V4], size=2)
+    for h in ("a.test", "b.test", "c.test"):
+        c.lookup(h)
+    assert list(c.entries) == ["b.test", "c.test"]
+    c.configure({"DNS_CACHE_SIZE": "1", "DNS_NEG_TTL": "3", "NAT64_PREFIX": "64:ff9b::/96"})
+    assert list(c.entries) == ["c.test"]
+    assert (c.size, c.neg_ttl, str(c.nat64)) == (1, 3, "64:ff9b::")
+
+def test_module_cache_configured_in_place():
+    before = proxy_server.dns_cache
+    proxy_server.dns_cache.configure({"DNS_CACHE_TTL": "30"})
+    assert proxy_server.dns_cache is before and before.ttl == 30
+    before.configure({})
+
+def test_synthesize_nat64():
+    c = DNSCache(nat64_prefix="64:ff9b::")
+    assert c.synthesize("192.0.2.33") == "64:ff9b::c000:221"
@@ -0,0 +1,67 @@
+import socket
+
+import pytest
+
+import proxy_server
+from proxy_server import _candidates, open_outbound
+
+V4 = [(socket.AF_INET, f"192.0.2.{i}") for i in range(1, 4)]
+V6 = [(socket.AF_INET6, f"2001:db8::{i}") for i in range(1, 3)]
+
+@pytest.fixture(autouse=True)
+def memory(monkeypatch):
+    monkeypatch.setattr(proxy_server, "family_memory", {})
+
+def test_candidates_alternate_from_first_family():
+    assert _candidates("h", 80, V6 + V4) == [V6[0], V4[0], V6[1], V4[1], V4[2]]
+    assert _candidates("h", 80, V4 + V6) == [V4[0], V6[0], V4[1], V6[1], V4[2]]
+
+def test_candidates_sticky_and_ipv6_only():
+    assert _candidates("h", 80, V4 + V6, bind_ip="2001:db8::99") == V6
+    with pytest.raises(socket.gaierror):
+        _candidates("h", 80, V4, bind_ip="2001:db8::99")
+    synth = proxy_server.dns_cache.synthesize
+    assert [ip for _, ip in _candidates("h", 80, V4[:1], ipv6_only=True)] == [synth(V4[0][1])]
+
+def test_candidates_use_remembered_family():
+    proxy_server._remember_family("h", 80, socket.AF_INET)
+    assert _candidates("h", 80, V6 + V4)[0] == V4[0]
+
+def _listener(family, host):
+    s = socket.socket(family, socket.SOCK_STREAM)
+    s.bind((host, 0))
+    s.listen(4)
+    return s
+
+def _resolve(monkeypatch, addrs):
+    monkeypatch.setattr(proxy_server.dns_cache, "lookup", lambda host: list(addrs))
+
+def test_open_outbound_falls_back_to_ipv4(monkeypatch):
+    srv = _listener(socket.AF_INET, "127.0.0.1")
+    port = srv.getsockname()[1]
+    _resolve(monkeypatch, [(socket.AF_INET6, "::1"), (socket.AF_INET, "127.0.0.1")])   # ::1 menolak
+    sock = open_outbound(None, "dual.test", port, timeout=2)
+    assert sock.family == socket.AF_INET
+    assert proxy_server.family_memory[("dual.test", port)][0] == socket.AF_INET
+    sock.close()
+    srv.close()
+
+def test_open_outbound_prefers_first_candidate(monkeypatch):
+    srv = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+    srv.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+    srv.bind(("::", 0))
+    srv.listen(4)
+    port = srv.getsockname()[1]
+    _resolve(monkeypatch, [(socket.AF_INET6, "::1"), (socket.AF_INET, "127.0.0.1")])
+    sock = open_outbound(None, "dual.test", port, timeout=2)
+    assert sock.family == socket.AF_INET6
+    sock.close()
+    srv.close()
+
+def test_open_outbound_all_refused(monkeypatch):
+    srv = _listener(socket.AF_INET, "127.0.0.1")
+    port = srv.getsockname()[1]
+    srv.close()
+    _resolve(monkeypatch, [(socket.AF_INET6, "::1"), (socket.AF_INET, "127.0.0.1")])
+    with pytest.raises(OSError):
+        open_outbound(None, "dual.test", port, timeout=2)
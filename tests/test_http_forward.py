@@ -0,0 +1,106 @@
+import base64, socket, threading
+
+from proxy_server import (SockReader, Tunnel, parse_request, parse_response,
+                          _http_rewrite_request)
+
+OK = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok"
+
+def _request(user, port, path="/", method="GET"):
+    auth = base64.b64encode(f"{user}:pw".encode()).decode()
+    target = f"127.0.0.1:{port}" if method == "CONNECT" else f"http://127.0.0.1:{port}{path}"
+    return (f"{method} {target} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+            f"Proxy-Authorization: Basic {auth}\r\n\r\n").encode()
+
+def _response(reader):
+    raw = reader.read_head()
+    if raw is None:
+        return None, b""
+    head = parse_response(raw)
+    n = int(head.headers.get("content-length", 0))
+    body = b""
+    while len(body) < n:
+        body += reader.take() if reader.pending else reader.sock.recv(n - len(body))
+    return head.status, body
+
+def _session(ps):
+    a, b = socket.socketpair()
+    a.settimeout(5)
+    t = threading.Thread(target=ps.handle_http_client,
+                         args=(b, {"SOCKS_PASSWORD": "pw"}, ps.config_store.get().resolver),
+                         daemon=True)
+    t.start()
+    return a, SockReader(a), t
+
+def _active(ps, user):
+    return ps.limiter.active.get(("user", user), 0)
+
+def test_user_switch_is_admitted_against_new_user(proxy, origin):
+    o = origin({"/": OK})
+    proxy.limiter.configure({"LIMIT_USER_CONNS": "1"})
+    held = Tunnel("u2", None, "http")
+    assert proxy.limiter.admit(held)
+    a, r, t = _session(proxy)
+    a.sendall(_request("u1", o.port))
+    assert _response(r) == (200, b"ok")
+    assert _active(proxy, "u1") == 1
+    a.sendall(_request("u2", o.port))              # u2 sudah penuh
+    assert _response(r)[0] == 429
+    t.join(5)
+    assert _active(proxy, "u1") == 0 and _active(proxy, "u2") == 1
+    proxy.limiter.release(held)
+    assert not proxy.limiter.active
+
+def test_user_switch_moves_the_slot(proxy, origin):
+    o = origin({"/": OK})
+    proxy.limiter.configure({"LIMIT_USER_CONNS": "1"})
+    a, r, t = _session(proxy)
+    a.sendall(_request("u1", o.port))
+    assert _response(r)[0] == 200
+    a.sendall(_request("u3", o.port))
+    assert _response(r)[0] == 200
+    assert _active(proxy, "u1") == 0 and _active(proxy, "u3") == 1
+    a.close()
+    t.join(5)
+    assert not proxy.limiter.active
+
+def test_connect_on_keep_alive_rejected(proxy, origin):
+    o = origin({"/": OK})
+    a, r, t = _session(proxy)
+    a.sendall(_request("u1", o.port))
+    assert _response(r)[0] == 200
+    a.sendall(_request("u1", o.port, method="CONNECT"))
+    assert _response(r)[0] == 405
+    t.join(5)
+
+def test_upgrade_reuses_admitted_tunnel(proxy, origin):
+    def upgrade(conn):
+        conn.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: x\r\n\r\n")
+        while True:
+            d = conn.recv(100)
+            if not d:
+                return
+            conn.sendall(d)
+    o = origin({"/ws": upgrade})
+    proxy.limiter.configure({"LIMIT_USER_CONNS": "1"})
+    a, r, t = _session(proxy)
+    a.sendall(_request("u1", o.port, "/ws"))
+    assert _response(r)[0] == 101
+    a.sendall(b"ping")
+    assert a.recv(4) == b"ping"
+    assert _active(proxy, "u1") == 1
+    (tun,) = [x for x in proxy.active_tunnels if x.user == "u1"]
+    opened = tun.opened
+    a.close()
+    t.join(5)
+    assert tun.opened == opened and tun not in proxy.active_tunnels
+    assert not proxy.limiter.active
+
+def test_rewrite_origin_form_uses_host_header():
+    for host, want in ((b"[2001:db8::1]:8080", ("2001:db8::1", 8080)),
+                       (b"[2001:db8::1]", ("2001:db8::1", 80)),
+                       (b"example.test", ("example.test", 80))):
+        req = parse_request(b"GET /a HTTP/1.1\r\nHost: " + host + b"\r\n"
+                            b"Proxy-Authorization: Basic eA==\r\n\r\n")
+        h, p, path, raw = _http_rewrite_request(req)
+        assert (h, p, path) == want + ("/a",)
+        assert b"Proxy-Authorization" not in raw
@@ -0,0 +1,79 @@
+import socket
+
+import pytest
+
+from proxy_server import (SockReader, HeaderTooLarge, parse_request, parse_response,
+                          _body_framing, _forward_body, _keep_alive)
+
+class Sink:
+    def __init__(self):
+        self.data = bytearray()
+    def sendall(self, b):
+        self.data += b
+
+def _reader(*chunks):
+    a, b = socket.socketpair()
+    for c in chunks:
+        a.sendall(c)
+    a.close()
+    return SockReader(b)
+
+def test_parse_request():
+    h = parse_request(b"get http://x.test/a?b HTTP/1.1\r\nHost: x.test\r\n"
+                      b"Proxy-Authorization: Basic eA==\r\nX-Odd:  spaced \r\n\r\n")
+    assert (h.method, h.target, h.version) == ("GET", "http://x.test/a?b", "HTTP/1.1")
+    assert h.headers["x-odd"] == "spaced"
+    assert h.lines[1] == b"Proxy-Authorization: Basic eA=="
+
+def test_parse_request_bad_start_line():
+    assert parse_request(b"GARBAGE\r\n\r\n") is None
+
+def test_too_many_header_lines():
+    raw = b"GET / HTTP/1.1\r\n" + b"X: y\r\n" * 5 + b"\r\n"
+    assert parse_request(raw, max_lines=5).headers["x"] == "y"
+    with pytest.raises(HeaderTooLarge):
+        parse_request(raw, max_lines=4)
+
+def test_parse_response():
+    h = parse_response(b"HTTP/1.1 404 Not Found\r\nContent-Length: 3\r\n\r\n")
+    assert (h.version, h.status, h.headers["content-length"]) == ("HTTP/1.1", 404, "3")
+
+def test_read_head_split_terminator_and_pipelined_body():
+    r = _reader(b"GET / HTTP/1.1\r\nHost: a\r\n\r", b"\nbody")
+    assert r.read_head() == b"GET / HTTP/1.1\r\nHost: a\r\n\r\n"
+    assert r.pending == 4
+    assert r.take() == b"body"
+
+def test_read_head_limit_and_eof():
+    with pytest.raises(HeaderTooLarge):
+        _reader(b"GET / HTTP/1.1\r\n" + b"X: y\r\n" * 100).read_head(256)
+    assert _reader().read_head() is None
+    with pytest.raises(ConnectionError):
+        _reader(b"GET / HT").read_head()
+
+@pytest.mark.parametrize("hdrs, method, status, want", [
+    ({"content-length": "5"}, None, None, ("length", 5)),
+    ({"transfer-encoding": "gzip, chunked", "content-length": "5"}, None, None, ("chunked", 0)),
+    ({}, None, None, ("none", 0)),
+    ({}, "GET", 200, ("close", 0)),
+    ({"content-length": "5"}, "HEAD", 200, ("none", 0)),
+    ({"content-length": "5"}, "GET", 304, ("none", 0)),
+])
+def test_body_framing(hdrs, method, status, want):
+    assert _body_framing(hdrs, method, status) == want
+
+def test_forward_chunked_with_trailer():
+    body = b"4;ext=1\r\nWiki\r\n5\r\npedia\r\n0\r\nX-Sum: 1\r\n\r\n"
+    r, out = _reader(body + b"NEXT"), Sink()
+    assert _forward_body(r, out, ("chunked", 0)) == len(body)
+    assert out.data == body and r.take() == b"NEXT"
+
+def test_forward_length_short_body():
+    with pytest.raises(ConnectionError):
+        _forward_body(_reader(b"abc"), Sink(), ("length", 10))
+
+def test_keep_alive():
+    assert _keep_alive("HTTP/1.1", {})
+    assert not _keep_alive("HTTP/1.1", {"connection": "close"})
+    assert not _keep_alive("HTTP/1.0", {})
+    assert _keep_alive("HTTP/1.0", {"connection": "Keep-Alive"})
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+import api_server
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    conf = tmp_path / "config.cfg"
+    conf.write_text("SOCKS_USERNAME=user\n")
+    pool = tmp_path / "added_ips.txt"
+    pool.write_text("".join(f"2001:db8::{i}\n" for i in range(1, 6)))
+    monkeypatch.setattr(api_server, "CONFIG", str(conf))
+    monkeypatch.setattr(api_server, "IP_LIST", str(pool))
+    monkeypatch.setitem(api_server._config_cache, "sig", None)
+    monkeypatch.setitem(api_server._status, "pool", [])
+    monkeypatch.setattr(api_server, "refresh_status", lambda: None)
+    monkeypatch.setattr(api_server, "telegram_notify", lambda msg: None)
+    return api_server
+
+def _config(api, text):
+    with open(api.CONFIG, "w") as f:
+        f.write(text)
+    api._config_cache["sig"] = None
+
+def _wait(job, timeout=2):
+    deadline = time.monotonic() + timeout
+    while job.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not job.active
+
+def test_parse_users(api):
+    assert api.parse_users("all") == [0, 1, 2, 3, 4]
+    assert api.parse_users("2-3,5,5,9") == [1, 2, 4]
+    with pytest.raises(ValueError):
+        api.parse_users("x")
+
+def test_submit_records_result_and_errors(api):
+    q = api.JobQueue()
+    ok = q.submit("start", lambda: {"ok": True, "pid": 1})
+    bad = q.submit("stop", lambda: 1 / 0)
+    _wait(ok)
+    _wait(bad)
+    assert (ok.state, ok.results) == ("done", [{"ok": True, "pid": 1}])
+    assert bad.state == "failed" and "division" in bad.error
+    assert [j["id"] for j in q.list()] == [bad.id, ok.id]
+
+def test_rotate_batches_and_aggregates(api, monkeypatch):
+    chunks = []
+    def rotate(idxs, grace):
+        chunks.append(list(idxs))
+        if 3 in idxs:
+            raise OSError("pool down")
+        return [{"user": i + 1, "ok": True} for i in idxs]
+    monkeypatch.setattr(api, "rotate_users", rotate)
+    q = api.JobQueue(parallel=2, batch=2)
+    job = q.rotate([0, 1, 1, 2, 3])
+    _wait(job)
+    assert sorted(chunks) == [[0, 1], [2, 3]]
+    assert (job.total, job.done, job.failed, job.state) == (4, 2, 2, "done")
+    assert {r["user"] for r in job.results if not r["ok"]} == {3, 4}
+
+def test_rotate_nothing_is_done(api):
+    job = api.JobQueue().rotate([])
+    assert job.state == "done" and job.total == 0
+
+# ── Scheduler ─────────────────────────────────────────────────
+
+class FakeJobs:
+    def __init__(self):
+        self.calls = []
+    def rotate(self, idxs, grace=None, kind="rotate"):
+        self.calls.append((sorted(idxs), kind))
+        job = api_server.Job("j1", kind, len(idxs))
+        job.state = "done"
+        return job
+
+def _usage(monkeypatch, per_user):
+    snap = {"alive": True, "users": {f"user{i}": {"bytes_up": b, "bytes_down": 0, "connections": c}
+                                     for i, (b, c) in per_user.items()}}
+    monkeypatch.setattr(api_server.stats_reader, "read", lambda: snap)
+
+def test_scheduler_every_minutes(api, monkeypatch):
+    _config(api, "ROTATE_EVERY_MIN=10\nROTATE_USERS=1-2\n")
+    monkeypatch.setattr(api, "jobs", FakeJobs())
+    _usage(monkeypatch, {})
+    s = api.RotationScheduler()
+    s.tick(s.last_all + 300)
+    assert api.jobs.calls == []
+    s.tick(s.last_all + 600)
+    assert api.jobs.calls == [([0, 1], "schedule")]
+
+def test_scheduler_usage_thresholds(api, monkeypatch):
+    _config(api, "ROTATE_AFTER_BYTES=1000\nROTATE_AFTER_CONNS=5\n")
+    monkeypatch.setattr(api, "jobs", FakeJobs())
+    s = api.RotationScheduler()
+    _usage(monkeypatch, {1: (100, 1), 2: (100, 1), 3: (100, 1)})
+    s.tick(time.time())                               # baseline
+    _usage(monkeypatch, {1: (1200, 1), 2: (100, 7), 3: (500, 2)})
+    s.tick(time.time())
+    assert api.jobs.calls == [([0, 1], "schedule")]
+    _usage(monkeypatch, {1: (10, 0), 2: (100, 7), 3: (500, 2)})     # proxy restart
+    s.tick(time.time())
+    assert len(api.jobs.calls) == 1
+
+def test_scheduler_disabled_policy(api, monkeypatch):
+    monkeypatch.setattr(api, "jobs", FakeJobs())
+    s = api.RotationScheduler()
+    s.tick(time.time() + 10 ** 6)
+    assert api.jobs.calls == []
@@ -0,0 +1,36 @@
+import logging
+
+import proxy_server
+from proxy_server import LogPipeline
+
+def _pipeline():
+    h = LogPipeline()
+    h.stdout = None            # thread writer jangan menulis ke output pytest
+    return h
+
+def _record(level=logging.INFO, name="HTTP  ", msg="hello"):
+    return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+def test_handler_filters_respected():
+    h = _pipeline()
+    h.addFilter(lambda r: r.name != "NOISY")
+    h.handle(_record(name="NOISY"))
+    h.handle(_record())
+    assert [r.getMessage() for r in h.queue] == ["hello"]
+
+def test_sampling_per_level():
+    h = _pipeline()
+    h.configure({"LOG_SAMPLE_WARNING": "0", "LOG_ACCESS_SAMPLE": "0"})
+    for level in (logging.INFO, logging.WARNING, logging.ERROR):
+        h.handle(_record(level))
+    assert [r.levelno for r in h.queue] == [logging.INFO, logging.ERROR]
+    assert h.sampled == 1
+
+def test_queue_bound_counts_drops(monkeypatch):
+    monkeypatch.setattr(proxy_server, "LOG_QUEUE_MAX", 2)
+    h = _pipeline()
+    for _ in range(5):
+        h.handle(_record())
+    assert (len(h.queue), h.dropped) == (2, 3)
+    h.flush()
+    assert not h.queue and h.total_dropped == 3
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+import log_tail
+from log_tail import Follower, cap, tail, tail_lines
+
+def _write(path, lines, newline=True):
+    path.write_text("\n".join(lines) + ("\n" if newline else ""))
+
+@pytest.fixture(params=[16, 8192], ids=["small-block", "default-block"])
+def block(request, monkeypatch):
+    monkeypatch.setattr(log_tail, "BLOCK", request.param)
+
+def test_tail_lines(tmp_path, block):
+    p = tmp_path / "a.log"
+    lines = [f"line {i}" for i in range(100)]
+    _write(p, lines)
+    assert tail_lines(str(p), 5) == lines[-5:]
+    assert tail_lines(str(p), 500) == lines
+    assert tail_lines(str(p), 0) == []
+    _write(p, lines, newline=False)
+    assert tail_lines(str(p), 3) == lines[-3:]
+
+def test_tail_missing_and_empty(tmp_path):
+    assert tail(str(tmp_path / "nope.log"), 5) == []
+    (tmp_path / "e.log").write_text("")
+    assert tail(str(tmp_path / "e.log"), 5) == []
+
+def test_cap_moves_to_previous_generation(tmp_path, block):
+    p = tmp_path / "a.log"
+    lines = [f"line {i}" for i in range(10)]
+    _write(p, lines)
+    assert not cap(str(p), 10)
+    assert cap(str(p), 5)
+    assert p.read_text() == ""
+    assert (tmp_path / "a.log.1").read_text().splitlines() == lines
+    with open(p, "a") as f:
+        f.write("new\n")
+    assert tail(str(p), 3) == ["line 8", "line 9", "new"]
+
+def test_cap_keeps_append_fd_valid(tmp_path):
+    p = tmp_path / "a.log"
+    fd = os.open(p, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    os.write(fd, b"a\nb\nc\n")
+    assert cap(str(p), 1)
+    os.write(fd, b"d\n")
+    os.close(fd)
+    assert p.read_text() == "d\n"
+
+def test_follower_partial_lines_and_truncate(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_tail, "POLL_EVERY", 0.01)
+    p = tmp_path / "a.log"
+    _write(p, ["old"])
+    f = Follower(str(p))
+    assert f.poll(0.01) == []
+    with open(p, "a") as out:
+        out.write("one\ntw")
+    assert f.poll(0.01) == ["one"]
+    assert f.offset == len("old\none\n")
+    with open(p, "a") as out:
+        out.write("o\n")
+    assert f.poll(0.01) == ["two"]
+    cap(str(p), 1)
+    with open(p, "a") as out:
+        out.write("three\n")
+    assert f.poll(0.01) == ["three"]
+    f.close()
+
+def test_follower_replaced_file(tmp_path):
+    p = tmp_path / "a.log"
+    _write(p, ["old"])
+    f = Follower(str(p))
+    f.poll(0.01)
+    tmp = tmp_path / "new.log"
+    _write(tmp, ["fresh"])
+    os.replace(tmp, p)
+    got = f.poll(0.01) or f.poll(0.01)
+    assert got == ["fresh"]
+    f.close()
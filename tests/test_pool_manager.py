@@ -0,0 +1,41 @@
+import errno, socket
+
+import pool_manager
+from pool_manager import Netlink, NLMSG, NLMSG_ERR, NLMSG_ERROR, RTM_NEWADDR
+
+class FakeSock:
+    """Kernel palsu: ack hanya untuk seq di `answer` (nilai = errno)."""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.queue  = []
+
+    def sendall(self, buf):
+        pos, acks = 0, b""
+        while pos < len(buf):
+            ln, _, _, seq, _ = NLMSG.unpack_from(buf, pos)
+            if seq in self.answer:
+                body = NLMSG_ERR.pack(-self.answer[seq]) + buf[pos:pos + NLMSG.size]
+                acks += NLMSG.pack(NLMSG.size + len(body), NLMSG_ERROR, 0, seq, 0) + body
+            pos += ln
+        if acks:
+            self.queue.append(acks)
+
+    def recv(self, n):
+        if not self.queue:
+            raise socket.timeout("timed out")
+        return self.queue.pop(0)
+
+def _netlink(answer):
+    nl = Netlink.__new__(Netlink)
+    nl.sock, nl.seq = FakeSock(answer), 0
+    return nl
+
+def test_batch_matches_acks_by_seq():
+    nl = _netlink({1: 0, 2: errno.EEXIST, 3: 0})
+    assert nl.batch([(RTM_NEWADDR, 0, b"")] * 3) == [0, errno.EEXIST, 0]
+
+def test_batch_unanswered_requests_time_out(monkeypatch):
+    monkeypatch.setattr(pool_manager, "ACK_TIMEOUT", 0.1)
+    nl = _netlink({1: 0, 3: errno.EPERM})
+    assert nl.batch([(RTM_NEWADDR, 0, b"")] * 3) == [0, errno.ETIMEDOUT, errno.EPERM]
@@ -0,0 +1,83 @@
+import time
+
+import proxy_server
+from proxy_server import TokenBucket, RateLimiter, Tunnel, PACE_CHUNK
+
+def test_reserve_goes_into_debt():
+    b = TokenBucket(rate=1000, burst=1000)
+    assert b.reserve(1000) == 0.0
+    wait = b.reserve(500)
+    assert 0.45 < wait <= 0.5
+
+def test_take_never_goes_negative():
+    b = TokenBucket(rate=1000, burst=1000)
+    assert b.take(600)
+    assert not b.take(600)
+    assert 400 <= b.tokens < 410
+    b.refund(600)
+    assert b.tokens == 1000             # dibatasi burst
+
+def test_refill_capped_at_burst():
+    b = TokenBucket(rate=1000, burst=2000)
+    b.reserve(2000)
+    b.last -= 10
+    assert b.reserve(2000) == 0.0 and b.reserve(100) > 0
+
+def _limiter(**cfg):
+    lim = RateLimiter()
+    lim.configure({k: str(v) for k, v in cfg.items()})
+    return lim
+
+def test_unlimited_tunnel_has_no_buckets():
+    lim = _limiter()
+    t = Tunnel("u1", "2001:db8::1", "socks5")
+    assert lim.chunk(t, 65536) == 65536
+    assert lim.delay(t, 10 ** 9, True) == 0.0
+    assert not lim.buckets
+
+def test_buckets_shared_per_scope():
+    lim = _limiter(LIMIT_USER_DOWN_KBPS=64, LIMIT_GLOBAL_DOWN_KBPS=1024)
+    a = Tunnel("u1", "2001:db8::1", "socks5")
+    b = Tunnel("u1", "2001:db8::2", "http")
+    assert lim.chunk(a, 65536) == PACE_CHUNK
+    lim.chunk(b, 65536)
+    assert a.limits[1] == b.limits[1] and len(a.limits[1]) == 2
+    assert a.limits[0] == []
+
+def test_reconfigure_updates_buckets_in_place():
+    lim = _limiter(LIMIT_USER_UP_KBPS=10)
+    t = Tunnel("u1", None, "socks5")
+    lim.chunk(t, 1)
+    bucket = t.limits[0][0]
+    lim.configure({"LIMIT_USER_UP_KBPS": "20", "LIMIT_BURST_SEC": "2"})
+    assert bucket.rate == 20 * 1024 and bucket.burst == max(40 * 1024, PACE_CHUNK)
+    lim.chunk(t, 1)
+    assert t.limits[0][0] is bucket
+
+def test_admit_caps_and_release():
+    lim = _limiter(LIMIT_USER_CONNS=1)
+    t1, t2 = Tunnel("u1", None, "socks5"), Tunnel("u1", None, "socks5")
+    assert lim.admit(t1)
+    assert not lim.admit(t2)
+    assert lim.admit(Tunnel("u2", None, "socks5"))
+    lim.release(t1)
+    lim.release(t1)                     # release ganda tidak bikin minus
+    assert lim.admit(t2)
+
+def test_sweep_evicts_idle_full_buckets():
+    lim = _limiter(LIMIT_USER_UP_KBPS=10)
+    idle, busy = Tunnel("old", None, "socks5"), Tunnel("new", None, "socks5")
+    lim.delay(idle, 1, True)
+    lim.delay(busy, 1, True)
+    assert lim.sweep() == 0             # belum BUCKET_IDLE sejak sweep terakhir
+    now = time.monotonic()
+    lim.swept -= proxy_server.BUCKET_IDLE
+    lim.buckets[("user", "old", True)].last = now - proxy_server.BUCKET_IDLE
+    b = lim.buckets[("user", "new", True)]
+    b.last, b.tokens = now - proxy_server.BUCKET_IDLE, -b.rate * 1000
+    gen = lim.gen
+    assert lim.sweep() == 1
+    assert list(lim.buckets) == [("user", "new", True)]
+    assert lim.gen == gen + 1
+    lim.delay(idle, 1, True)            # tunnel lama sync ulang → bucket baru
+    assert idle.limits[0][0] is lim.buckets[("user", "old", True)]
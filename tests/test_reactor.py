@@ -0,0 +1,51 @@
+import logging, socket
+
+import pytest
+
+import proxy_server
+from proxy_server import RelayReactor, Tunnel
+
+@pytest.fixture(autouse=True)
+def limits():
+    proxy_server.limiter.configure({})
+
+def _pair(reactor, tunnel):
+    a, a2 = socket.socketpair()
+    b, b2 = socket.socketpair()
+    for s in (a, b):
+        s.settimeout(2)
+    reactor.add(a2, b2, tunnel)
+    return a, b
+
+def test_failing_tunnel_does_not_stop_reactor(monkeypatch, caplog):
+    bad, good = Tunnel(user="bad"), Tunnel(user="good")
+    chunk = proxy_server.limiter.chunk
+    def boom(tunnel, n):
+        if tunnel is bad:
+            raise RuntimeError("boom")
+        return chunk(tunnel, n)
+    monkeypatch.setattr(proxy_server.limiter, "chunk", boom)
+    reactor = RelayReactor("test", idle=30)
+    a1, b1 = _pair(reactor, bad)
+    a2, b2 = _pair(reactor, good)
+    with caplog.at_level(logging.ERROR, logger="RELAY "):
+        a1.sendall(b"x")
+        assert b1.recv(16) == b""              # hanya tunnel yang error ditutup
+        a2.sendall(b"hello")
+        assert b2.recv(16) == b"hello"
+        b2.sendall(b"world")
+        assert a2.recv(16) == b"world"
+    assert any(r.exc_info and "bad" in r.getMessage() for r in caplog.records)
+    for s in (a1, b1, a2, b2):
+        s.close()
+
+def test_relay_both_directions():
+    reactor = RelayReactor("test", idle=30)
+    a, b = _pair(reactor, Tunnel(user="u"))
+    a.sendall(b"ping")
+    assert b.recv(16) == b"ping"
+    b.sendall(b"pong")
+    assert a.recv(16) == b"pong"
+    a.close()
+    assert b.recv(16) == b""
+    b.close()
@@ -0,0 +1,16 @@
+import pytest
+
+from proxy_server import _split_hostport
+
+@pytest.mark.parametrize("target, want", [
+    ("example.com:8443", ("example.com", 8443)),
+    ("example.com", ("example.com", 443)),
+    ("192.0.2.1:80", ("192.0.2.1", 80)),
+    ("[2001:db8::1]:8443", ("2001:db8::1", 8443)),
+    ("[2001:db8::1]", ("2001:db8::1", 443)),
+    ("2001:db8::1", ("2001:db8::1", 443)),      # v6 tanpa bracket: ":1" bukan port
+    ("::1", ("::1", 443)),
+    ("example.com:https", ("example.com:https", 443)),
+])
+def test_split_hostport(target, want):
+    assert _split_hostport(target, 443) == want
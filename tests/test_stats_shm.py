@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import stats_shm
+from stats_shm import StatsWriter, SegmentReader, StatsReader, SEQ_OFFSET, _SEQ
+
+def _summary(up, users=None):
+    return {"total": {"connections": 2, "bytes_up": up, "bytes_down": 7,
+                      "connects": 2, "connect_ms": 30, "active": 1},
+            "users": users or {}, "gauges": {"dns_hits": 3, "loop_lag_seconds": 0.5}}
+
+@pytest.fixture
+def shm_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(stats_shm, "KUYDIR", str(tmp_path))
+    monkeypatch.setattr(stats_shm, "SHM_FILE", str(tmp_path / "stats.shm"))
+    return tmp_path
+
+def test_round_trip(shm_dir):
+    path = str(shm_dir / "stats.shm")
+    w = StatsWriter(path)
+    w.publish(_summary(100, {"user1": {"bytes_up": 5, "bytes_down": 1}}))
+    snap = SegmentReader(path).read()
+    assert snap["pid"] == os.getpid() and snap["alive"]
+    assert snap["total"]["bytes_up"] == 100
+    assert snap["total"]["connect_avg_ms"] == 15
+    assert snap["users"]["user1"]["bytes_up"] == 5
+    assert snap["gauges"]["dns_hits"] == 3
+    assert _SEQ.unpack_from(w.mm, SEQ_OFFSET)[0] % 2 == 0
+    w.close()
+
+def test_reader_skips_torn_write(shm_dir, monkeypatch):
+    path = str(shm_dir / "stats.shm")
+    w = StatsWriter(path)
+    w.publish(_summary(1))
+    _SEQ.pack_into(w.mm, SEQ_OFFSET, w.seq + 1)         # writer "mati" di tengah tulis
+    monkeypatch.setattr(SegmentReader, "RETRIES", 3)
+    assert SegmentReader(path).read() is None
+    w.publish(_summary(2))
+    assert SegmentReader(path).read()["total"]["bytes_up"] == 2
+    w.close()
+
+def test_writer_reuses_segment(shm_dir):
+    path = str(shm_dir / "stats.shm")
+    reader = SegmentReader(path)
+    w = StatsWriter(path)
+    w.publish(_summary(1))
+    assert reader.read()["total"]["bytes_up"] == 1
+    w.close()
+    w = StatsWriter(path)                               # restart: inode sama
+    w.publish(_summary(9))
+    assert reader.read()["total"]["bytes_up"] == 9
+    w.close()
+
+def test_reader_merges_workers(shm_dir):
+    ws = [StatsWriter(stats_shm.worker_shm_file(i)) for i in range(2)]
+    ws[0].publish(_summary(10, {"u": {"bytes_up": 1, "bytes_down": 0}}))
+    ws[1].publish(_summary(20, {"u": {"bytes_up": 2, "bytes_down": 0}}))
+    snap = StatsReader().read()
+    assert snap["workers"] == 2
+    assert snap["total"]["bytes_up"] == 30
+    assert snap["users"]["u"]["bytes_up"] == 3
+    assert snap["gauges"]["dns_hits"] == 6
+    assert snap["gauges"]["loop_lag_seconds"] == 0.5    # max, bukan jumlah
+    for w in ws:
+        w.close()
@@ -0,0 +1,112 @@
+import logging, socket, struct, time
+
+import pytest
+
+import proxy_server
+from proxy_server import _udp_parse, _udp_header, RateLimiter, Tunnel, UDPAssoc, UDPRelay
+
+def _dgram(header, data=b"payload", pad=0):
+    raw = b"\0\0\0" + header + data
+    buf = bytearray(raw + b"\xee" * pad)            # buffer recv lebih besar dari datagram
+    return buf, len(raw)
+
+@pytest.mark.parametrize("header, host", [
+    (b"\x01" + socket.inet_aton("192.0.2.7") + struct.pack("!H", 53), "192.0.2.7"),
+    (b"\x04" + socket.inet_pton(socket.AF_INET6, "2001:db8::7") + struct.pack("!H", 53), "2001:db8::7"),
+    (b"\x03\x08dns.test" + struct.pack("!H", 53), "dns.test"),
+])
+def test_parse(header, host):
+    buf, n = _dgram(header, pad=64)
+    h, port, hdr, off = _udp_parse(buf, n)
+    assert (h, port, hdr) == (host, 53, header)
+    assert bytes(buf[off:n]) == b"payload"
+
+@pytest.mark.parametrize("ip, host", [
+    ("::ffff:192.0.2.7", "192.0.2.7"),
+    ("2001:db8::7", "2001:db8::7"),
+])
+def test_reply_header_round_trip(ip, host):
+    hdr = _udp_header(ip, 5353)
+    buf, n = _dgram(hdr)
+    assert _udp_parse(buf, n) == (host, 5353, hdr, len(hdr) + 3)
+
+@pytest.mark.parametrize("raw", [
+    b"\0\0",                                        # terlalu pendek
+    b"\0\0\x01\x01" + bytes(6),                     # FRAG != 0
+    b"\0\0\0\x05" + bytes(6),                       # ATYP tidak dikenal
+    b"\0\0\0\x01\xc0\x00\x02",                      # alamat terpotong
+    b"\0\0\0\x01" + bytes(4) + b"\x00",             # port terpotong
+    b"\0\0\0\x03\x10short",                         # panjang domain > isi
+])
+def test_parse_rejects(raw):
+    with pytest.raises(ValueError):
+        _udp_parse(bytearray(raw), len(raw))
+
+def _limiter(**cfg):
+    lim = RateLimiter()
+    lim.configure({k: str(v) for k, v in cfg.items()})
+    return lim
+
+def test_police_drops_without_debt():
+    lim = _limiter(LIMIT_USER_UP_KBPS=16)           # burst = max(16 KB, PACE_CHUNK)
+    t = Tunnel("u1", None, "udp")
+    assert lim.police(t, 16384, True)
+    assert not lim.police(t, 1024, True)            # refill 1 KB = 62 ms, jauh di atas jitter
+    assert lim.police(t, 10 ** 6, False)            # arah down tanpa limit
+    assert t.limits[0][0].tokens >= 0
+
+def test_police_refunds_when_later_bucket_rejects():
+    lim = _limiter(LIMIT_USER_UP_KBPS=1024, LIMIT_GLOBAL_UP_KBPS=16)
+    t = Tunnel("u1", None, "udp")
+    assert lim.police(t, 16000, True)
+    user, glob = t.limits[0]
+    before = user.tokens
+    assert not lim.police(t, 1000, True)            # global kurang
+    assert user.tokens >= before                    # token user dikembalikan
+    assert glob.tokens < 1000
+
+# ── Relay ─────────────────────────────────────────────────────
+
+def _wait(cond, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cond()
+
+def test_failing_association_does_not_stop_relay(monkeypatch, caplog):
+    proxy_server.limiter.configure({})
+    bad, good = Tunnel(user="bad", proto="udp"), Tunnel(user="good", proto="udp")
+    police = proxy_server.limiter.police
+    def boom(tunnel, n, up):
+        if tunnel is bad:
+            raise RuntimeError("boom")
+        return police(tunnel, n, up)
+    monkeypatch.setattr(proxy_server.limiter, "police", boom)
+
+    target = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target.bind(("127.0.0.1", 0))
+    target.settimeout(2)
+    header = b"\x01" + socket.inet_aton("127.0.0.1") + struct.pack("!H", target.getsockname()[1])
+
+    relay = UDPRelay()
+    a_bad  = UDPAssoc(bad, "127.0.0.1", "127.0.0.1", None, False)
+    a_good = UDPAssoc(good, "127.0.0.1", "127.0.0.1", None, False)
+    relay.add(a_bad)
+    relay.add(a_good)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(("127.0.0.1", 0))
+    client.settimeout(2)
+    with caplog.at_level(logging.ERROR, logger="RELAY "):
+        client.sendto(b"\0\0\0" + header + b"x", a_bad.client.getsockname())
+        assert _wait(lambda: a_bad.closed)
+        client.sendto(b"\0\0\0" + header + b"ping", a_good.client.getsockname())
+        data, addr = target.recvfrom(64)
+        assert data == b"ping"
+        target.sendto(b"pong", addr)
+        assert client.recv(64).endswith(b"pong")
+    assert not a_good.closed
+    assert any(r.exc_info and "bad" in r.getMessage() for r in caplog.records)
+    relay.close(a_good)
+    assert _wait(lambda: a_good.closed)
+    client.close()
+    target.close()
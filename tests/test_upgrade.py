@@ -0,0 +1,87 @@
+import os, socket, sys
+
+import pytest
+
+import proxy_server
+
+CHILD = """
+import os, socket
+fds = dict(i.split("=") for i in os.environ["KUY_LISTEN_FDS"].split(","))
+srv = socket.socket(fileno=int(fds["socks5.0"]))
+if os.environ.get("CHILD_READY") == "1":
+    os.write(int(os.environ["KUY_READY_FD"]), b"1")
+    conn, _ = srv.accept()
+    conn.sendall(b"child")
+    conn.close()
+"""
+
+@pytest.fixture
+def listener():
+    srv = socket.socket()
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(8)
+    yield srv
+    srv.close()
+
+@pytest.fixture
+def inherited(monkeypatch):
+    monkeypatch.setattr(proxy_server, "inherited_fds", {})
+    return proxy_server.inherited_fds
+
+def test_open_listener_reuses_inherited_socket(listener, inherited, monkeypatch):
+    port = listener.getsockname()[1]
+    queued = socket.create_connection(("127.0.0.1", port))    # sudah antri sebelum handoff
+    monkeypatch.setenv("KUY_LISTEN_FDS", f"socks5.0={os.dup(listener.fileno())},http.0=x")
+    proxy_server._parse_inherited()
+    assert list(inherited) == ["socks5.0"] and "KUY_LISTEN_FDS" not in os.environ
+    srv = proxy_server.open_listener("socks5.0", port, "127.0.0.1")
+    listener.close()
+    conn, _ = srv.accept()
+    queued.sendall(b"hi")
+    assert conn.recv(2) == b"hi"
+    for s in (conn, queued, srv):
+        s.close()
+
+def test_inherited_socket_dropped_when_port_changes(listener, inherited):
+    old = listener.getsockname()
+    inherited["socks5.0"] = os.dup(listener.fileno())
+    srv = proxy_server.open_listener("socks5.0", 0, "127.0.0.1")
+    assert srv.getsockname()[1] != old[1]
+    listener.close()
+    with pytest.raises(ConnectionRefusedError):             # salinan warisan ikut ditutup
+        socket.create_connection(old)
+    srv.close()
+
+def test_close_inherited(listener, inherited):
+    fd = inherited["http.1"] = os.dup(listener.fileno())
+    proxy_server._close_inherited()
+    assert not inherited
+    with pytest.raises(OSError):
+        os.fstat(fd)
+
+@pytest.fixture
+def child(tmp_path, monkeypatch):
+    script = tmp_path / "child.py"
+    script.write_text(CHILD)
+    monkeypatch.setattr(sys, "argv", [str(script)])
+    monkeypatch.setattr(proxy_server, "PID_FILE", str(tmp_path / "proxy.pid"))
+    monkeypatch.setattr(proxy_server, "stats_writer", "writer")
+    return tmp_path
+
+def test_upgrade_hands_listener_to_new_process(child, listener, monkeypatch):
+    monkeypatch.setenv("CHILD_READY", "1")
+    client = socket.create_connection(listener.getsockname())
+    client.settimeout(5)
+    assert proxy_server.upgrade({"socks5.0": listener})
+    assert proxy_server.stats_writer is None               # segmen stats ikut diserahkan
+    assert client.recv(5) == b"child"
+    pid = int((child / "proxy.pid").read_text())
+    assert os.waitpid(pid, 0)[0] == pid
+    client.close()
+
+def test_upgrade_child_not_ready_keeps_old_process(child, listener, monkeypatch):
+    monkeypatch.setenv("CHILD_READY", "0")
+    monkeypatch.setattr(proxy_server, "UPGRADE_TIMEOUT", 2)
+    assert not proxy_server.upgrade({"socks5.0": listener})
+    assert proxy_server.stats_writer == "writer"
+    assert not (child / "proxy.pid").exists()